@@ -0,0 +1,175 @@
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.future import select
+from starlette.concurrency import run_in_threadpool
+from .models import ArchivedPartition, MessageType
+from . import ciphertext
+
+# Cold archive for old message partitions.
+#
+# Each archived partition becomes a directory with one gzipped JSON-lines
+# file per chat, rows in (created_at, id) order:
+#
+#   ARCHIVE_DIR/messages_p2024_01/<chat_id>.jsonl.gz
+#
+# so reading one chat's old history opens one small file. Archived ranges
+# are listed in message_archives; every archived range ends at or before
+# boundary(), and history queries only ask Postgres for rows after it.
+# Archived messages are read-only: delete_message refuses them.
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+ARCHIVE_CACHE_TTL = float(os.getenv("ARCHIVE_CACHE_TTL", "60"))
+
+# Same fields (and attribute access) as the history query's column rows.
+# Files hold bodies as text, so the binary columns are always empty.
+ArchivedMessage = namedtuple("ArchivedMessage", [
+    "id", "chat_id", "sender_id", "content", "type", "created_at", "reply_to_id", "blob_id",
+    "reply_content", "reply_sender_id", "reply_type",
+    "iv", "ciphertext", "reply_iv", "reply_ciphertext",
+], defaults=(None, None, None, None))
+
+EXPORT_QUERY = """
+    SELECT m.id, m.chat_id, m.sender_id, m.content, m.iv, m.ciphertext, m.type::text AS type, m.created_at,
+           m.reply_to_id, m.blob_id,
+           r.content AS reply_content, r.iv AS reply_iv, r.ciphertext AS reply_ciphertext,
+           r.sender_id AS reply_sender_id, r.type::text AS reply_type
+    FROM {partition} m
+    LEFT JOIN messages r ON r.id = m.reply_to_id
+    ORDER BY m.chat_id, m.created_at, m.id
+"""
+
+
+def _decode(line: bytes) -> ArchivedMessage:
+    row = json.loads(line)
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    row["type"] = MessageType(row["type"])
+    if row["reply_type"]:
+        row["reply_type"] = MessageType(row["reply_type"])
+    return ArchivedMessage(**row)
+
+
+class MessageArchive:
+    def __init__(self, root: str, cache_ttl: float):
+        self.root = root
+        self.cache_ttl = cache_ttl
+        self._ranges = None
+        self._loaded_at = 0.0
+
+    def _chat_path(self, partition: str, chat_id: str) -> str:
+        return os.path.join(self.root, partition, f"{chat_id}.jsonl.gz")
+
+    async def ranges(self, db) -> list:
+        # (name, start, end) newest first; cached per worker
+        if self._ranges is None or time.monotonic() - self._loaded_at > self.cache_ttl:
+            result = await db.execute(
+                select(ArchivedPartition.name, ArchivedPartition.range_start, ArchivedPartition.range_end)
+                .order_by(ArchivedPartition.range_end.desc())
+            )
+            self._ranges = [tuple(r) for r in result.all()]
+            self._loaded_at = time.monotonic()
+        return self._ranges
+
+    async def boundary(self, db) -> Optional[datetime]:
+        ranges = await self.ranges(db)
+        return ranges[0][2] if ranges else None
+
+    def _read_file(self, path: str) -> list:
+        try:
+            with gzip.open(path, "rb") as f:
+                return [_decode(line) for line in f]
+        except FileNotFoundError:
+            return []
+
+    async def read(self, db, chat_id: str, limit: int, before=None, after=None) -> list:
+        # Up to `limit` archived messages strictly before/after a (created_at, id)
+        # position: newest first for `before` (or no cursor), oldest first for `after`
+        ranges = await self.ranges(db)
+        if after is not None:
+            ranges = [r for r in reversed(ranges) if r[2] > after[0]]
+        elif before is not None:
+            ranges = [r for r in ranges if r[1] is None or r[1] <= before[0]]
+        rows = []
+        for name, _, _ in ranges:
+            chunk = await run_in_threadpool(self._read_file, self._chat_path(name, chat_id))
+            if after is not None:
+                rows.extend(m for m in chunk if (m.created_at, m.id) > after)
+            else:
+                chunk.reverse()
+                rows.extend(m for m in chunk if before is None or (m.created_at, m.id) < before)
+            if len(rows) >= limit:
+                break
+        return rows[:limit]
+
+    async def find(self, db, chat_id: str, message_id: str) -> Optional[ArchivedMessage]:
+        # Scans the chat's file in every archived month; only for rare paths
+        for name, _, _ in await self.ranges(db):
+            chunk = await run_in_threadpool(self._read_file, self._chat_path(name, chat_id))
+            for m in chunk:
+                if m.id == message_id:
+                    return m
+        return None
+
+    async def export_partition(self, engine, name: str, start, end) -> int:
+        # Files are written to a temp dir and renamed into place, then the
+        # range is recorded; re-running after a crash just redoes both
+        final_dir = os.path.join(self.root, name)
+        tmp_dir = final_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        count = 0
+        current_chat, out = None, None
+        try:
+            async with engine.connect() as conn:
+                result = await conn.stream(text(EXPORT_QUERY.format(partition=name)))
+                # Runs from the maintenance CLI, so plain blocking file IO is fine
+                async for row in result:
+                    if row.chat_id != current_chat:
+                        if out:
+                            out.close()
+                        current_chat = row.chat_id
+                        out = gzip.open(self._chat_path(name + ".tmp", current_chat), "wb")
+                    record = row._asdict()
+                    record["content"] = ciphertext.text(record["content"], record.pop("iv"), record.pop("ciphertext"))
+                    record["reply_content"] = ciphertext.text(
+                        record["reply_content"], record.pop("reply_iv"), record.pop("reply_ciphertext")
+                    )
+                    record["created_at"] = row.created_at.isoformat()
+                    line = json.dumps(record) + "\n"
+                    out.write(line.encode("utf-8"))
+                    count += 1
+        finally:
+            if out:
+                out.close()
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+        async with engine.begin() as conn:
+            stmt = pg_insert(ArchivedPartition).values(
+                name=name, range_start=start, range_end=end, path=final_dir, row_count=count
+            )
+            await conn.execute(stmt.on_conflict_do_update(
+                index_elements=[ArchivedPartition.name],
+                set_={"path": stmt.excluded.path, "row_count": stmt.excluded.row_count},
+            ))
+        return count
+
+    async def delete_chat(self, chat_id: str):
+        def remove():
+            for path in glob.glob(os.path.join(glob.escape(self.root), "*", f"{glob.escape(chat_id)}.jsonl.gz")):
+                os.unlink(path)
+        try:
+            await run_in_threadpool(remove)
+        except OSError as e:
+            print(f"Archive delete error: {e}")
+
+
+message_archive = MessageArchive(ARCHIVE_DIR, ARCHIVE_CACHE_TTL)
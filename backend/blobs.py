@@ -0,0 +1,169 @@
+import abc
+import hashlib
+import os
+import re
+import tempfile
+from typing import AsyncIterator, Optional
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+# Content-addressed storage for encrypted attachments (IMAGE messages).
+#
+# The server only ever sees ciphertext; a blob's id is the SHA-256 of its
+# bytes, so identical uploads are stored once and a blob never changes.
+# BlobStore is the backend interface; LocalBlobStore keeps blobs on disk.
+#
+# Nothing unlinks a blob inline. Deleting a message or a chat only drops
+# chat_blobs rows; the collect_blobs job (backend/tasks.py) later removes
+# rows no message uses and files no row uses. Because a blob is shared by
+# content, an upload of the same bytes can race that pass, so both sides
+# hold lock() for the blob: uploads and sends shared, the collector
+# exclusive, and the collector re-checks references once it has the lock.
+
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+BLOB_DIR = os.getenv("BLOB_DIR", "data/blobs")
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(10 * 1024 * 1024)))
+# Uploads and files younger than this are never collected
+BLOB_GC_GRACE = float(os.getenv("BLOB_GC_GRACE", str(24 * 3600)))
+BLOB_GC_INTERVAL = float(os.getenv("BLOB_GC_INTERVAL", "3600"))
+BLOB_LOCK_SPACE = 727012  # first key of the two-key advisory locks, per blob
+CHUNK_SIZE = 64 * 1024
+
+BLOB_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobStore(abc.ABC):
+    # Store a stream, return (blob_id, size)
+    @abc.abstractmethod
+    async def write(self, chunks: AsyncIterator[bytes], max_size: int) -> tuple[str, int]:
+        ...
+
+    # Size in bytes, or None if the blob does not exist
+    @abc.abstractmethod
+    async def size(self, blob_id: str) -> Optional[int]:
+        ...
+
+    # Stream bytes start..end inclusive
+    @abc.abstractmethod
+    def read(self, blob_id: str, start: int, end: int) -> AsyncIterator[bytes]:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, blob_id: str):
+        ...
+
+    # Ids of stored blobs last written before `older_than` (a unix time)
+    @abc.abstractmethod
+    def ids(self, older_than: float) -> AsyncIterator[str]:
+        ...
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, blob_id: str) -> str:
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    async def write(self, chunks, max_size):
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLarge()
+                    digest.update(chunk)
+                    await run_in_threadpool(f.write, chunk)
+            blob_id = digest.hexdigest()
+            await run_in_threadpool(self._commit, tmp_path, self._path(blob_id))
+            return blob_id, size
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @staticmethod
+    def _commit(tmp_path: str, path: str):
+        try:
+            # Same content already stored: refresh it, so the collector's
+            # grace period starts over
+            os.utime(path)
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    async def size(self, blob_id):
+        try:
+            return (await run_in_threadpool(os.stat, self._path(blob_id))).st_size
+        except FileNotFoundError:
+            return None
+
+    async def read(self, blob_id, start, end):
+        f = await run_in_threadpool(open, self._path(blob_id), "rb")
+        try:
+            await run_in_threadpool(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_in_threadpool(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    async def delete(self, blob_id):
+        try:
+            await run_in_threadpool(os.unlink, self._path(blob_id))
+        except FileNotFoundError:
+            pass
+
+    def _ids_in(self, prefix: str, older_than: float) -> list[str]:
+        found = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, prefix)):
+            for name in filenames:
+                if BLOB_ID_RE.match(name):
+                    try:
+                        if os.stat(os.path.join(dirpath, name)).st_mtime < older_than:
+                            found.append(name)
+                    except FileNotFoundError:
+                        pass
+        return found
+
+    async def ids(self, older_than):
+        # One top-level directory (1/256 of the ids) per thread hop
+        try:
+            prefixes = sorted(await run_in_threadpool(os.listdir, self.root))
+        except FileNotFoundError:
+            return
+        for prefix in prefixes:
+            if len(prefix) != 2:
+                continue  # tmp/
+            for blob_id in await run_in_threadpool(self._ids_in, prefix, older_than):
+                yield blob_id
+
+
+async def lock(db, blob_ids, shared: bool = True):
+    # Transaction-scoped per-blob locks, taken in order so they can't deadlock
+    fn = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+    for blob_id in sorted(set(blob_ids)):
+        await db.execute(text(f"SELECT {fn}(:space, hashtext(:id))"), {"space": BLOB_LOCK_SPACE, "id": blob_id})
+
+
+def _make_store() -> BlobStore:
+    if BLOB_BACKEND == "local":
+        return LocalBlobStore(BLOB_DIR)
+    raise ValueError(f"Unknown BLOB_BACKEND: {BLOB_BACKEND}")
+
+
+blob_store = _make_store()
@@ -0,0 +1,68 @@
+import base64
+import binascii
+import os
+from typing import Optional
+
+# Binary storage for encrypted message bodies.
+#
+# Clients send a message body as `iv:ciphertext`, two base64 strings, which
+# costs a third more than the bytes themselves on disk, in the buffer cache
+# and on the wire. With MESSAGE_STORAGE=binary new messages keep the two
+# halves decoded in messages.iv / messages.ciphertext (bytea) and content is
+# NULL; existing rows are converted in batches by the convert_ciphertext job
+# (backend/tasks.py). Bodies that wouldn't survive the round trip unchanged
+# (plain emoji, anything not canonical base64) stay text.
+#
+# Conversion happens here only, at the API edge. JSON responses always carry
+# `content`; clients that send Accept: application/msgpack get `iv` and
+# `ciphertext` as raw bytes instead (see backend/responses.py).
+
+MESSAGE_STORAGE = os.getenv("MESSAGE_STORAGE", "text").lower()
+BINARY_STORAGE = MESSAGE_STORAGE == "binary"
+
+
+def split(content: Optional[str]) -> Optional[tuple[bytes, bytes]]:
+    # (iv, ciphertext), or None if content isn't exactly `base64:base64`
+    if not content or content.count(":") != 1:
+        return None
+    iv_text, ciphertext_text = content.split(":")
+    try:
+        iv = base64.b64decode(iv_text, validate=True)
+        ciphertext = base64.b64decode(ciphertext_text, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not iv or not ciphertext or join(iv, ciphertext) != content:
+        return None
+    return iv, ciphertext
+
+
+def join(iv: bytes, ciphertext: bytes) -> str:
+    return base64.b64encode(iv).decode("ascii") + ":" + base64.b64encode(ciphertext).decode("ascii")
+
+
+def columns(content: str) -> dict:
+    # Column values for a new message in the configured storage mode
+    parts = split(content) if BINARY_STORAGE else None
+    if parts is None:
+        return {"content": content, "iv": None, "ciphertext": None}
+    return {"content": None, "iv": parts[0], "ciphertext": parts[1]}
+
+
+def text(content: Optional[str], iv: Optional[bytes], ciphertext: Optional[bytes]) -> Optional[str]:
+    # The body as clients sent it, whichever way the row stores it
+    if content is not None or iv is None:
+        return content
+    return join(iv, ciphertext)
+
+
+def fields(content: Optional[str], iv: Optional[bytes], ciphertext: Optional[bytes], binary: bool) -> dict:
+    # Response fields for a body: `content` for JSON; for msgpack, raw `iv`
+    # and `ciphertext` whenever the body is an encrypted pair
+    if not binary:
+        return {"content": text(content, iv, ciphertext)}
+    if iv is None:
+        parts = split(content)
+        if parts is None:
+            return {"content": content}
+        iv, ciphertext = parts
+    return {"content": None, "iv": bytes(iv), "ciphertext": bytes(ciphertext)}
@@ -0,0 +1,140 @@
+import asyncio
+import base64
+import io
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import pyotp
+import qrcode
+import qrcode.image.svg
+
+# CPU-bound helpers and the pool they run on.
+#
+# QR rendering (pure Python + Pillow) takes tens of milliseconds and would
+# stall every other request on the worker if run inside a handler, so it
+# goes to a small process pool (CPU_POOL=thread for a thread pool). The pool
+# is bounded: once CPU_POOL_MAX_PENDING calls are queued or running, new ones
+# are refused with PoolSaturated instead of piling up. This module is
+# imported by the pool's child processes, so keep its imports light.
+
+CPU_POOL_KIND = os.getenv("CPU_POOL", "process")
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", "2"))
+CPU_POOL_MAX_PENDING = int(os.getenv("CPU_POOL_MAX_PENDING", "64"))
+# Event-loop lag probe: how often to sample, and when to complain
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "100"))
+
+
+# --- work functions (top level so they pickle into child processes) ---
+
+def render_qr(data: str, fmt: str = "png") -> str:
+    # Returns a data: URL ready for <img src>
+    if fmt == "svg":
+        img = qrcode.make(data, image_factory=qrcode.image.svg.SvgPathImage)
+        return "data:image/svg+xml;base64," + base64.b64encode(img.to_string()).decode("ascii")
+    buf = io.BytesIO()
+    qrcode.make(data).save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def verify_totp(secret: str, code: str) -> bool:
+    return pyotp.TOTP(secret).verify(code, valid_window=1)
+
+
+# --- pool ---
+
+class PoolSaturated(Exception):
+    pass
+
+
+class CpuPool:
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Executor = None
+        self.pending = 0  # queue depth: submitted and not yet finished
+        self.completed = 0
+        self.rejected = 0
+
+    def _make_executor(self) -> Executor:
+        if self.kind == "process":
+            # spawn, not fork: the parent has an event loop and open sockets
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="cpu")
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolSaturated()
+        if self._executor is None:
+            self._executor = self._make_executor()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    async def start(self):
+        if self._executor is None:
+            self._executor = self._make_executor()
+
+    async def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+cpu_pool = CpuPool(CPU_POOL_KIND, CPU_POOL_WORKERS, CPU_POOL_MAX_PENDING)
+
+
+# --- event-loop lag ---
+
+class LoopLagMonitor:
+    # Sleeps for a fixed interval and records how late it woke up: the time
+    # the loop was busy running something else
+    def __init__(self, interval: float, warn_ms: float):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_ms = max(0.0, (loop.time() - started - self.interval) * 1000)
+            self.max_ms = max(self.max_ms, self.last_ms)
+            if self.last_ms > self.warn_ms:
+                print(f"Event loop lag: {self.last_ms:.0f}ms (cpu pool pending {cpu_pool.pending})")
+
+    def stats(self) -> dict:
+        return {"last_ms": round(self.last_ms, 1), "max_ms": round(self.max_ms, 1)}
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+loop_lag = LoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_WARN_MS)
@@ -3,13 +3,12 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
-from .database import get_db
+from .database import get_db, AsyncSessionLocal, ReadSessionLocal, engine, replica_engine, recent_writes
 from .models import User
 from sqlalchemy.future import select
-from datetime import datetime, timezone
 
-# Import Redis client
-from .redis_client import redis_client
+from .user_cache import user_cache, CachedUser
+from .presence import presence
 
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -26,16 +25,14 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def authenticate_token(token: str, db: AsyncSession):
+    # Shared by the HTTP dependency below and the /ws handshake
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    # Check Redis cache for user presence/data (Optional optimization: cache user object)
-    # For now, we just use Redis to TRACK presence
-    
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -44,25 +41,42 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     except JWTError:
         raise credentials_exception
     
-    # 1. Fetch user (DB cache is tricky with asyncpg+sqlalchemy object detachment, so we keep DB fetch for safety)
-    # But we CAN cache simple ID mapping if needed. For now, DB fetch is fast enough for <1k users.
-    result = await db.execute(select(User).filter(User.username == username))
-    user = result.scalars().first()
+    # 1. Resolve the user: detached snapshot from the in-process cache,
+    # falling back to the DB on a miss. Endpoints that modify the user load
+    # their own ORM instance by id.
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        result = await db.execute(select(User).filter(User.username == username))
+        db_user = result.scalars().first()
+        if db_user is None:
+            raise credentials_exception
+        user = CachedUser.from_orm(db_user)
+        user_cache.set(username, user)
+    return user
 
-    # 2. Update Redis Presence
-    # Key: user:last_seen:{user_id} -> timestamp ISO string
-    # Key: user:online:{user_id} -> "1" (expires in 5 mins)
+def token_expires_at(token: str):
+    # `exp` of a token authenticate_token has already accepted, or None
     try:
-        now_iso = datetime.now(timezone.utc).isoformat()
-        pipe = redis_client.pipeline()
-        pipe.set(f"user:last_seen:{user.id}", now_iso)
-        pipe.set(f"user:online:{user.id}", "1", ex=45) # 45 seconds online window
-        await pipe.execute()
-    except Exception as e:
-        print(f"Redis error in deps: {e}")
-        # Don't fail request if Redis is down
-        pass
+        return jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_token(token, db)
+    # Lets the primary session attribute its writes to this user (replica lag guard)
+    db.info["user_id"] = user.id
+
+    # 2. Record presence: an in-memory heartbeat, flushed to Redis in batches
+    presence.touch(user.id)
 
     return user
+
+
+async def get_read_db(current_user = Depends(get_current_user)):
+    # Read-only endpoints go to the replica, except right after the caller
+    # wrote something, so they always see their own writes.
+    factory = ReadSessionLocal
+    if replica_engine is engine or await recent_writes.is_fresh(current_user.id):
+        factory = AsyncSessionLocal
+    async with factory() as session:
+        yield session
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import time
+from typing import Optional
+from fastapi import Request
+from .redis_client import redis_client
+from .database import engine, replica_engine, DB_READ_AFTER_WRITE_WINDOW
+
+# Conditional GET for the polled endpoints.
+#
+# Write paths stamp a version marker in Redis after they commit: one per chat
+# (its history changed) and one per user (their chat list changed). The
+# value is the bump time in ns, so a Redis flush can't make an old ETag
+# match again. Readers fetch the markers before querying and answer
+# If-None-Match with 304 when they still match.
+#
+# Markers are read before the data, so a response is never tagged newer
+# than its contents. With a replica, markers younger than the replica lag
+# window produce no ETag, since the replica may not have the change yet.
+
+CHAT_VERSION = "ver:chat:{}"
+CHAT_LIST_VERSION = "ver:chats:{}"
+VERSION_TTL = int(os.getenv("ETAG_VERSION_TTL", str(7 * 24 * 3600)))
+# Presence (is_online / last_seen) in the chat list is only re-sent this often
+PRESENCE_BUCKET = int(os.getenv("ETAG_PRESENCE_BUCKET", "30"))
+# Browsers keep the body and revalidate it on every request
+REVALIDATE = "private, no-cache"
+# For responses whose URL already names the version of its contents
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+async def bump(chat_ids=(), user_ids=()) -> int:
+    version = time.time_ns()
+    keys = [CHAT_VERSION.format(c) for c in set(chat_ids)] + [CHAT_LIST_VERSION.format(u) for u in set(user_ids)]
+    if not keys:
+        return version
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, version, ex=VERSION_TTL)
+        await pipe.execute()
+    except Exception as e:
+        print(f"ETag version error: {e}")
+    return version
+
+
+async def versions(*keys) -> Optional[list[int]]:
+    # None when there is nothing safe to compare against
+    try:
+        values = await redis_client.mget(keys)
+        missing = [k for k, v in zip(keys, values) if v is None]
+        if missing:
+            # Start tracking now; the next request gets an ETag
+            pipe = redis_client.pipeline(transaction=False)
+            for key in missing:
+                pipe.set(key, time.time_ns(), ex=VERSION_TTL, nx=True)
+            await pipe.execute()
+            return None
+        return [int(v) for v in values]
+    except Exception as e:
+        print(f"ETag version error: {e}")
+        return None
+
+
+def make_etag(markers: Optional[list[int]], *parts) -> Optional[str]:
+    if markers is None:
+        return None
+    if replica_engine is not engine and time.time_ns() - max(markers) < DB_READ_AFTER_WRITE_WINDOW * 1e9:
+        return None
+    digest = hashlib.sha1("|".join(map(str, (*markers, *parts))).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, etag: Optional[str]) -> bool:
+    header = request.headers.get("if-none-match")
+    if not etag or not header:
+        return False
+    # Weak comparison: W/ prefixes are ignored
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+from .redis_client import redis_client
+
+# Redis-backed queue for deferred work.
+#
+#   jobs:ready      list of job ids waiting for a worker
+#   jobs:delayed    zset, id -> when it becomes ready (retries back off here)
+#   jobs:running    zset, id -> visibility deadline
+#   jobs:dead       list of ids that used up their attempts
+#   jobs:job:{id}   hash: type, payload, attempts, max_attempts, error, claim
+#
+# Claiming moves a job from ready to running with a deadline
+# JOB_VISIBILITY_TIMEOUT ahead. A worker that dies mid-job just lets the
+# deadline pass and the job is claimed again, so handlers must be
+# idempotent; long ones call job.heartbeat() to push the deadline out.
+# Every claim gets its own token, and heartbeats, completion and failure
+# only count while it is still the job's current claim: a worker that
+# overran its deadline can't finish a job someone else now holds.
+# A failing job is retried with exponential backoff, then parked in
+# jobs:dead; so is one whose claims keep expiring.
+#
+# Handlers are registered with @job_queue.handler("type") (see
+# backend/tasks.py). Workers run inside the app (JOB_WORKERS per process,
+# 0 to disable) or standalone: python -m backend.tasks
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+
+READY_KEY = "jobs:ready"
+DELAYED_KEY = "jobs:delayed"
+RUNNING_KEY = "jobs:running"
+DEAD_KEY = "jobs:dead"
+STATS_KEY = "jobs:stats"
+JOB_KEY = "jobs:job:{}"
+SCHEDULE_KEY = "jobs:schedule:{}"
+
+# KEYS: ready, delayed, running, dead, stats
+# ARGV: now, deadline, job key prefix, default max_attempts, claim token
+# Promotes due retries and expired claims, then claims the oldest ready job.
+# An expired claim already counted as an attempt (attempts go up on claim),
+# so one that has used up max_attempts is dead-lettered instead: a job that
+# keeps killing its worker can't come back forever.
+CLAIM = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, id in ipairs(due) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('LPUSH', KEYS[1], id)
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], id)
+    local key = ARGV[3] .. id
+    local state = redis.call('HMGET', key, 'attempts', 'max_attempts')
+    redis.call('HDEL', key, 'claim')
+    if tonumber(state[1] or 0) >= tonumber(state[2] or ARGV[4]) then
+        redis.call('HSET', key, 'error', 'visibility timeout expired')
+        redis.call('LPUSH', KEYS[4], id)
+        redis.call('HINCRBY', KEYS[5], 'dead_lettered', 1)
+    else
+        redis.call('LPUSH', KEYS[1], id)
+        redis.call('HINCRBY', KEYS[5], 'retried', 1)
+    end
+end
+local id = redis.call('RPOP', KEYS[1])
+if not id then
+    return nil
+end
+redis.call('ZADD', KEYS[3], ARGV[2], id)
+local key = ARGV[3] .. id
+local attempts = redis.call('HINCRBY', key, 'attempts', 1)
+redis.call('HSET', key, 'claim', ARGV[5])
+local fields = redis.call('HMGET', key, 'type', 'payload', 'max_attempts')
+return {id, fields[1], fields[2], attempts, fields[3]}
+"""
+
+# KEYS: running, job key, stats; ARGV: id, claim token
+COMPLETE = """
+if redis.call('HGET', KEYS[2], 'claim') ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+redis.call('HINCRBY', KEYS[3], 'completed', 1)
+return 1
+"""
+
+# KEYS: running, job key, stats, dead, delayed
+# ARGV: id, claim token, error, retry at (empty: attempts used up)
+FAIL = """
+if redis.call('HGET', KEYS[2], 'claim') ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'error', ARGV[3])
+redis.call('HDEL', KEYS[2], 'claim')
+if ARGV[4] == '' then
+    redis.call('LPUSH', KEYS[4], ARGV[1])
+    redis.call('HINCRBY', KEYS[3], 'dead_lettered', 1)
+else
+    redis.call('ZADD', KEYS[5], ARGV[4], ARGV[1])
+    redis.call('HINCRBY', KEYS[3], 'retried', 1)
+end
+return 1
+"""
+
+# KEYS: running, job key; ARGV: id, claim token, deadline
+EXTEND = """
+if redis.call('HGET', KEYS[2], 'claim') ~= ARGV[2] then
+    return 0
+end
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', ARGV[3], ARGV[1])
+"""
+
+
+@dataclass
+class Job:
+    id: str
+    type: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+    claim: str
+    queue: "JobQueue"
+
+    async def heartbeat(self) -> bool:
+        # False once the claim has expired and the job may be running elsewhere
+        return await self.queue.extend(self)
+
+
+class JobQueue:
+    def __init__(self, workers: int, poll_interval: float, visibility_timeout: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self._claim = redis_client.register_script(CLAIM)
+        self._complete = redis_client.register_script(COMPLETE)
+        self._fail = redis_client.register_script(FAIL)
+        self._extend = redis_client.register_script(EXTEND)
+        self._handlers = {}
+        self._schedules = {}
+        self._tasks = []
+
+    def handler(self, job_type: str):
+        def register(fn):
+            self._handlers[job_type] = fn
+            return fn
+        return register
+
+    def every(self, job_type: str, interval: float, payload: Optional[dict] = None):
+        # Enqueued once per interval across all processes
+        self._schedules[job_type] = (interval, payload or {})
+
+    async def enqueue(self, job_type: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> Optional[str]:
+        # Returns None if Redis is unavailable; callers that must not lose
+        # work have a sweep job to catch up (see backend/tasks.py)
+        job_id = str(uuid.uuid4())
+        try:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.hset(JOB_KEY.format(job_id), mapping={
+                "type": job_type,
+                "payload": json.dumps(payload),
+                "attempts": 0,
+                "max_attempts": max_attempts,
+            })
+            pipe.lpush(READY_KEY, job_id)
+            pipe.hincrby(STATS_KEY, "enqueued", 1)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Job enqueue error: {e}")
+            return None
+        return job_id
+
+    async def claim(self) -> Optional[Job]:
+        now = time.time()
+        claim = uuid.uuid4().hex
+        row = await self._claim(
+            keys=[READY_KEY, DELAYED_KEY, RUNNING_KEY, DEAD_KEY, STATS_KEY],
+            args=[now, now + self.visibility_timeout, JOB_KEY.format(""), JOB_MAX_ATTEMPTS, claim],
+        )
+        if row is None:
+            return None
+        job_id, job_type, payload, attempts, max_attempts = row
+        return Job(
+            id=job_id,
+            type=job_type,
+            payload=json.loads(payload) if payload else {},
+            attempts=int(attempts),
+            max_attempts=int(max_attempts or JOB_MAX_ATTEMPTS),
+            claim=claim,
+            queue=self,
+        )
+
+    async def extend(self, job: Job) -> bool:
+        deadline = time.time() + self.visibility_timeout
+        return bool(await self._extend(
+            keys=[RUNNING_KEY, JOB_KEY.format(job.id)], args=[job.id, job.claim, deadline],
+        ))
+
+    async def complete(self, job: Job):
+        if not await self._complete(
+            keys=[RUNNING_KEY, JOB_KEY.format(job.id), STATS_KEY], args=[job.id, job.claim],
+        ):
+            print(f"Job {job.type} {job.id} finished after its claim expired; left to the new claim")
+
+    async def fail(self, job: Job, error: str):
+        retry_at = ""
+        if job.attempts < job.max_attempts:
+            retry_at = time.time() + JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        if not await self._fail(
+            keys=[RUNNING_KEY, JOB_KEY.format(job.id), STATS_KEY, DEAD_KEY, DELAYED_KEY],
+            args=[job.id, job.claim, error, retry_at],
+        ):
+            print(f"Job {job.type} {job.id} failed after its claim expired; left to the new claim")
+
+    async def _run(self, job: Job):
+        fn = self._handlers.get(job.type)
+        try:
+            if fn is None:
+                raise LookupError(f"no handler for job type {job.type!r}")
+            await fn(job)
+        except asyncio.CancelledError:
+            raise  # shutting down: the visibility timeout hands it to someone else
+        except Exception as e:
+            print(f"Job {job.type} {job.id} failed (attempt {job.attempts}/{job.max_attempts}): {e!r}")
+            await self.fail(job, repr(e))
+            return
+        await self.complete(job)
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self.claim()
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job queue error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _schedule(self):
+        while True:
+            for job_type, (interval, payload) in self._schedules.items():
+                try:
+                    if await redis_client.set(SCHEDULE_KEY.format(job_type), 1, nx=True, ex=max(1, int(interval))):
+                        await self.enqueue(job_type, payload)
+                except Exception as e:
+                    print(f"Job schedule error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def stats(self) -> dict:
+        # Queue depth and lifetime counters, shared by all processes
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.llen(READY_KEY)
+        pipe.zcard(DELAYED_KEY)
+        pipe.zcard(RUNNING_KEY)
+        pipe.llen(DEAD_KEY)
+        pipe.hgetall(STATS_KEY)
+        ready, delayed, running, dead, counters = await pipe.execute()
+        return {
+            "ready": ready,
+            "delayed": delayed,
+            "running": running,
+            "dead": dead,
+            **{name: int(value) for name, value in counters.items()},
+        }
+
+    async def start(self, workers: Optional[int] = None):
+        workers = self.workers if workers is None else workers
+        if workers <= 0:
+            return
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(workers)]
+        self._tasks.append(asyncio.create_task(self._schedule()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_POLL_INTERVAL, JOB_VISIBILITY_TIMEOUT)
@@ -1,36 +1,46 @@
 from fastapi import FastAPI
 import os
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import auth, users, chats
+from .routers import auth, users, chats, blobs, ws, sync, metrics
 
 from contextlib import asynccontextmanager
-from .database import engine, Base
-from sqlalchemy import text
+from .migrations import migrate, RUN_MIGRATIONS
+from .realtime import manager
+from .presence import presence
+from .cpu import cpu_pool, loop_lag
+from .partitions import partition_maintainer
+from .jobs import job_queue
+from . import tasks  # registers the job handlers
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        # Migrate: add new columns to existing tables if they don't exist
-        try:
-            await conn.execute(text(
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT FALSE"
-            ))
-            await conn.execute(text(
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_url TEXT"
-            ))
-            await conn.execute(text(
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS encrypted_private_key TEXT"
-            ))
-            await conn.execute(text(
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS key_salt TEXT"
-            ))
-        except Exception as e:
-            print(f"Migration note: {e}")
+    # Schema changes live in backend/migrations.py; with RUN_MIGRATIONS off
+    # the app boots and runs without touching DDL (run `python -m
+    # backend.migrations` and `python -m backend.partitions` instead).
+    # Migrations that lock hot tables only run from that command.
+    if RUN_MIGRATIONS:
+        await migrate(at_boot=True)
+    await cpu_pool.start()
+    await loop_lag.start()
+    await manager.start()
+    await presence.start()
+    if RUN_MIGRATIONS:
+        await partition_maintainer.start()
+    await job_queue.start()
     yield
+    await job_queue.stop()
+    await partition_maintainer.stop()
+    await presence.stop()
+    await manager.stop()
+    await loop_lag.stop()
+    await cpu_pool.stop()
 
 app = FastAPI(title="Secure Drop Messenger", lifespan=lifespan)
 
+# Added before ProxyHeadersMiddleware so it runs inside it and sees the real client IP
+from .ratelimit import RateLimitMiddleware
+app.add_middleware(RateLimitMiddleware)
+
 # Trust forwarded headers from Caddy (X-Forwarded-Proto, X-Forwarded-For)
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts="*")
@@ -41,11 +51,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Sync-Cursor"],
 )
 
+# Outermost, so request latency includes every other middleware
+from .metrics import MetricsMiddleware
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(chats.router, prefix="/chats", tags=["chats"])
+app.include_router(blobs.router, prefix="/chats", tags=["blobs"])
+app.include_router(ws.router, tags=["realtime"])
+app.include_router(sync.router, tags=["sync"])
+app.include_router(metrics.router, tags=["metrics"])
 # Messages are handled under chats usually, but we can have direct access if needed
 # app.include_router(messages.router, prefix="/messages", tags=["messages"])
 
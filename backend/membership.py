@@ -0,0 +1,156 @@
+import os
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .models import Chat, ChatParticipant
+from .redis_client import redis_client
+
+# Chat membership index in Redis.
+#
+#   chat:{id}:members   user ids in the chat
+#   user:{id}:chats     chat ids the user is in
+#
+# Sets are filled lazily from Postgres and always hold a "" marker, so a key
+# that exists is the complete set. Participants only change when a chat is
+# created or deleted: create_chat writes the chat's set and adds it to the
+# users' sets that are loaded; delete_chat replaces the chat's set with the
+# bare marker, and fills skip soft-deleted chats. Fills only write keys that
+# don't exist yet, so a fill racing a delete can't bring the old members
+# back. The TTL bounds anything else that slips through. With Redis down
+# every lookup falls back to Postgres.
+
+MEMBERSHIP_TTL = int(os.getenv("MEMBERSHIP_TTL", "86400"))
+CHAT_MEMBERS = "chat:{}:members"
+USER_CHATS = "user:{}:chats"
+LOADED = ""
+
+# KEYS[1] = set, ARGV = ttl, members...
+FILL = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('SADD', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# KEYS = sets, ARGV[1] = member; sets that aren't loaded stay that way
+ADD_IF_LOADED = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('SADD', key, ARGV[1])
+    end
+end
+return 0
+"""
+
+
+class MembershipIndex:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._fill = redis_client.register_script(FILL)
+        self._add = redis_client.register_script(ADD_IF_LOADED)
+        self.hits = 0
+        self.misses = 0
+
+    async def _read(self, keys) -> list:
+        # None for a set that isn't loaded
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.smembers(key)
+            sets = await pipe.execute()
+        except Exception as e:
+            print(f"Membership index error: {e}")
+            return [None] * len(keys)
+        return [s - {LOADED} if s else None for s in sets]
+
+    async def _store(self, sets: dict):
+        # Empty results are not stored: unknown chat ids shouldn't fill Redis
+        sets = {key: members for key, members in sets.items() if members}
+        if not sets:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, members in sets.items():
+                await self._fill(keys=[key], args=[self.ttl, LOADED, *members], client=pipe)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Membership index error: {e}")
+
+    async def members_many(self, db: AsyncSession, chat_ids) -> dict[str, set]:
+        chat_ids = list(set(chat_ids))
+        cached = await self._read([CHAT_MEMBERS.format(c) for c in chat_ids])
+        found = {c: members for c, members in zip(chat_ids, cached) if members is not None}
+        missing = [c for c in chat_ids if c not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            result = await db.execute(
+                select(ChatParticipant.chat_id, ChatParticipant.user_id)
+                .join(Chat, Chat.id == ChatParticipant.chat_id)
+                .where(ChatParticipant.chat_id.in_(missing), Chat.deleted_at.is_(None))
+            )
+            loaded = {c: set() for c in missing}
+            for row in result.all():
+                loaded[row.chat_id].add(row.user_id)
+            await self._store({CHAT_MEMBERS.format(c): members for c, members in loaded.items()})
+            found.update(loaded)
+        return found
+
+    async def members(self, db: AsyncSession, chat_id: str) -> set:
+        return (await self.members_many(db, [chat_id]))[chat_id]
+
+    async def require_member(self, db: AsyncSession, chat_id: str, user_id: str) -> set:
+        # The authorization check for every chat endpoint; returns all members,
+        # which are usually the recipients of whatever the caller does next
+        members = await self.members(db, chat_id)
+        if user_id not in members:
+            raise HTTPException(status_code=403, detail="Вы не участник этого чата")
+        return members
+
+    async def user_chats(self, db: AsyncSession, user_id: str) -> set:
+        key = USER_CHATS.format(user_id)
+        chats = (await self._read([key]))[0]
+        if chats is not None:
+            self.hits += 1
+            return chats
+        self.misses += 1
+        result = await db.execute(
+            select(ChatParticipant.chat_id)
+            .join(Chat, Chat.id == ChatParticipant.chat_id)
+            .where(ChatParticipant.user_id == user_id, Chat.deleted_at.is_(None))
+        )
+        chats = set(result.scalars().all())
+        await self._store({key: chats})
+        return chats
+
+    async def chat_created(self, chat_id: str, user_ids):
+        # After the commit that created the chat
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            await self._fill(keys=[CHAT_MEMBERS.format(chat_id)], args=[self.ttl, LOADED, *user_ids], client=pipe)
+            await self._add(keys=[USER_CHATS.format(u) for u in user_ids], args=[chat_id], client=pipe)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Membership index error: {e}")
+
+    async def chat_deleted(self, chat_id: str, user_ids):
+        # After the commit that deleted the chat: leave an empty, loaded set
+        key = CHAT_MEMBERS.format(chat_id)
+        try:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.sadd(key, LOADED)
+            pipe.expire(key, self.ttl)
+            for uid in user_ids:
+                pipe.srem(USER_CHATS.format(uid), chat_id)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Membership index error: {e}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+membership = MembershipIndex(MEMBERSHIP_TTL)
@@ -0,0 +1,222 @@
+import bisect
+import os
+import time
+from contextvars import ContextVar
+
+# Prometheus metrics, served at GET /metrics (backend/routers/metrics.py).
+#
+# A small in-process registry that writes the text exposition format, so
+# there is nothing extra to install: counters, gauges and histograms with
+# labels. This module imports nothing from the app, so the database and
+# Redis clients can record into it. Caddy doesn't route /metrics; scrape
+# the backend directly (backend:8000/metrics). METRICS_ENABLED=false turns
+# the HTTP middleware and the endpoint off.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels):
+        # Mirrors a running total a component keeps itself (see the collector)
+        self._values[labels] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        # [per-bucket counts..., +Inf count, sum]; cumulated at render time
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, state in self._values.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                total += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        # async fn() run before each scrape to refresh gauges from stats()
+        self._collectors.append(fn)
+        return fn
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    async def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                await fn()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"),
+)
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being served")
+http_sql_queries = registry.histogram(
+    "http_request_sql_queries", "SQL statements executed per HTTP request", ("method", "route"), COUNT_BUCKETS,
+)
+sql_statements = registry.histogram(
+    "db_statement_duration_seconds", "SQL statement latency by engine and verb", ("engine", "verb"), FAST_BUCKETS,
+)
+db_checkout_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("engine",), FAST_BUCKETS,
+)
+db_checkout_timeouts = registry.counter(
+    "db_pool_checkout_timeouts_total", "Pool checkouts that gave up after DB_POOL_TIMEOUT", ("engine",),
+)
+redis_commands = registry.histogram(
+    "redis_command_duration_seconds", "Redis command (or pipeline) latency", ("command",), FAST_BUCKETS,
+)
+redis_errors = registry.counter("redis_errors_total", "Redis commands that raised", ("command",))
+
+# Per-request SQL statement counter, set by the HTTP middleware; the engine
+# hooks run in SQLAlchemy's greenlet, which shares the request's context
+request_queries: ContextVar = ContextVar("request_queries", default=None)
+
+
+def observe_statement(engine_name: str, statement: str, seconds: float):
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    if verb not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+        verb = "OTHER"
+    sql_statements.observe(seconds, engine_name, verb)
+    counter = request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def _route_template(scope) -> str:
+    # /chats/abc/messages -> /chats/{chat_id}/messages, rebuilt from the path
+    # params so it doesn't depend on how FastAPI nests included routers
+    if scope.get("route") is None:
+        return "unmatched"
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join("{" + names[part] + "}" if part in names else part for part in scope["path"].split("/"))
+
+
+class MetricsMiddleware:
+    # Pure ASGI (like RateLimitMiddleware). Routes are labelled by their
+    # template, so label sets stay bounded.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        queries = [0]
+        token = request_queries.set(queries)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            request_queries.reset(token)
+            path = _route_template(scope)
+            if path != "/metrics":
+                http_requests.observe(time.perf_counter() - started, scope["method"], path, status)
+                http_sql_queries.observe(queries[0], scope["method"], path)
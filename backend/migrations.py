@@ -0,0 +1,501 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import text
+from .database import engine
+from .partitions import is_partitioned, ensure_partitions, month_start, add_months
+
+# Versioned schema migrations.
+#
+# Each migration runs once and is recorded in schema_migrations. The runner
+# holds a Postgres advisory lock for the whole run, so when several workers
+# boot at once one migrates and the rest poll for the lock, then find
+# nothing to do.
+# Transactional migrations are applied and recorded atomically; the
+# non-transactional ones (CREATE INDEX CONCURRENTLY) run in autocommit and
+# must be idempotent, since a crash can leave them half done. Migrations
+# that would lock hot tables for long on a populated database are only
+# applied by the command below, never by the app at boot.
+#
+# Every statement below is written to be safe on databases that were
+# upgraded by the old ALTER-on-startup code, so existing installs simply
+# record the versions. The DDL is spelled out as of each version rather
+# than taken from backend/models.py: the live models describe the latest
+# schema, and a migration built from them changes meaning as they evolve.
+#
+#   python -m backend.migrations            apply pending migrations
+#   python -m backend.migrations --status   list applied / pending
+
+# Run migrations from the app lifespan; turn off when they run as a deploy step
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "true").lower() in ("1", "true", "yes", "on")
+MIGRATION_LOCK_ID = 727011  # arbitrary, shared by every process of this app
+MIGRATION_LOCK_POLL = float(os.getenv("MIGRATION_LOCK_POLL", "1"))
+# How long a migration waits for a table lock before failing (Postgres syntax)
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "10s")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[..., Awaitable[None]]
+    transactional: bool = True
+    # Migrations that lock hot tables: given a connection, says whether this
+    # database needs it run as a deploy step. The app then refuses to apply
+    # it at boot; `python -m backend.migrations` always does.
+    deploy_step: Optional[Callable[..., Awaitable[bool]]] = None
+
+
+async def _execute(conn, *statements):
+    for statement in statements:
+        await conn.execute(text(statement))
+
+
+async def _create_index_concurrently(conn, name: str, ddl: str):
+    # A failed concurrent build leaves an INVALID index that IF NOT EXISTS
+    # would happily skip, so drop it first and rebuild. A valid one is left
+    # alone: Postgres refuses CONCURRENTLY on partitioned tables even when
+    # the index is already there.
+    result = await conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"
+    ), {"name": name})
+    valid = result.scalar()
+    if valid:
+        return
+    if valid is False:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    await conn.execute(text(ddl))
+
+
+# The schema as the app's startup create_all left it before migrations existed
+BASELINE = (
+    """
+    DO $$ BEGIN
+        CREATE TYPE messagetype AS ENUM ('TEXT', 'IMAGE', 'EMOJI');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        username VARCHAR NOT NULL,
+        totp_secret VARCHAR,
+        public_key VARCHAR,
+        is_verified BOOLEAN NOT NULL,
+        avatar_url TEXT,
+        encrypted_private_key TEXT,
+        key_salt TEXT,
+        created_at TIMESTAMPTZ
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+    """
+    CREATE TABLE IF NOT EXISTS chats (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        created_at TIMESTAMPTZ,
+        created_by VARCHAR REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_participants (
+        chat_id VARCHAR NOT NULL REFERENCES chats (id),
+        user_id VARCHAR NOT NULL REFERENCES users (id),
+        PRIMARY KEY (chat_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        chat_id VARCHAR NOT NULL REFERENCES chats (id),
+        sender_id VARCHAR NOT NULL REFERENCES users (id),
+        content TEXT NOT NULL,
+        type messagetype,
+        created_at TIMESTAMPTZ,
+        read_at TIMESTAMPTZ,
+        reply_to_id VARCHAR REFERENCES messages (id)
+    )
+    """,
+)
+
+
+async def _initial(conn):
+    # Trigram operator class used by the username search index
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await _execute(conn, *BASELINE)
+
+
+async def _user_profile_columns(conn):
+    await _execute(
+        conn,
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_url TEXT",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS encrypted_private_key TEXT",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS key_salt TEXT",
+    )
+
+
+async def _chat_summary(conn):
+    await _execute(
+        conn,
+        # No FK: messages gets partitioned in 9 and its id alone can't be referenced
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_id VARCHAR",
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        # Backfill the chat summary for chats that predate it
+        """
+        UPDATE chats c SET last_message_id = m.id, last_activity_at = m.created_at
+        FROM chats c2
+        CROSS JOIN LATERAL (
+            SELECT id, created_at FROM messages
+            WHERE chat_id = c2.id
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ) m
+        WHERE c.id = c2.id AND c.last_message_id IS NULL
+        """,
+        "UPDATE chats SET last_activity_at = created_at "
+        "WHERE last_message_id IS NULL AND last_activity_at IS DISTINCT FROM created_at",
+    )
+
+
+async def _read_watermarks(conn):
+    await _execute(
+        conn,
+        "ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS last_read_at TIMESTAMPTZ",
+        "ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS last_read_message_id VARCHAR",
+        # Seed read watermarks from the legacy per-message read_at receipts
+        """
+        UPDATE chat_participants cp SET last_read_at = m.created_at, last_read_message_id = m.id
+        FROM chat_participants cp2
+        CROSS JOIN LATERAL (
+            SELECT id, created_at FROM messages
+            WHERE chat_id = cp2.chat_id AND sender_id <> cp2.user_id AND read_at IS NOT NULL
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ) m
+        WHERE cp.chat_id = cp2.chat_id AND cp.user_id = cp2.user_id AND cp.last_read_at IS NULL
+        """,
+    )
+
+
+async def _message_blobs(conn):
+    await _execute(
+        conn,
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS blob_id VARCHAR(64)",
+        """
+        CREATE TABLE IF NOT EXISTS chat_blobs (
+            chat_id VARCHAR NOT NULL REFERENCES chats (id),
+            blob_id VARCHAR(64) NOT NULL,
+            size BIGINT NOT NULL,
+            uploader_id VARCHAR NOT NULL REFERENCES users (id),
+            created_at TIMESTAMPTZ,
+            PRIMARY KEY (chat_id, blob_id)
+        )
+        """,
+    )
+
+
+async def _direct_chat_key(conn):
+    await _execute(
+        conn,
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS direct_key VARCHAR",
+        # Key existing 1:1 chats; if the old create path ever duplicated a
+        # pair, the oldest chat gets the key and the others stay unkeyed.
+        """
+        UPDATE chats c SET direct_key = d.k
+        FROM (
+            SELECT DISTINCT ON (p.k) p.chat_id, p.k
+            FROM (
+                SELECT chat_id, string_agg(user_id, ':' ORDER BY user_id) AS k
+                FROM chat_participants GROUP BY chat_id HAVING count(*) = 2
+            ) p
+            JOIN chats c2 ON c2.id = p.chat_id
+            ORDER BY p.k, c2.created_at
+        ) d
+        WHERE c.id = d.chat_id AND c.direct_key IS NULL
+          AND NOT EXISTS (SELECT 1 FROM chats c3 WHERE c3.direct_key = d.k)
+        """,
+    )
+
+
+async def _hot_path_indexes(conn):
+    # Built without blocking writes to these tables
+    for name, ddl in (
+        ("ix_messages_chat_created_id",
+         "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_chat_created_id ON messages (chat_id, created_at, id)"),
+        ("ix_chats_last_activity_at",
+         "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chats_last_activity_at ON chats (last_activity_at)"),
+        ("ix_chat_participants_user_id",
+         "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_participants_user_id ON chat_participants (user_id)"),
+        ("ix_chats_direct_key",
+         "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_chats_direct_key ON chats (direct_key)"),
+        ("ix_users_username_trgm",
+         "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops)"),
+        ("ix_users_username_prefix",
+         "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_prefix ON users (lower(username) text_pattern_ops)"),
+    ):
+        await _create_index_concurrently(conn, name, ddl)
+
+
+async def _sync_log(conn):
+    await _execute(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS sync_sequences (
+            user_id VARCHAR NOT NULL PRIMARY KEY REFERENCES users (id),
+            seq BIGINT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sync_events (
+            user_id VARCHAR NOT NULL REFERENCES users (id),
+            seq BIGINT NOT NULL,
+            type VARCHAR NOT NULL,
+            chat_id VARCHAR,
+            payload JSON NOT NULL,
+            created_at TIMESTAMPTZ,
+            PRIMARY KEY (user_id, seq)
+        )
+        """,
+    )
+
+
+async def _legacy_messages(conn) -> bool:
+    # True while messages is still a heap with rows in it
+    if await is_partitioned(conn):
+        return False
+    return (await conn.execute(text("SELECT EXISTS (SELECT 1 FROM messages)"))).scalar()
+
+
+async def _partition_messages(conn):
+    # A heap with rows becomes messages_legacy, attached as the partition for
+    # everything before next month without copying it. An empty heap (a
+    # fresh database) is simply dropped.
+    #
+    # Locks: the swap at the end takes ACCESS EXCLUSIVE on messages (and
+    # briefly on chats, for its FK) in one short transaction, which blocks
+    # every read and write of messages while it runs. Everything that scans
+    # the table happens before it, without blocking writes: the range CHECK
+    # is added NOT VALID and validated under SHARE UPDATE EXCLUSIVE, and the
+    # new primary key's index is built concurrently. With both in place
+    # SET NOT NULL and ATTACH PARTITION skip their scans and the existing
+    # indexes are attached as they are, so the swap is catalog work only.
+    # It gives up after MIGRATION_LOCK_TIMEOUT rather than queue behind long
+    # queries with every other session queued behind it; run it again then.
+    # On a database with messages it only runs as a deploy step.
+    #
+    # Non-transactional: each step is safe to repeat after a crash, and the
+    # swap is all-or-nothing.
+    await _execute(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS message_archives (
+            name VARCHAR NOT NULL PRIMARY KEY,
+            range_start TIMESTAMPTZ,
+            range_end TIMESTAMPTZ NOT NULL,
+            path VARCHAR NOT NULL,
+            row_count BIGINT NOT NULL,
+            archived_at TIMESTAMPTZ
+        )
+        """,
+    )
+    if await is_partitioned(conn):
+        await ensure_partitions(conn)
+        return
+    legacy = await _legacy_messages(conn)
+    if legacy:
+        await _execute(conn, "UPDATE messages SET created_at = now() WHERE created_at IS NULL")
+        newest = (await conn.execute(text("SELECT max(created_at) FROM messages"))).scalar()
+        cutoff = add_months(month_start(max(filter(None, (newest, datetime.now(timezone.utc))))), 1)
+        await _execute(conn, f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+        try:
+            await _execute(
+                conn,
+                # Also backs SET NOT NULL below; re-added in case an earlier
+                # attempt picked another month
+                "ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_legacy_range",
+                "ALTER TABLE messages ADD CONSTRAINT messages_legacy_range "
+                f"CHECK (created_at IS NOT NULL AND created_at < '{cutoff.isoformat()}') NOT VALID",
+            )
+        finally:
+            await _execute(conn, "RESET lock_timeout")
+        await _execute(conn, "ALTER TABLE messages VALIDATE CONSTRAINT messages_legacy_range")
+        await _create_index_concurrently(
+            conn, "ix_messages_legacy_id_created_at",
+            "CREATE UNIQUE INDEX CONCURRENTLY ix_messages_legacy_id_created_at ON messages (id, created_at)",
+        )
+
+    async with conn.engine.begin() as swap:
+        await _execute(swap, f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+        await _execute(
+            swap,
+            # FKs can't point at a partitioned table's id alone
+            "ALTER TABLE chats DROP CONSTRAINT IF EXISTS fk_chats_last_message_id",
+            "ALTER TABLE chats DROP CONSTRAINT IF EXISTS chats_last_message_id_fkey",
+            "ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_reply_to_id_fkey",
+            "ALTER TABLE messages RENAME TO messages_legacy",
+            "ALTER INDEX IF EXISTS ix_messages_chat_created_id RENAME TO ix_messages_legacy_chat_created_id",
+            "ALTER TABLE messages_legacy DROP CONSTRAINT IF EXISTS messages_pkey",
+        )
+        if legacy:
+            await _execute(
+                swap,
+                "ALTER TABLE messages_legacy ALTER COLUMN created_at SET NOT NULL",
+                # ATTACH only reuses an index that backs a matching constraint
+                "ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_pkey "
+                "PRIMARY KEY USING INDEX ix_messages_legacy_id_created_at",
+            )
+        else:
+            await _execute(swap, "DROP TABLE messages_legacy")
+        # The new parent has exactly the columns messages has at this
+        # version, or the ATTACH would refuse the legacy table
+        await _execute(
+            swap,
+            """
+            CREATE TABLE messages (
+                id VARCHAR NOT NULL,
+                chat_id VARCHAR NOT NULL REFERENCES chats (id),
+                sender_id VARCHAR NOT NULL REFERENCES users (id),
+                content TEXT NOT NULL,
+                type messagetype,
+                created_at TIMESTAMPTZ NOT NULL,
+                read_at TIMESTAMPTZ,
+                reply_to_id VARCHAR,
+                blob_id VARCHAR(64),
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+            """,
+            "CREATE INDEX ix_messages_chat_created_id ON messages (chat_id, created_at, id)",
+        )
+        if legacy:
+            await _execute(
+                swap,
+                f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ('{cutoff.isoformat()}')",
+                "ALTER TABLE messages_legacy DROP CONSTRAINT messages_legacy_range",
+            )
+        await ensure_partitions(swap)
+
+
+async def _chat_soft_delete(conn):
+    await _execute(conn, "ALTER TABLE chats ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ")
+
+
+async def _binary_ciphertext(conn):
+    # Catalog-only changes (no default, no rewrite), cascaded to every partition.
+    # Existing rows are converted later in batches (backend/tasks.py).
+    await _execute(
+        conn,
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS iv BYTEA",
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS ciphertext BYTEA",
+        "ALTER TABLE messages ALTER COLUMN content DROP NOT NULL",
+    )
+
+
+async def _sync_event_retention(conn):
+    await _create_index_concurrently(
+        conn, "ix_sync_events_created_at",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sync_events_created_at ON sync_events (created_at)",
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "initial", _initial),
+    Migration(2, "user_profile_columns", _user_profile_columns),
+    Migration(3, "chat_summary", _chat_summary),
+    Migration(4, "read_watermarks", _read_watermarks),
+    Migration(5, "message_blobs", _message_blobs),
+    Migration(6, "direct_chat_key", _direct_chat_key),
+    Migration(7, "hot_path_indexes", _hot_path_indexes, transactional=False),
+    Migration(8, "sync_log", _sync_log),
+    Migration(9, "partition_messages", _partition_messages, transactional=False, deploy_step=_legacy_messages),
+    Migration(10, "chat_soft_delete", _chat_soft_delete),
+    Migration(11, "binary_ciphertext", _binary_ciphertext),
+    Migration(12, "sync_event_retention", _sync_event_retention, transactional=False),
+]
+
+
+async def _applied_versions(conn) -> set[int]:
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+        "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    ))
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    return set(result.scalars().all())
+
+
+async def _record(conn, migration: Migration):
+    await conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n) ON CONFLICT DO NOTHING"),
+        {"v": migration.version, "n": migration.name},
+    )
+
+
+async def migrate(target_engine=engine, at_boot: bool = False) -> list[int]:
+    applied_now = []
+    async with target_engine.connect() as lock_conn:
+        # Session-level lock on its own autocommit connection, so it spans
+        # the per-migration transactions below
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Poll rather than block in pg_advisory_lock: a waiter stuck inside
+        # that statement holds a snapshot, and CREATE INDEX CONCURRENTLY in
+        # the migrating worker waits for every older snapshot to go away,
+        # a deadlock Postgres can't see
+        while not (await lock_conn.execute(
+            text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}
+        )).scalar():
+            await asyncio.sleep(MIGRATION_LOCK_POLL)
+        try:
+            applied = await _applied_versions(lock_conn)
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                if at_boot and migration.deploy_step:
+                    async with target_engine.connect() as conn:
+                        if await migration.deploy_step(conn):
+                            raise RuntimeError(
+                                f"Migration {migration.version} {migration.name} locks tables on this "
+                                "database; apply it with `python -m backend.migrations` first"
+                            )
+                print(f"Applying migration {migration.version} {migration.name}")
+                if migration.transactional:
+                    async with target_engine.begin() as conn:
+                        await migration.apply(conn)
+                        await _record(conn, migration)
+                else:
+                    async with target_engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await migration.apply(conn)
+                        await _record(conn, migration)
+                applied_now.append(migration.version)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    return applied_now
+
+
+async def status(target_engine=engine) -> list[tuple[Migration, bool]]:
+    async with target_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        applied = await _applied_versions(conn)
+    return [(m, m.version in applied) for m in MIGRATIONS]
+
+
+async def _main(args):
+    try:
+        if args.status:
+            for migration, done in await status():
+                print(f"{migration.version:>4} {migration.name:<24} {'applied' if done else 'pending'}")
+        else:
+            versions = await migrate()
+            print(f"Applied {len(versions)} migration(s)" if versions else "Schema is up to date")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Secure Drop schema migrations")
+    parser.add_argument("--status", action="store_true", help="show applied and pending migrations")
+    asyncio.run(_main(parser.parse_args()))
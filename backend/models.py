@@ -1,9 +1,8 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Enum, Boolean
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, BigInteger, DateTime, ForeignKey, Text, Enum, Boolean, Index, JSON, LargeBinary
 from sqlalchemy.orm import relationship
 import enum
+import hashlib
 import uuid
-from datetime import datetime
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -31,14 +30,50 @@ class User(Base):
     chats = relationship("ChatParticipant", back_populates="user")
     sent_messages = relationship("Message", back_populates="sender")
 
+    @property
+    def key_version(self):
+        return public_key_version(self.public_key)
+
+    __table_args__ = (
+        # Username search: trigram index for substring matches, pattern-ops
+        # btree for short prefix queries (both on lower(username))
+        Index("ix_users_username_trgm", func.lower(username).label("lower_username"),
+              postgresql_using="gin", postgresql_ops={"lower_username": "gin_trgm_ops"}),
+        Index("ix_users_username_prefix", func.lower(username).label("lower_username"),
+              postgresql_ops={"lower_username": "text_pattern_ops"}),
+    )
+
+def direct_chat_key(user_a: str, user_b: str) -> str:
+    return ":".join(sorted((user_a, user_b)))
+
+def public_key_version(public_key):
+    # Derived from the key itself, so it changes exactly when the key is
+    # rotated and needs no bookkeeping on the write paths
+    if not public_key:
+        return None
+    return hashlib.sha1(public_key.encode()).hexdigest()[:16]
+
 class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     created_at = Column(DateTime(timezone=True), default=func.now())
 
+    # Denormalized summary, maintained by the message write paths in the same
+    # transaction so the chat list never has to aggregate over messages.
+    # No FK: messages is partitioned, so its id alone can't be referenced.
+    last_message_id = Column(String, nullable=True)
+    last_activity_at = Column(DateTime(timezone=True), default=func.now(), nullable=False, index=True)
+    # Canonical "<smaller user id>:<larger user id>" for 1:1 chats; unique, so
+    # lookups are one index probe and concurrent creates cannot duplicate.
+    direct_key = Column(String, nullable=True, unique=True, index=True)
+    # Set by delete_chat; the chat is hidden at once and a purge_chat job
+    # (backend/tasks.py) removes its rows afterwards
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+
     participants = relationship("ChatParticipant", back_populates="chat")
-    messages = relationship("Message", back_populates="chat")
+    messages = relationship("Message", back_populates="chat", foreign_keys="Message.chat_id")
+    last_message = relationship("Message", primaryjoin="foreign(Chat.last_message_id) == Message.id", viewonly=True)
     created_by = Column(String, ForeignKey("users.id"), nullable=True) # Creator of the chat
 
 class ChatParticipant(Base):
@@ -47,21 +82,96 @@ class ChatParticipant(Base):
     chat_id = Column(String, ForeignKey("chats.id"), primary_key=True)
     user_id = Column(String, ForeignKey("users.id"), primary_key=True)
 
+    # Read watermark: every message at or before (last_read_at, last_read_message_id)
+    # in (created_at, id) order has been read by this participant.
+    last_read_at = Column(DateTime(timezone=True), nullable=True)
+    last_read_message_id = Column(String, nullable=True)
+
     chat = relationship("Chat", back_populates="participants")
     user = relationship("User", back_populates="chats")
 
+    __table_args__ = (
+        # The PK leads with chat_id; "my chats" lookups need user_id first
+        Index("ix_chat_participants_user_id", "user_id"),
+    )
+
 class Message(Base):
+    # Range-partitioned by month on created_at (see backend/partitions.py);
+    # the partition key has to be part of the primary key.
     __tablename__ = "messages"
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     chat_id = Column(String, ForeignKey("chats.id"), nullable=False)
     sender_id = Column(String, ForeignKey("users.id"), nullable=False)
-    content = Column(Text, nullable=False) # Encrypted content
+    content = Column(Text, nullable=True) # Encrypted content, `iv:ciphertext` in base64
+    # MESSAGE_STORAGE=binary keeps the two halves decoded here instead and
+    # leaves content NULL (see backend/ciphertext.py)
+    iv = Column(LargeBinary, nullable=True)
+    ciphertext = Column(LargeBinary, nullable=True)
     type = Column(Enum(MessageType), default=MessageType.TEXT)
-    created_at = Column(DateTime(timezone=True), default=func.now())
-    read_at = Column(DateTime(timezone=True), nullable=True) # Read receipt
-    reply_to_id = Column(String, ForeignKey("messages.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), primary_key=True, default=func.now())
+    read_at = Column(DateTime(timezone=True), nullable=True) # Legacy per-row receipt, superseded by ChatParticipant watermarks
+    reply_to_id = Column(String, nullable=True)  # no FK, see last_message_id
+    # IMAGE payloads live in the blob store; the row only references them
+    blob_id = Column(String(64), nullable=True)
 
-    chat = relationship("Chat", back_populates="messages")
+    chat = relationship("Chat", back_populates="messages", foreign_keys=[chat_id])
     sender = relationship("User", back_populates="sent_messages")
-    reply_to = relationship("Message", remote_side=[id], backref="replies")
+    reply_to = relationship(
+        "Message", primaryjoin="foreign(Message.reply_to_id) == remote(Message.id)", backref="replies"
+    )
+
+    __table_args__ = (
+        # Keyset pagination of chat history walks this index in both directions
+        Index("ix_messages_chat_created_id", "chat_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class ChatBlob(Base):
+    # Which chat a stored blob was uploaded to; downloads are authorized by
+    # chat membership plus this row, never by knowing the hash alone.
+    __tablename__ = "chat_blobs"
+
+    chat_id = Column(String, ForeignKey("chats.id"), primary_key=True)
+    blob_id = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    uploader_id = Column(String, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+class SyncSequence(Base):
+    # Per-user event counter. Bumped by the write transaction that records
+    # the event, so the row lock keeps each user's sequence gap-free and in
+    # commit order.
+    __tablename__ = "sync_sequences"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    seq = Column(BigInteger, nullable=False, default=0)
+
+class SyncEvent(Base):
+    # Per-user change log read by GET /sync?since=<seq>; the PK serves the
+    # "everything after seq" range scan.
+    __tablename__ = "sync_events"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    seq = Column(BigInteger, primary_key=True)
+    type = Column(String, nullable=False)
+    chat_id = Column(String, nullable=True)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+    __table_args__ = (
+        # Retention: prune_sync_events deletes the oldest events first
+        Index("ix_sync_events_created_at", "created_at"),
+    )
+
+class ArchivedPartition(Base):
+    # A month of messages moved out of Postgres into compressed files
+    # (backend/archive.py); history reads fall back to them.
+    __tablename__ = "message_archives"
+
+    name = Column(String, primary_key=True)
+    range_start = Column(DateTime(timezone=True), nullable=True)  # NULL: everything before range_end
+    range_end = Column(DateTime(timezone=True), nullable=False)
+    path = Column(String, nullable=False)
+    row_count = Column(BigInteger, nullable=False, default=0)
+    archived_at = Column(DateTime(timezone=True), default=func.now())
@@ -0,0 +1,32 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+
+# Opaque keyset cursors: clients must treat them as black boxes and only echo
+# them back. Internally a cursor is the sort key of a row, JSON encoded and
+# base64url'd, e.g. (created_at, id) for messages.
+
+def encode_cursor(*parts) -> str:
+    raw = json.dumps([p.isoformat() if isinstance(p, datetime) else p for p in parts], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    if not isinstance(parts, list) or len(parts) != size:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    return parts
+
+
+def decode_time_cursor(cursor: str):
+    # (created_at, id) cursor used by message history
+    created_at, row_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(created_at), str(row_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import text
+from .database import engine
+from .archive import message_archive
+
+# Monthly range partitions of the messages table.
+#
+# Partitions are named messages_pYYYY_MM and cover [month start, next month
+# start) in UTC. A database converted from the unpartitioned table keeps
+# its old rows in messages_legacy, covering everything before the first
+# month. PartitionMaintainer (started from the lifespan) keeps the current
+# month and PARTITION_PREMAKE_MONTHS ahead created; inserts have nowhere to
+# go without them.
+#
+# Archiving is a separate, heavier job run from cron:
+#
+#   python -m backend.partitions             create upcoming partitions
+#   python -m backend.partitions --archive   also archive old partitions
+#
+# Partitions that ended more than ARCHIVE_AFTER_MONTHS ago are exported to
+# compressed files, recorded in message_archives, then detached and dropped.
+
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "3600"))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+MAINTENANCE_LOCK_ID = 727012
+
+_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \('([^']+)'\)")
+
+
+def month_start(dt: datetime) -> datetime:
+    dt = dt.astimezone(timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(dt: datetime, months: int) -> datetime:
+    index = dt.year * 12 + dt.month - 1 + months
+    return dt.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"messages_p{start:%Y_%m}"
+
+
+def _parse_bound(value: str) -> datetime:
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+async def is_partitioned(conn) -> bool:
+    result = await conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages')"
+    ))
+    return result.scalar() is not None
+
+
+async def list_partitions(conn) -> list[tuple[str, Optional[datetime], datetime]]:
+    # (name, start or None for MINVALUE, end), oldest first
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'messages'::regclass"
+    ))
+    partitions = []
+    for name, bound in result.all():
+        match = _BOUND_RE.search(bound or "")
+        if not match:
+            continue
+        start = None if match.group(1) == "MINVALUE" else _parse_bound(match.group(1).strip("'"))
+        partitions.append((name, start, _parse_bound(match.group(2))))
+    partitions.sort(key=lambda p: p[2])
+    return partitions
+
+
+async def ensure_partitions(conn, now: Optional[datetime] = None) -> list[str]:
+    # Creates missing partitions from the current month up to the premake horizon
+    now = now or datetime.now(timezone.utc)
+    existing = await list_partitions(conn)
+    covered = existing[-1][2] if existing else None
+    start = max(month_start(now), covered) if covered else month_start(now)
+    horizon = add_months(month_start(now), PARTITION_PREMAKE_MONTHS + 1)
+    created = []
+    while start < horizon:
+        end = add_months(start, 1)
+        name = partition_name(start)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        created.append(name)
+        start = end
+    return created
+
+
+async def archive_old_partitions(target_engine=engine, now: Optional[datetime] = None) -> list[str]:
+    now = now or datetime.now(timezone.utc)
+    cutoff = add_months(month_start(now), -ARCHIVE_AFTER_MONTHS)
+    async with target_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        partitions = [p for p in await list_partitions(conn) if p[2] <= cutoff]
+    archived = []
+    for name, start, end in partitions:
+        # Export and record first: once recorded, reads stop asking Postgres
+        # for that range, so detaching afterwards never hides rows.
+        await message_archive.export_partition(target_engine, name, start, end)
+        await asyncio.sleep(message_archive.cache_ttl)  # let workers pick up the new range
+        async with target_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name} CONCURRENTLY"))
+            await conn.execute(text(f"DROP TABLE {name}"))
+        print(f"Archived partition {name}")
+        archived.append(name)
+    return archived
+
+
+async def _with_lock(fn):
+    # Only one process does maintenance at a time; others skip the round
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        locked = (await lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID})).scalar()
+        if not locked:
+            return None
+        try:
+            return await fn()
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+
+
+async def maintain_partitions():
+    async def run():
+        async with engine.begin() as conn:
+            if await is_partitioned(conn):
+                return await ensure_partitions(conn)
+    return await _with_lock(run)
+
+
+class PartitionMaintainer:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await maintain_partitions()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Partition maintenance error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if engine.dialect.name == "postgresql":
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+partition_maintainer = PartitionMaintainer(PARTITION_CHECK_INTERVAL)
+
+
+async def _main(args):
+    try:
+        print(f"Partitions ensured: {await maintain_partitions()}")
+        if args.archive:
+            archived = await _with_lock(archive_old_partitions)
+            print(f"Archived: {archived}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Messages partition maintenance")
+    parser.add_argument("--archive", action="store_true", help=f"archive partitions older than {ARCHIVE_AFTER_MONTHS} months")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from .redis_client import redis_client
+
+# Presence tracking.
+#
+# Requests only record a heartbeat in memory; a background task flushes the
+# pending heartbeats to Redis with a single ZADD every PRESENCE_FLUSH_INTERVAL
+# seconds, and a user is re-flushed at most once per PRESENCE_WRITE_INTERVAL.
+# All presence lives in one sorted set (member = user id, score = last seen
+# epoch seconds), so a whole chat list is resolved with one ZMSCORE.
+
+PRESENCE_KEY = "presence:last_seen"
+ONLINE_WINDOW = int(os.getenv("PRESENCE_ONLINE_WINDOW", "45"))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "2"))
+PRESENCE_WRITE_INTERVAL = float(os.getenv("PRESENCE_WRITE_INTERVAL", "10"))
+
+
+class PresenceTracker:
+    def __init__(self):
+        self._pending: dict[str, float] = {}
+        self._last_flushed: dict[str, float] = {}
+        self._task = None
+
+    def touch(self, user_id: str):
+        now = time.time()
+        if now - self._last_flushed.get(user_id, 0) < PRESENCE_WRITE_INTERVAL:
+            return
+        self._pending[user_id] = now
+
+    async def flush(self):
+        # Entries older than the write interval no longer throttle anything;
+        # dropping them keeps the map to recently active users
+        cutoff = time.time() - PRESENCE_WRITE_INTERVAL
+        self._last_flushed = {uid: ts for uid, ts in self._last_flushed.items() if ts >= cutoff}
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await redis_client.zadd(PRESENCE_KEY, batch)
+            self._last_flushed.update(batch)
+        except Exception as e:
+            print(f"Presence flush error: {e}")
+            # Keep the newest heartbeats for the next attempt
+            for uid, ts in batch.items():
+                self._pending.setdefault(uid, ts)
+
+    async def lookup(self, user_ids) -> dict:
+        # user_id -> (is_online, last_seen) in a single round trip
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        scores = await redis_client.zmscore(PRESENCE_KEY, user_ids)
+        now = time.time()
+        result = {}
+        for uid, score in zip(user_ids, scores):
+            if score is None:
+                result[uid] = (False, None)
+            else:
+                result[uid] = (now - score < ONLINE_WINDOW, datetime.fromtimestamp(score, tz=timezone.utc))
+        return result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+presence = PresenceTracker()
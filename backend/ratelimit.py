@@ -0,0 +1,128 @@
+import math
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+from jose import JWTError, jwt
+from starlette.responses import JSONResponse
+from .redis_client import redis_client
+from .deps import SECRET_KEY, ALGORITHM
+
+# Rate limiting for hot and expensive endpoints.
+#
+# Token buckets live in Redis and are updated by one Lua script (one round
+# trip, atomic across workers, Redis server clock). Authenticated routes are
+# limited per user (JWT subject, no DB lookup), anonymous ones per client IP
+# as resolved by ProxyHeadersMiddleware. If Redis is down requests pass.
+#
+# Each rule is "<burst>/<seconds>": up to <burst> calls at once, refilled
+# evenly over <seconds>. Override with RATE_LIMIT_<NAME>, e.g.
+# RATE_LIMIT_SEND_MESSAGE=60/10; "off" disables a rule.
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+
+TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    method: str
+    path: re.Pattern
+    by_user: bool
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+def _rule(name: str, method: str, path: str, by_user: bool, default: str) -> Optional[Rule]:
+    spec = os.getenv(f"RATE_LIMIT_{name.upper()}", default).strip().lower()
+    if spec in ("", "off", "0"):
+        return None
+    capacity, _, period = spec.partition("/")
+    return Rule(name, method, re.compile(path), by_user, int(capacity), float(period or 1))
+
+
+RULES = [r for r in (
+    # QR rendering and TOTP checks: per IP, the caller has no token yet
+    _rule("register", "POST", r"^/auth/register$", False, "5/60"),
+    _rule("confirm_registration", "POST", r"^/auth/confirm-registration$", False, "10/60"),
+    _rule("login", "POST", r"^/auth/login$", False, "10/60"),
+    _rule("check_username", "GET", r"^/auth/check$", False, "30/60"),
+    _rule("send_message", "POST", r"^/chats/[^/]+/messages$", True, "30/10"),
+    # Up to 100 messages per call
+    _rule("send_message_batch", "POST", r"^/chats/messages/batch$", True, "5/10"),
+    _rule("search_users", "GET", r"^/users/?$", True, "30/10"),
+) if r is not None]
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, rules=None):
+        self.app = app
+        self.rules = RULES if rules is None else rules
+        self.script = redis_client.register_script(TOKEN_BUCKET)
+
+    def _match(self, scope) -> Optional[Rule]:
+        for rule in self.rules:
+            if scope["method"] == rule.method and rule.path.match(scope["path"]):
+                return rule
+        return None
+
+    @staticmethod
+    def _identity(scope, by_user: bool) -> str:
+        if by_user:
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    scheme, _, token = value.decode("latin-1").partition(" ")
+                    if scheme.lower() == "bearer":
+                        try:
+                            sub = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+                        except JWTError:
+                            sub = None
+                        if sub:
+                            return f"u:{sub}"
+                    break
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def __call__(self, scope, receive, send):
+        rule = self._match(scope) if scope["type"] == "http" and RATE_LIMIT_ENABLED else None
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        key = f"rl:{rule.name}:{self._identity(scope, rule.by_user)}"
+        try:
+            wait_ms = await self.script(keys=[key], args=[rule.capacity, rule.rate])
+        except Exception as e:
+            print(f"Rate limiter error: {e}")
+            wait_ms = 0
+
+        if wait_ms:
+            response = JSONResponse(
+                {"detail": "Слишком много запросов, попробуйте позже"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(int(wait_ms) / 1000)))},
+            )
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
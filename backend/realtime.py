@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+from fastapi import WebSocket, status
+from .redis_client import redis_client
+
+# Real-time delivery over WebSockets.
+#
+# Each uvicorn worker keeps its own sockets in memory and one Redis pub/sub
+# connection. Events are published to a per-user channel (events:user:{id});
+# a worker only subscribes to the channels of users that currently have a
+# socket open on it, so fan-out works across any number of workers/nodes.
+#
+# Every socket has its own bounded send queue drained by its own writer
+# task, so one slow client never holds up delivery to the others. A socket
+# whose queue fills up, or that takes longer than WS_SEND_TIMEOUT over a
+# single send, is closed (1013); the client reconnects and refetches.
+
+USER_CHANNEL = "events:user:{}"
+# Always-subscribed channel so the pub/sub connection exists (and can be
+# read from) even while no sockets are open on this worker.
+BROADCAST_CHANNEL = "events:broadcast"
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+
+class ConnectionManager:
+    def __init__(self):
+        # user id -> socket -> its send queue
+        self.connections: dict[str, dict[WebSocket, asyncio.Queue]] = {}
+        self._writers: dict[WebSocket, asyncio.Task] = {}
+        self._closing = set()
+        self.dropped = 0  # slow sockets closed
+        # Worker-wide channels (e.g. cache invalidation) -> handler(data)
+        self.handlers = {}
+        self.pubsub = None
+        self._task = None
+
+    def on(self, channel: str, handler):
+        # Register before startup; every worker subscribes for its lifetime
+        self.handlers[channel] = handler
+
+    async def start(self):
+        self.pubsub = redis_client.pubsub()
+        await self.pubsub.subscribe(BROADCAST_CHANNEL, *self.handlers)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        for writer in list(self._writers.values()):
+            writer.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.pubsub:
+            await self.pubsub.aclose()
+
+    async def connect(self, user_id: str, websocket: WebSocket):
+        sockets = self.connections.setdefault(user_id, {})
+        queue = sockets[websocket] = asyncio.Queue(WS_SEND_QUEUE)
+        self._writers[websocket] = asyncio.create_task(self._write(user_id, websocket, queue))
+        if len(sockets) == 1 and self.pubsub:
+            await self.pubsub.subscribe(USER_CHANNEL.format(user_id))
+
+    async def disconnect(self, user_id: str, websocket: WebSocket):
+        sockets = self.connections.get(user_id)
+        if not sockets or sockets.pop(websocket, None) is None:
+            return
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+        if not sockets:
+            del self.connections[user_id]
+            if self.pubsub:
+                try:
+                    await self.pubsub.unsubscribe(USER_CHANNEL.format(user_id))
+                except Exception as e:
+                    print(f"Realtime unsubscribe error: {e}")
+
+    async def _deliver(self, user_id: str, data: str):
+        for ws, queue in list(self.connections.get(user_id, {}).items()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                await self._drop(user_id, ws)
+
+    async def _write(self, user_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        while True:
+            data = await queue.get()
+            try:
+                await asyncio.wait_for(websocket.send_text(data), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self._drop(user_id, websocket)
+                return
+            except Exception:
+                # Already gone; the endpoint's receive loop notices too
+                await self.disconnect(user_id, websocket)
+                return
+
+    async def _drop(self, user_id: str, websocket: WebSocket):
+        # Too slow to keep up: stop queueing for it and close it in the
+        # background, so this never waits on the slow client either
+        self.dropped += 1
+        await self.disconnect(user_id, websocket)
+        closing = asyncio.create_task(self._close(websocket))
+        self._closing.add(closing)
+        closing.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=status.WS_1013_TRY_AGAIN_LATER), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _listen(self):
+        while True:
+            try:
+                msg = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if msg is None:
+                    continue
+                channel = msg["channel"]
+                if channel.startswith("events:user:"):
+                    await self._deliver(channel[len("events:user:"):], msg["data"])
+                elif channel in self.handlers:
+                    self.handlers[channel](msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Redis went away: redis-py reconnects and resubscribes on the next read
+                print(f"Realtime listener error: {e}")
+                await asyncio.sleep(1)
+
+
+manager = ConnectionManager()
+
+
+async def publish(user_ids, event_type: str, payload: dict):
+    # Fire-and-forget: a Redis outage must never fail the write that produced the event
+    if not user_ids:
+        return
+    data = json.dumps({"type": event_type, **payload}, default=str)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for uid in set(user_ids):
+            pipe.publish(USER_CHANNEL.format(uid), data)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Realtime publish error: {e}")
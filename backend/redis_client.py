@@ -1,10 +1,43 @@
 import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
 import os
+import time
+from . import metrics
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+
+# Same clients, timing every command (and every pipeline as one round trip)
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except Exception:
+            metrics.redis_errors.inc("PIPELINE")
+            raise
+        finally:
+            metrics.redis_commands.observe(time.perf_counter() - started, "PIPELINE")
+
+
+class InstrumentedRedis(redis.Redis):
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            metrics.redis_errors.inc(command)
+            raise
+        finally:
+            metrics.redis_commands.observe(time.perf_counter() - started, command)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
 # Global Redis client
-redis_client = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+redis_client = InstrumentedRedis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
 
 async def get_redis():
     return redis_client
@@ -0,0 +1,65 @@
+import json
+from datetime import date, datetime
+from enum import Enum
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+# JSON response for the hot list endpoints.
+#
+# Handlers hand it plain dicts built straight from column rows, skipping
+# response_model validation. orjson (extra "fast", locked and installed in
+# the Docker image) encodes datetimes natively and is several times faster;
+# without it the stdlib encoder is used with the same output shape.
+#
+# The message endpoints can also answer in msgpack (extra "binary", also in
+# the image), so ciphertext goes out as raw bytes instead of base64
+# (backend/ciphertext.py).
+# Clients opt in with Accept: application/msgpack; without the package they
+# get JSON as usual.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=_default)
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK
+
+    def render(self, content) -> bytes:
+        # Datetimes as ISO strings, like the JSON responses
+        return msgpack.packb(content, default=_default, use_bin_type=True, datetime=False)
+
+
+def wants_msgpack(request: Request) -> bool:
+    return msgpack is not None and MSGPACK in request.headers.get("accept", "")
+
+
+def negotiated(request: Request, content, **kwargs) -> Response:
+    # Vary so shared caches and the ETag check keep the two encodings apart
+    headers = {**kwargs.pop("headers", {}), "Vary": "Accept"}
+    if wants_msgpack(request):
+        return MsgpackResponse(content, headers=headers, **kwargs)
+    return FastJSONResponse(content, headers=headers, **kwargs)
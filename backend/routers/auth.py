@@ -7,10 +7,10 @@ from ..schemas import UserCreate, Token
 from jose import jwt
 from datetime import datetime, timedelta, timezone
 import pyotp
-import qrcode
-import io
-import base64
+from typing import Literal
 from ..deps import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..user_cache import invalidate_user
+from ..cpu import cpu_pool, PoolSaturated, render_qr, verify_totp
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -21,9 +21,17 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+async def offload(fn, *args):
+    # CPU-bound work runs on the bounded pool, never on the event loop
+    try:
+        return await cpu_pool.run(fn, *args)
+    except PoolSaturated:
+        raise HTTPException(status_code=503, detail="Сервер перегружен, попробуйте позже", headers={"Retry-After": "1"})
+
 # Phase 1: Generate TOTP secret and QR — user NOT created yet
 class UserRegisterStart(BaseModel):
     username: str
+    qr_format: Literal["png", "svg"] = "png"  # SVG is cheaper to render
 
 @router.get("/check")
 async def check_username(username: str, db: AsyncSession = Depends(get_db)):
@@ -42,14 +50,11 @@ async def register(user: UserRegisterStart, db: AsyncSession = Depends(get_db)):
     secret = pyotp.random_base32()
     totp_uri = pyotp.totp.TOTP(secret).provisioning_uri(name=user.username, issuer_name="SecureDrop")
 
-    img = qrcode.make(totp_uri)
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
+    qr_code = await offload(render_qr, totp_uri, user.qr_format)
 
     return {
         "username": user.username,
-        "qr_code": f"data:image/png;base64,{img_base64}",
+        "qr_code": qr_code,
         "secret": secret
     }
 
@@ -67,8 +72,7 @@ class ConfirmRegistration(BaseModel):
 async def confirm_registration(req: ConfirmRegistration, db: AsyncSession = Depends(get_db)):
     req.username = req.username.strip()
     # Verify TOTP code with the secret
-    totp = pyotp.TOTP(req.totp_secret)
-    if not totp.verify(req.totp_code, valid_window=1):
+    if not await offload(verify_totp, req.totp_secret, req.totp_code):
         raise HTTPException(status_code=400, detail="Неверный код. Попробуйте ещё раз")
 
     # Check uniqueness again (race condition guard)
@@ -106,13 +110,13 @@ async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=400, detail="Неверное имя пользователя или код")
 
-    totp = pyotp.TOTP(user.totp_secret)
-    if not totp.verify(request.totp_code, valid_window=1):
+    if not await offload(verify_totp, user.totp_secret, request.totp_code):
         raise HTTPException(status_code=400, detail="Неверный код")
 
     if not user.is_verified:
         user.is_verified = True
         await db.commit()
+        await invalidate_user(user.username)
 
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
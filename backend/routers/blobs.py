@@ -0,0 +1,118 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from ..database import get_db
+from ..models import ChatBlob
+from ..schemas import BlobUploadResponse
+from ..deps import get_current_user
+from ..user_cache import CachedUser
+from ..membership import membership
+from ..blobs import blob_store, lock, BlobTooLarge, BLOB_ID_RE, BLOB_MAX_BYTES
+
+router = APIRouter()
+
+# Blobs are immutable (content-addressed), so clients may cache them forever
+IMMUTABLE_CACHE = "private, max-age=31536000, immutable"
+
+
+def _parse_range(header: str, size: int):
+    # Single "bytes=start-end" range (also "start-" and "-suffix"); None if absent
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # unsupported -> serve the full body
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Диапазон недоступен", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+@router.post("/{chat_id}/blobs", response_model=BlobUploadResponse)
+async def upload_blob(
+    chat_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    await membership.require_member(db, chat_id, current_user.id)
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > BLOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+
+    # Body is the raw ciphertext, streamed to disk without buffering it in memory
+    try:
+        blob_id, size = await blob_store.write(request.stream(), BLOB_MAX_BYTES)
+    except BlobTooLarge:
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Пустой файл")
+
+    # The bytes may have been stored already and collected since; under the
+    # lock the collector can't remove them before this row is committed
+    await lock(db, [blob_id])
+    if await blob_store.size(blob_id) is None:
+        raise HTTPException(status_code=503, detail="Не удалось сохранить файл, повторите загрузку")
+    await db.execute(
+        pg_insert(ChatBlob)
+        .values(chat_id=chat_id, blob_id=blob_id, size=size, uploader_id=current_user.id)
+        .on_conflict_do_nothing(index_elements=["chat_id", "blob_id"])
+    )
+    await db.commit()
+    return {"blob_id": blob_id, "size": size}
+
+
+@router.get("/{chat_id}/blobs/{blob_id}")
+async def download_blob(
+    chat_id: str,
+    blob_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    if not BLOB_ID_RE.match(blob_id):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    await membership.require_member(db, chat_id, current_user.id)
+
+    result = await db.execute(
+        select(ChatBlob.size).where(ChatBlob.chat_id == chat_id, ChatBlob.blob_id == blob_id)
+    )
+    size = result.scalar()
+    if size is None or await blob_store.size(blob_id) is None:
+        raise HTTPException(status_code=404, detail="Файл не найден")
+
+    headers = {
+        "ETag": f'"{blob_id}"',
+        "Cache-Control": IMMUTABLE_CACHE,
+        "Accept-Ranges": "bytes",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        blob_store.read(blob_id, start, end),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
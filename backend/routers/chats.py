@@ -1,25 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, aliased
 from ..database import get_db
-from ..models import Chat, ChatParticipant, User, Message, MessageType
-from ..schemas import ChatCreate, ChatResponse, MessageCreate, MessageResponse, UserResponse
-from ..deps import get_current_user
-from typing import List
-from sqlalchemy import delete as sa_delete
-from datetime import datetime, timezone
-
-# Import Redis
-from ..redis_client import redis_client
+from ..models import Chat, ChatParticipant, ChatBlob, User, Message, MessageType, direct_chat_key, public_key_version
+from ..schemas import ChatCreate, ChatResponse, MessageCreate, MessageResponse, MessageBatch, MessageBatchResult
+from ..deps import get_current_user, get_read_db
+from ..user_cache import CachedUser
+from typing import List, Optional
+from sqlalchemy import update as sa_update, func, or_, tuple_, literal_column, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from ..pagination import encode_cursor, decode_time_cursor
+from datetime import timedelta
+from collections import Counter
+import time
+import uuid
+
+from ..realtime import publish
+from .. import sync, etags, ciphertext
+from ..presence import presence
+from ..responses import FastJSONResponse, negotiated, wants_msgpack
+from ..archive import message_archive
+from ..blobs import lock as lock_blobs
+from ..jobs import job_queue
+from ..membership import membership
+from ..unread import unread
 
 router = APIRouter()
 
+
+def _read_at(sender_id, position, participants):
+    # A message at `position` = (created_at, id) counts as read once a
+    # participant other than its sender has a watermark at or past it
+    for p in participants:
+        if p.user_id == sender_id or p.last_read_at is None:
+            continue
+        if position <= (p.last_read_at, p.last_read_message_id):
+            return p.last_read_at
+    return None
+
+
 @router.post("", response_model=ChatResponse)
 async def create_chat(
     chat_data: ChatCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
     result = await db.execute(select(User).filter(User.username == chat_data.participant_username))
     other_user = result.scalars().first()
@@ -32,36 +57,38 @@ async def create_chat(
     if other_user.id == current_user.id:
         raise HTTPException(status_code=400, detail="Нельзя создать чат с самим собой")
 
-    # Check if chat already exists
-    my_chats = await db.execute(
-        select(Chat)
-        .join(ChatParticipant, Chat.id == ChatParticipant.chat_id)
-        .where(ChatParticipant.user_id == current_user.id)
-        .options(selectinload(Chat.participants))
-    )
-    for existing_chat in my_chats.scalars().all():
-        pids = {p.user_id for p in existing_chat.participants}
-        if other_user.id in pids and len(pids) == 2:
-            result = await db.execute(
-                select(Chat).where(Chat.id == existing_chat.id)
-                .options(selectinload(Chat.participants).selectinload(ChatParticipant.user))
+    # 1:1 chats are unique per pair: one indexed lookup on the canonical key
+    direct_key = direct_chat_key(current_user.id, other_user.id)
+    result = await db.execute(select(Chat.id).where(Chat.direct_key == direct_key))
+    chat_id = result.scalar()
+
+    if chat_id is None:
+        # Race-free create: a concurrent request for the same pair blocks on
+        # the unique key and then gets the winner's row back. xmax = 0 marks
+        # a freshly inserted row. Chat and participants commit together.
+        stmt = pg_insert(Chat).values(created_by=current_user.id, direct_key=direct_key)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Chat.direct_key],
+            set_={"direct_key": stmt.excluded.direct_key},
+        ).returning(Chat.id, literal_column("xmax = 0").label("inserted"))
+        row = (await db.execute(stmt)).one()
+        chat_id = row.id
+        if row.inserted:
+            await db.execute(
+                pg_insert(ChatParticipant)
+                .values([
+                    {"chat_id": chat_id, "user_id": current_user.id},
+                    {"chat_id": chat_id, "user_id": other_user.id},
+                ])
+                .on_conflict_do_nothing()
             )
-            c = result.scalars().first()
-            # We don't enrich with Redis here for simplicity, or we can copy valid response logic
-            return ChatResponse(id=c.id, created_at=c.created_at, participants=[p.user for p in c.participants])
-
-    # Create new
-    chat = Chat(created_by=current_user.id)
-    db.add(chat)
-    await db.commit()
-    await db.refresh(chat)
-
-    db.add(ChatParticipant(chat_id=chat.id, user_id=current_user.id))
-    db.add(ChatParticipant(chat_id=chat.id, user_id=other_user.id))
-    await db.commit()
+        await db.commit()
+        if row.inserted:
+            await membership.chat_created(chat_id, [current_user.id, other_user.id])
+            await etags.bump(user_ids=[current_user.id, other_user.id])
 
     result = await db.execute(
-        select(Chat).where(Chat.id == chat.id)
+        select(Chat).where(Chat.id == chat_id)
         .options(selectinload(Chat.participants).selectinload(ChatParticipant.user))
     )
     chat = result.scalars().first()
@@ -70,172 +97,139 @@ async def create_chat(
 
 @router.get("", response_model=List[ChatResponse])
 async def get_chats(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    # 1. Fetch chats from DB
+    # 0. Unchanged since the client's last poll -> 304 without touching the DB
+    markers = await etags.versions(etags.CHAT_LIST_VERSION.format(current_user.id))
+    etag = etags.make_etag(markers, current_user.id, int(time.time() // etags.PRESENCE_BUCKET))
+    headers = {"ETag": etag, "Cache-Control": etags.REVALIDATE} if etag else {}
+    if etags.not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    # 1. Chats with their denormalized summary and last message, newest
+    # activity first, as plain column rows (no ORM objects).
+    # Show a chat ONLY if (I created it) OR (it has messages).
     result = await db.execute(
-        select(Chat)
-        .join(ChatParticipant)
-        .where(ChatParticipant.user_id == current_user.id)
-        .options(
-            selectinload(Chat.participants).selectinload(ChatParticipant.user)
-            # REMOVED: selectinload(Chat.messages) - this was the bottleneck
+        select(
+            Chat.id,
+            Chat.created_at,
+            Message.id.label("last_id"),
+            Message.content.label("last_content"),
+            Message.iv.label("last_iv"),
+            Message.ciphertext.label("last_ciphertext"),
+            Message.type.label("last_type"),
+            Message.blob_id.label("last_blob_id"),
+            Message.sender_id.label("last_sender_id"),
+            Message.created_at.label("last_created_at"),
         )
+        .join(ChatParticipant, ChatParticipant.chat_id == Chat.id)
+        .outerjoin(Message, Message.id == Chat.last_message_id)
+        .where(
+            ChatParticipant.user_id == current_user.id,
+            Chat.deleted_at.is_(None),
+            or_(Chat.created_by == current_user.id, Chat.last_message_id.isnot(None)),
+        )
+        .order_by(Chat.last_activity_at.desc(), Chat.id.desc())
     )
-    chats = result.scalars().unique().all()
-    
-    if not chats:
-        return []
-
-    # Filter: Show chat ONLY if (I created it) OR (It has messages)
-    # We need to know if it has messages. 
-    # The subquery below fetches messages. We can use that?
-    # Or we can check `chat.messages` if we eagerly loaded it? We removed selectinload(Chat.messages).
-    # Re-adding selectinload(Chat.messages) is heavy.
-    # Better: Filter AFTER fetching last message? 
-    # If `last_message` is None AND `chat.created_by != current_user.id` -> Skip.
-    
-    # We will refine the list AFTER step 3 (last message fetch).
-    
-    chat_ids = [c.id for c in chats]
+    chats = result.all()
 
-    # 3. Fetch Last Message for each chat efficiently
-    # Use a robust subquery approach compatible with most SQL dialects, though we are on Postgres.
-    # We find the latest created_at for each chat, then join to get the message details.
-    
-    from sqlalchemy import func, tuple_
-
-    # Subquery to find the max created_at for each chat
-    latest_times_subquery = (
-        select(Message.chat_id, func.max(Message.created_at).label("max_created_at"))
-        .where(Message.chat_id.in_(chat_ids))
-        .group_by(Message.chat_id)
-        .subquery()
-    )
+    if not chats:
+        return FastJSONResponse([], headers=headers)
 
-    # Main query to fetch full message details
-    # We join on chat_id and created_at. 
-    # Note: If two messages have the exact same timestamp in the same chat, this might return duplicates.
-    # Given the precision of timestamps, this is rare, but we can handle it by taking the first one in python or using DISTINCT.
-    try:
-        stmt = (
-            select(Message)
-            .join(
-                latest_times_subquery,
-                (Message.chat_id == latest_times_subquery.c.chat_id) & 
-                (Message.created_at == latest_times_subquery.c.max_created_at)
-            )
+    # 2. Every member of those chats with just the columns the list shows
+    result = await db.execute(
+        select(
+            ChatParticipant.chat_id,
+            ChatParticipant.user_id,
+            ChatParticipant.last_read_at,
+            ChatParticipant.last_read_message_id,
+            User.username,
+            User.public_key,
+            User.avatar_url,
         )
-        
-        last_msgs_result = await db.execute(stmt)
-        last_msgs = last_msgs_result.scalars().all()
-        
-        # Deduplicate in Python just in case multiple messages have exact same timestamp
-        last_msg_map = {}
-        for m in last_msgs:
-            # If we already have a message for this chat, only overwrite if this one somehow has a greater ID (arbitrary tie-break)
-            if m.chat_id not in last_msg_map or m.id > last_msg_map[m.chat_id].id:
-                last_msg_map[m.chat_id] = m
-                
-    except Exception as e:
-        print(f"Error fetching last messages: {e}")
-        last_msg_map = {}
-
-    # 3. Collect all participant IDs for Redis
-    all_users = []
-    for chat in chats:
-        for p in chat.participants:
-            all_users.append(p.user)
-    
-    unique_users = {u.id: u for u in all_users}
-    user_ids = list(unique_users.keys())
-
-    # 4. Batch fetch Redis Status
-    presence_map = {}
-    last_seen_map = {}
-    
-    if user_ids and redis_client:
+        .join(User, User.id == ChatParticipant.user_id)
+        .where(ChatParticipant.chat_id.in_([c.id for c in chats]))
+    )
+    members = {}
+    for row in result.all():
+        members.setdefault(row.chat_id, []).append(row)
+
+    # 3. Batch fetch presence (one ZMSCORE for every participant) and my
+    # unread counters (one HGETALL; None while they are being rebuilt)
+    presence_info = {}
+    user_ids = {row.user_id for rows in members.values() for row in rows}
+    if user_ids:
         try:
-            pipe = redis_client.pipeline()
-            for uid in user_ids:
-                pipe.get(f"user:online:{uid}")
-                pipe.get(f"user:last_seen:{uid}")
-            results = await pipe.execute()
-            
-            for i, uid in enumerate(user_ids):
-                is_online = results[i*2]
-                last_seen_str = results[i*2 + 1]
-                
-                presence_map[uid] = True if is_online else False
-                if last_seen_str:
-                    try:
-                        last_seen_map[uid] = datetime.fromisoformat(last_seen_str)
-                    except:
-                        last_seen_map[uid] = None
-                else:
-                    last_seen_map[uid] = None
+            presence_info = await presence.lookup(user_ids)
         except Exception as e:
             print(f"Redis fetch error: {e}")
+    unread_counts = await unread.counts(current_user.id)
 
-    # 5. Construct Response
+    # 4. Construct Response
     response = []
     for chat in chats:
+        participants = members.get(chat.id, [])
         participants_resp = []
-        for p in chat.participants:
-            u_obj = p.user
-            u_resp = UserResponse.model_validate(u_obj)
-            u_resp.is_online = presence_map.get(u_obj.id, False)
-            u_resp.last_seen = last_seen_map.get(u_obj.id, None)
-            participants_resp.append(u_resp)
-
-        last_msg = last_msg_map.get(chat.id)
-
-        # Lazy Chat Logic: 
-        # If I did NOT create the chat AND there are no messages, I should NOT see it.
-        if not last_msg and chat.created_by != current_user.id:
-            continue
-            
+        for p in participants:
+            is_online, last_seen = presence_info.get(p.user_id, (False, None))
+            participants_resp.append({
+                "id": p.user_id,
+                "username": p.username,
+                "key_version": public_key_version(p.public_key),
+                "avatar_url": p.avatar_url,
+                "is_online": is_online,
+                "last_seen": last_seen,
+            })
+
         response.append({
             "id": chat.id,
             "created_at": chat.created_at,
             "participants": participants_resp,
+            "unread_count": unread_counts.get(chat.id, 0) if unread_counts is not None else None,
             "last_message": {
-                "id": last_msg.id,
-                "content": last_msg.content if last_msg.type != MessageType.IMAGE else "📷 Фото",
-                "type": last_msg.type.value,
-                "sender_id": last_msg.sender_id,
-                "created_at": last_msg.created_at
-            } if last_msg else None
+                "id": chat.last_id,
+                "content": (
+                    ciphertext.text(chat.last_content, chat.last_iv, chat.last_ciphertext)
+                    if chat.last_type != MessageType.IMAGE and chat.last_blob_id is None else "📷 Фото"
+                ),
+                "type": chat.last_type.value,
+                "blob_id": chat.last_blob_id,
+                "sender_id": chat.last_sender_id,
+                "created_at": chat.last_created_at,
+                "read_at": _read_at(chat.last_sender_id, (chat.last_created_at, chat.last_id), participants),
+            } if chat.last_id else None
         })
 
-    # Sort by last message time, newest first
-    response.sort(key=lambda c: c["last_message"]["created_at"] if c["last_message"] else c["created_at"], reverse=True)
-    return response
+    return FastJSONResponse(response, headers=headers)
 
 
 @router.delete("/{chat_id}")
 async def delete_chat(
     chat_id: str,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    # Verify participation
+    recipients = list(await membership.require_member(db, chat_id, current_user.id))
+
+    # Soft delete: the chat disappears for everyone at once, and its 1:1 key
+    # is released so the pair can start a new chat. The rows (messages in
+    # bounded batches), blobs and archive files are purged by a background job.
     result = await db.execute(
-        select(ChatParticipant).where(
-            ChatParticipant.chat_id == chat_id,
-            ChatParticipant.user_id == current_user.id
-        )
+        sa_update(Chat)
+        .where(Chat.id == chat_id, Chat.deleted_at.is_(None))
+        .values(deleted_at=func.now(), direct_key=None)
     )
-    if not result.scalars().first():
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    # Delete messages, participants, then chat
-    await db.execute(sa_delete(Message).where(Message.chat_id == chat_id))
-    await db.execute(sa_delete(ChatParticipant).where(ChatParticipant.chat_id == chat_id))
-    await db.execute(sa_delete(Chat).where(Chat.id == chat_id))
+    if result.rowcount:
+        await sync.record(db, recipients, "chat.deleted", {"chat_id": chat_id}, chat_id)
     await db.commit()
+    await membership.chat_deleted(chat_id, recipients)
+    await unread.chat_deleted(chat_id, recipients)
+    await etags.bump(chat_ids=[chat_id], user_ids=recipients)
+    await job_queue.enqueue("purge_chat", {"chat_id": chat_id})
 
+    await publish(recipients, "chat.deleted", {"chat_id": chat_id})
     return {"ok": True}
 
 
@@ -243,82 +237,383 @@ async def delete_chat(
 async def send_message(
     chat_id: str,
     message: MessageCreate,
+    request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    result = await db.execute(
-        select(ChatParticipant).where(
-            ChatParticipant.chat_id == chat_id,
-            ChatParticipant.user_id == current_user.id
-        )
-    )
-    if not result.scalars().first():
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
+    recipients = list(await membership.require_member(db, chat_id, current_user.id))
 
     # Verify reply_to_id if present
+    reply = None
     if message.reply_to_id:
-        reply_msg_res = await db.execute(select(Message).where(Message.id == message.reply_to_id, Message.chat_id == chat_id))
-        if not reply_msg_res.scalars().first():
+        reply_msg_res = await db.execute(
+            select(Message.id, Message.content, Message.iv, Message.ciphertext, Message.sender_id, Message.type)
+            .where(Message.id == message.reply_to_id, Message.chat_id == chat_id)
+        )
+        reply = reply_msg_res.first()
+        if not reply:
             raise HTTPException(status_code=400, detail="Сообщение для ответа не найдено")
 
+    # Verify the attachment was uploaded to this chat
+    if message.blob_id:
+        await lock_blobs(db, [message.blob_id])
+        blob_res = await db.execute(select(ChatBlob.blob_id).where(ChatBlob.chat_id == chat_id, ChatBlob.blob_id == message.blob_id))
+        if not blob_res.scalars().first():
+            raise HTTPException(status_code=400, detail="Файл не найден")
+
+    body = ciphertext.columns(message.content)
     new_message = Message(
         chat_id=chat_id,
         sender_id=current_user.id,
-        content=message.content,
         type=message.type,
-        reply_to_id=message.reply_to_id
+        reply_to_id=message.reply_to_id,
+        blob_id=message.blob_id,
+        **body,
     )
     db.add(new_message)
+    await db.flush()  # created_at (part of the primary key) comes back with the INSERT
+    # Advance the chat summary in the same transaction. now() is the transaction
+    # timestamp, i.e. the message's created_at; the guard keeps a slower
+    # concurrent sender from moving the summary backwards in (created_at, id)
+    # order, which read watermarks rely on.
+    await db.execute(
+        sa_update(Chat)
+        .where(
+            Chat.id == chat_id,
+            or_(
+                Chat.last_message_id.is_(None),
+                tuple_(Chat.last_activity_at, Chat.last_message_id) < tuple_(func.now(), new_message.id),
+            ),
+        )
+        .values(last_message_id=new_message.id, last_activity_at=func.now())
+    )
+
+    saved = {
+        "id": new_message.id,
+        "chat_id": chat_id,
+        "sender_id": current_user.id,
+        "content": message.content,
+        "type": message.type,
+        "created_at": new_message.created_at,
+        "reply_to_id": message.reply_to_id,
+        "blob_id": message.blob_id,
+        "read_at": None,
+        "reply_to": {
+            "id": reply.id,
+            "content": ciphertext.text(reply.content, reply.iv, reply.ciphertext),
+            "sender_id": reply.sender_id,
+            "type": reply.type,
+        } if reply else None,
+    }
+    payload = MessageResponse.model_validate(saved).model_dump(mode="json")
+    await sync.record(db, recipients, "message.created", {"chat_id": chat_id, "message": sync.message_ref(payload)}, chat_id)
     await db.commit()
-    await db.refresh(new_message)
-    
-    # Reload with reply_to relationship
+    await unread.add([([u for u in recipients if u != current_user.id], chat_id, 1)])
+    await etags.bump(chat_ids=[chat_id], user_ids=recipients)
+
+    await publish(recipients, "message.created", {"chat_id": chat_id, "message": payload})
+    if wants_msgpack(request):
+        saved.update(ciphertext.fields(body["content"], body["iv"], body["ciphertext"], True))
+        if reply:
+            saved["reply_to"].update(ciphertext.fields(reply.content, reply.iv, reply.ciphertext, True))
+    return negotiated(request, saved)
+
+
+@router.post("/messages/batch", response_model=List[MessageBatchResult])
+async def send_messages(
+    batch: MessageBatch,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    # Offline-queue flush: every item is checked against a few set lookups
+    # (members from the index, reply targets and blobs one query each),
+    # accepted ones go in with one multi-row INSERT and commit together.
+    items = batch.messages
+    chat_ids = {item.chat_id for item in items}
+
+    # My membership and the recipient lists of every chat in the batch
+    members = await membership.members_many(db, chat_ids)
+
+    reply_ids = {item.reply_to_id for item in items if item.reply_to_id}
+    replies = {}
+    if reply_ids:
+        result = await db.execute(
+            select(Message.id, Message.chat_id, Message.content, Message.iv, Message.ciphertext, Message.sender_id, Message.type)
+            .where(Message.id.in_(reply_ids))
+        )
+        replies = {row.id: row for row in result.all()}
+
+    blob_keys = {(item.chat_id, item.blob_id) for item in items if item.blob_id}
+    blobs = set()
+    if blob_keys:
+        await lock_blobs(db, [blob_id for _, blob_id in blob_keys])
+        result = await db.execute(
+            select(ChatBlob.chat_id, ChatBlob.blob_id)
+            .where(tuple_(ChatBlob.chat_id, ChatBlob.blob_id).in_(blob_keys))
+        )
+        blobs = {tuple(row) for row in result.all()}
+
+    results = [None] * len(items)
+    accepted = []  # (index, item, row)
+    for index, item in enumerate(items):
+        reply = replies.get(item.reply_to_id)
+        if current_user.id not in members.get(item.chat_id, ()):
+            error = "Вы не участник этого чата"
+        elif item.reply_to_id and (reply is None or reply.chat_id != item.chat_id):
+            error = "Сообщение для ответа не найдено"
+        elif item.blob_id and (item.chat_id, item.blob_id) not in blobs:
+            error = "Файл не найден"
+        else:
+            accepted.append((index, item, {
+                "id": str(uuid.uuid4()),
+                "chat_id": item.chat_id,
+                "sender_id": current_user.id,
+                "content": item.content,
+                "type": item.type,
+                "reply_to_id": item.reply_to_id,
+                "blob_id": item.blob_id,
+                # One transaction means one now(); a microsecond step per row
+                # keeps (created_at, id) in submitted order
+                "created_at": func.now() + timedelta(microseconds=len(accepted)),
+            }))
+            continue
+        results[index] = {"index": index, "ok": False, "error": error}
+
+    if not accepted:
+        return FastJSONResponse(results)
+
     result = await db.execute(
-        select(Message).where(Message.id == new_message.id).options(selectinload(Message.reply_to))
+        pg_insert(Message)
+        .values([{**row, **ciphertext.columns(row["content"])} for _, _, row in accepted])
+        .returning(Message.id, Message.created_at)
+    )
+    created = dict(result.all())
+
+    # Each chat's summary moves to its newest message in the batch, with the
+    # same ordering guard as send_message. Table-level UPDATE so the list of
+    # parameters runs as a plain executemany.
+    newest = {row["chat_id"]: row["id"] for _, _, row in accepted}
+    await db.execute(
+        sa_update(Chat.__table__)
+        .where(
+            Chat.id == bindparam("b_chat_id"),
+            or_(
+                Chat.last_message_id.is_(None),
+                tuple_(Chat.last_activity_at, Chat.last_message_id) < tuple_(bindparam("b_at"), bindparam("b_id")),
+            ),
+        )
+        .values(last_message_id=bindparam("b_id"), last_activity_at=bindparam("b_at")),
+        [{"b_chat_id": chat_id, "b_id": msg_id, "b_at": created[msg_id]} for chat_id, msg_id in newest.items()],
     )
-    return result.scalars().first()
+
+    events = []
+    for index, item, row in accepted:
+        reply = replies.get(item.reply_to_id)
+        message = MessageResponse.model_validate({
+            **row,
+            "created_at": created[row["id"]],
+            "reply_to": {
+                "id": reply.id,
+                "content": ciphertext.text(reply.content, reply.iv, reply.ciphertext),
+                "sender_id": reply.sender_id,
+                "type": reply.type,
+            } if reply else None,
+        }).model_dump(mode="json")
+        results[index] = {"index": index, "ok": True, "message": message}
+        events.append((list(members[item.chat_id]), "message.created", {"chat_id": item.chat_id, "message": message}, item.chat_id))
+    await sync.record_many(db, [
+        (recipients, event_type, {**payload, "message": sync.message_ref(payload["message"])}, chat_id)
+        for recipients, event_type, payload, chat_id in events
+    ])
+    await db.commit()
+    sent = Counter(row["chat_id"] for _, _, row in accepted)
+    await unread.add([(members[chat_id] - {current_user.id}, chat_id, n) for chat_id, n in sent.items()])
+    await etags.bump(chat_ids=newest, user_ids=[uid for chat_id in newest for uid in members[chat_id]])
+
+    for recipients, event_type, payload, _ in events:
+        await publish(recipients, event_type, payload)
+    return FastJSONResponse(results)
 
 
 @router.get("/{chat_id}/messages", response_model=List[MessageResponse])
 async def get_messages(
     chat_id: str,
+    request: Request,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    read_db: AsyncSession = Depends(get_read_db),
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    result = await db.execute(
-        select(ChatParticipant).where(
-            ChatParticipant.chat_id == chat_id,
-            ChatParticipant.user_id == current_user.id
-        )
-    )
-    if not result.scalars().first():
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    # Mark unread messages from other user as read
-    # We can do this in bg or directly. Directly is simpler.
+    # Authorized from the membership index, so a 304 poll never touches Postgres
+    members = list(await membership.require_member(db, chat_id, current_user.id))
+
+    if before and after:
+        raise HTTPException(status_code=400, detail="Укажите только before или after")
+
+    # Nothing new in this chat since the client's copy of this page -> 304.
+    # Their watermark was already advanced by the request that produced it.
+    markers = await etags.versions(etags.CHAT_VERSION.format(chat_id))
+    binary = wants_msgpack(request)
+    page_key = (current_user.id, chat_id, before, after, limit, binary)
+    etag = etags.make_etag(markers, *page_key)
+    if etags.not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": etags.REVALIDATE, "Vary": "Accept"})
+
+    headers = {"ETag": etag, "Cache-Control": etags.REVALIDATE} if etag else {}
+
+    # Keyset pagination over (created_at, id), served by ix_messages_chat_created_id.
+    # No cursor -> the newest page. `before` walks back into history,
+    # `after` fetches what arrived since the client's last sync point.
+    # Plain column rows; the replied-to message comes from a self join.
+    sort_key = tuple_(Message.created_at, Message.id)
+    reply = aliased(Message)
     stmt = (
-        select(Message)
-        .where(
-            Message.chat_id == chat_id,
-            Message.sender_id != current_user.id,
-            Message.read_at.is_(None)
+        select(
+            Message.id,
+            Message.chat_id,
+            Message.sender_id,
+            Message.content,
+            Message.iv,
+            Message.ciphertext,
+            Message.type,
+            Message.created_at,
+            Message.reply_to_id,
+            Message.blob_id,
+            reply.content.label("reply_content"),
+            reply.iv.label("reply_iv"),
+            reply.ciphertext.label("reply_ciphertext"),
+            reply.sender_id.label("reply_sender_id"),
+            reply.type.label("reply_type"),
         )
+        .outerjoin(reply, reply.id == Message.reply_to_id)
+        .where(Message.chat_id == chat_id)
+        .limit(limit + 1)  # one extra row tells us whether another page exists
     )
-    unread_msgs = (await db.execute(stmt)).scalars().all()
-    
-    if unread_msgs:
-        now = datetime.now(timezone.utc)
-        for msg in unread_msgs:
-            msg.read_at = now
-        await db.commit()
-
+    cursor = decode_time_cursor(after or before) if (after or before) else None
+    if after:
+        stmt = stmt.where(sort_key > tuple_(*cursor)).order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        if before:
+            stmt = stmt.where(sort_key < tuple_(*cursor))
+        stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc())
+    # Months before the archive boundary live in files, not in Postgres
+    boundary = await message_archive.boundary(read_db)
+    if boundary is not None:
+        stmt = stmt.where(Message.created_at >= boundary)
+
+    # History itself is served by the replica (watermark above stays on the primary)
+    messages = list((await read_db.execute(stmt)).all())
+    if boundary is not None:
+        if after and cursor[0] < boundary:
+            # Archived rows come first in ascending order
+            archived = await message_archive.read(read_db, chat_id, limit + 1, after=cursor)
+            messages = (archived + messages)[:limit + 1]
+        elif not after and len(messages) <= limit:
+            # Hot rows ran out: continue below the oldest one (or the cursor)
+            edge = (messages[-1].created_at, messages[-1].id) if messages else cursor
+            messages += await message_archive.read(read_db, chat_id, limit + 1 - len(messages), before=edge)
+    has_more = len(messages) > limit
+    messages = list(messages[:limit])
+    if not after:
+        messages.reverse()  # always return oldest -> newest
+
+    # Everyone's read watermark, for read_at below
     result = await db.execute(
-        select(Message)
-        .where(Message.chat_id == chat_id)
-        .order_by(Message.created_at.asc())
-        .options(selectinload(Message.reply_to))
+        select(ChatParticipant.user_id, ChatParticipant.last_read_at, ChatParticipant.last_read_message_id)
+        .where(ChatParticipant.chat_id == chat_id)
     )
-    return result.scalars().all()
+    participants = result.all()
+
+    # Reading forward (the newest page, or `after`) moves my watermark up to
+    # the newest message this page returned, never past it: a client that got
+    # 50 of 300 new messages has read 50. Older pages (`before`) don't count.
+    if not before and messages:
+        newest = messages[-1]
+        position = (newest.created_at, newest.id)
+        mine = next((p for p in participants if p.user_id == current_user.id), None)
+        advanced = await db.execute(
+            sa_update(ChatParticipant)
+            .where(
+                ChatParticipant.chat_id == chat_id,
+                ChatParticipant.user_id == current_user.id,
+                or_(
+                    ChatParticipant.last_read_at.is_(None),
+                    tuple_(ChatParticipant.last_read_at, ChatParticipant.last_read_message_id)
+                    < tuple_(*position),
+                ),
+            )
+            .values(last_read_at=newest.created_at, last_read_message_id=newest.id)
+            .returning(ChatParticipant.user_id, ChatParticipant.last_read_at, ChatParticipant.last_read_message_id)
+            .execution_options(synchronize_session=False)
+        )
+        watermark = advanced.first()
+        if watermark:
+            receipt = {
+                "chat_id": chat_id,
+                "reader_id": current_user.id,
+                "last_read_at": watermark.last_read_at.isoformat(),
+                "last_read_message_id": watermark.last_read_message_id,
+            }
+            await sync.record(db, members, "messages.read", receipt, chat_id)
+            participants = [watermark if p.user_id == current_user.id else p for p in participants]
+        await db.commit()
+        if after and has_more:
+            # Still behind the head: take off just the unread messages this page showed
+            seen = 0
+            if watermark:
+                since = (mine.last_read_at, mine.last_read_message_id) if mine and mine.last_read_at else None
+                seen = sum(
+                    1 for m in messages
+                    if m.sender_id != current_user.id and (since is None or (m.created_at, m.id) > since)
+                )
+                await unread.add([([current_user.id], chat_id, -seen)])
+            changed = seen > 0
+        else:
+            # Up to the head: everything is read. A counter left over without
+            # a watermark move (a send that raced my last read) still changes
+            # my chat list.
+            changed = await unread.clear(current_user.id, chat_id)
+        if watermark:
+            # The page below includes the new receipt, so tag it with the new version
+            etag = etags.make_etag([await etags.bump(chat_ids=[chat_id], user_ids=members)], *page_key)
+            headers = {"ETag": etag, "Cache-Control": etags.REVALIDATE}
+            await publish(members, "messages.read", receipt)
+        elif changed:
+            await etags.bump(user_ids=[current_user.id])
+
+    # X-Next-Cursor: continue in the requested direction (absent when exhausted)
+    # X-Sync-Cursor: newest message seen, pass as `after` to poll for new ones
+    if has_more:
+        edge = messages[-1] if after else messages[0]
+        headers["X-Next-Cursor"] = encode_cursor(edge.created_at, edge.id)
+    if messages:
+        headers["X-Sync-Cursor"] = encode_cursor(messages[-1].created_at, messages[-1].id)
+    elif after:
+        headers["X-Sync-Cursor"] = after
+
+    page = [
+        {
+            "id": m.id,
+            "chat_id": m.chat_id,
+            "sender_id": m.sender_id,
+            **ciphertext.fields(m.content, m.iv, m.ciphertext, binary),
+            "type": m.type,
+            "created_at": m.created_at,
+            "reply_to_id": m.reply_to_id,
+            "blob_id": m.blob_id,
+            "read_at": _read_at(m.sender_id, (m.created_at, m.id), participants),
+            "reply_to": {
+                "id": m.reply_to_id,
+                **ciphertext.fields(m.reply_content, m.reply_iv, m.reply_ciphertext, binary),
+                "sender_id": m.reply_sender_id,
+                "type": m.reply_type,
+            } if m.reply_sender_id is not None else None,
+        }
+        for m in messages
+    ]
+    return negotiated(request, page, headers=headers)
 
 
 @router.delete("/{chat_id}/messages/{message_id}")
@@ -326,29 +621,55 @@ async def delete_message(
     chat_id: str,
     message_id: str,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    # Verify participation
-    result = await db.execute(
-        select(ChatParticipant).where(
-            ChatParticipant.chat_id == chat_id,
-            ChatParticipant.user_id == current_user.id
-        )
-    )
-    if not result.scalars().first():
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
+    recipients = list(await membership.require_member(db, chat_id, current_user.id))
 
     # Fetch message
     msg_res = await db.execute(select(Message).where(Message.id == message_id, Message.chat_id == chat_id))
     message = msg_res.scalars().first()
     
     if not message:
+        # Archive files are immutable, so archived history can't be edited
+        if await message_archive.find(db, chat_id, message_id):
+            raise HTTPException(status_code=409, detail="Архивные сообщения нельзя удалить")
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
     
     if message.sender_id != current_user.id:
         raise HTTPException(status_code=403, detail="Можно удалять только свои сообщения")
 
+    # If this was the chat's last message, roll the summary back to the previous one
+    chat_res = await db.execute(select(Chat).where(Chat.id == chat_id).with_for_update())
+    chat = chat_res.scalars().first()
+    if chat and chat.last_message_id == message_id:
+        prev_res = await db.execute(
+            select(Message.id, Message.created_at)
+            .where(Message.chat_id == chat_id, Message.id != message_id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(1)
+        )
+        prev = prev_res.first()
+        chat.last_message_id = prev.id if prev else None
+        chat.last_activity_at = prev.created_at if prev else chat.created_at
+
+    # Members who hadn't read it yet get it taken off their unread count
+    result = await db.execute(
+        select(ChatParticipant.user_id, ChatParticipant.last_read_at, ChatParticipant.last_read_message_id)
+        .where(ChatParticipant.chat_id == chat_id, ChatParticipant.user_id != current_user.id)
+    )
+    position = (message.created_at, message.id)
+    unread_by = [
+        p.user_id for p in result.all()
+        if p.last_read_at is None or position > (p.last_read_at, p.last_read_message_id)
+    ]
+
+    # An attachment no message uses any more is left to the collect_blobs job
     await db.delete(message)
+    event = {"chat_id": chat_id, "message_id": message_id}
+    await sync.record(db, recipients, "message.deleted", event, chat_id)
     await db.commit()
+    await unread.add([(unread_by, chat_id, -1)])
+    await etags.bump(chat_ids=[chat_id], user_ids=recipients)
 
+    await publish(recipients, "message.deleted", event)
     return {"ok": True}
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from ..metrics import registry, METRICS_ENABLED
+from ..database import engine, replica_engine
+from ..cpu import cpu_pool, loop_lag
+from ..jobs import job_queue
+from ..membership import membership
+from ..unread import unread
+from ..user_cache import user_cache
+from ..realtime import manager
+
+router = APIRouter()
+
+# Refreshed from the components' own stats() at scrape time; the counters
+# mirror running totals the components keep
+loop_lag_seconds = registry.gauge("event_loop_lag_seconds", "Event-loop lag: last sample and maximum", ("kind",))
+cpu_pool_tasks = registry.gauge("cpu_pool_tasks", "CPU pool calls by state", ("state",))
+db_pool_connections = registry.gauge("db_pool_connections", "Pooled DB connections", ("engine", "state"))
+cache_lookups = registry.counter("cache_lookups_total", "In-process and Redis cache lookups", ("cache", "result"))
+jobs_queued = registry.gauge("jobs_queued", "Background jobs by queue", ("queue",))
+jobs_enqueued = registry.counter("jobs_enqueued_total", "Background jobs enqueued since the queue was created")
+jobs_processed = registry.counter("jobs_processed_total", "Background jobs processed since the queue was created", ("outcome",))
+websocket_connections = registry.gauge("websocket_connections", "Open WebSocket connections on this worker")
+websocket_dropped = registry.counter("websocket_dropped_total", "WebSockets closed for falling behind on this worker")
+
+
+@registry.collector
+async def _collect():
+    lag = loop_lag.stats()
+    loop_lag_seconds.set(lag["last_ms"] / 1000, "last")
+    loop_lag_seconds.set(lag["max_ms"] / 1000, "max")
+
+    pool = cpu_pool.stats()
+    for state in ("pending", "completed", "rejected"):
+        cpu_pool_tasks.set(pool[state], state)
+
+    engines = {"primary": engine} if replica_engine is engine else {"primary": engine, "replica": replica_engine}
+    for name, target in engines.items():
+        db_pool = target.sync_engine.pool
+        if hasattr(db_pool, "checkedout"):
+            db_pool_connections.set(db_pool.checkedout(), name, "checked_out")
+            db_pool_connections.set(db_pool.checkedin(), name, "idle")
+            db_pool_connections.set(db_pool.size(), name, "pool_size")
+
+    for cache, stats in (("users", user_cache.stats()), ("membership", membership.stats()), ("unread", unread.stats())):
+        cache_lookups.set(stats["hits"], cache, "hit")
+        cache_lookups.set(stats["misses"], cache, "miss")
+
+    websocket_connections.set(sum(len(s) for s in manager.connections.values()))
+    websocket_dropped.set(manager.dropped)
+
+    queue = await job_queue.stats()
+    for name in ("ready", "delayed", "running", "dead"):
+        jobs_queued.set(queue[name], name)
+    jobs_enqueued.set(queue.get("enqueued", 0))
+    # "dead" is the dead-letter list's depth in stats(); its counter has its own name
+    for outcome, counter in (("completed", "completed"), ("retried", "retried"), ("dead", "dead_lettered")):
+        jobs_processed.set(queue.get(counter, 0), outcome)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(await registry.render(), media_type="text/plain; version=0.0.4")
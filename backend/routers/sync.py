@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from ..models import SyncEvent, SyncSequence
+from ..schemas import SyncResponse
+from ..deps import get_current_user, get_read_db
+from ..user_cache import CachedUser
+
+router = APIRouter()
+
+
+@router.get("/sync", response_model=SyncResponse)
+async def sync(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    # One statement, so the events and the user's current sequence come from
+    # the same snapshot (two reads on a replica can disagree): the sequence
+    # row outer-joined to a range scan on the (user_id, seq) primary key. An
+    # up-to-date client just gets an empty list back.
+    result = await db.execute(
+        select(SyncSequence.seq, SyncEvent)
+        .outerjoin(SyncEvent, and_(SyncEvent.user_id == SyncSequence.user_id, SyncEvent.seq > since))
+        .where(SyncSequence.user_id == current_user.id)
+        .order_by(SyncEvent.seq)
+        .limit(limit + 1)
+    )
+    rows = result.all()
+    current = rows[0][0] if rows else 0
+    events = [event for _, event in rows if event is not None]
+    has_more = len(events) > limit
+    events = events[:limit]
+    # Events past the retention window are pruned: a gap right after `since`
+    # means the client missed some and has to reload
+    if events:
+        seq = events[-1].seq
+        truncated = events[0].seq > since + 1
+    else:
+        seq = max(since, current)
+        truncated = current > since
+    return {
+        "events": events,
+        "seq": seq,
+        "has_more": has_more,
+        "truncated": truncated,
+    }
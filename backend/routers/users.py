@@ -1,24 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import func, case, tuple_, bindparam
 from ..database import get_db
-from ..models import User
-from ..schemas import UserResponse, UserUpdate
-from ..deps import get_current_user
-from typing import List
+from ..models import User, public_key_version
+from ..schemas import UserResponse, UserUpdate, UserSearchResult, PublicKeyResponse
+from ..deps import get_current_user, get_read_db
+from ..user_cache import CachedUser, invalidate_user
+from ..pagination import encode_cursor, decode_cursor
+from ..redis_client import redis_client
+from ..realtime import publish
+from .. import sync, etags
+from ..membership import membership
+from ..responses import FastJSONResponse
+from typing import List, Optional
+import hashlib
+import json
+import os
 
 router = APIRouter()
 
 @router.get("/me", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: CachedUser = Depends(get_current_user)):
     return current_user
 
 @router.put("/me", response_model=UserResponse)
 async def update_me(
     update: UserUpdate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
+    # get_current_user hands out a cached snapshot; edit the real row
+    old_username = current_user.username
+    current_user = await db.get(User, current_user.id)
+
     if update.username is not None:
         clean = update.username.strip()
         if len(clean) < 2:
@@ -32,21 +47,118 @@ async def update_me(
     if update.avatar_url is not None:
         current_user.avatar_url = update.avatar_url
 
+    # Everyone I share a chat with (and my other devices) sees the new profile
+    recipients = []
+    profile = None
+    if db.is_modified(current_user):
+        my_chats = await membership.user_chats(db, current_user.id)
+        members = await membership.members_many(db, my_chats)
+        recipients = list({current_user.id}.union(*members.values()))
+        profile = {"id": current_user.id, "username": current_user.username, "avatar_url": current_user.avatar_url}
+        await sync.record(db, recipients, "user.updated", {"user": profile})
+
     await db.commit()
     await db.refresh(current_user)
+    await invalidate_user(old_username)
+    await etags.bump(user_ids=recipients)
+    await publish(recipients, "user.updated", {"user": profile})
     return current_user
 
-@router.get("", response_model=List[UserResponse])
+# Search-as-you-type results are shared by everyone for a short while
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "30"))
+
+
+@router.get("", response_model=List[UserSearchResult])
 async def search_users(
     username: str,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    result = await db.execute(
-        select(User).filter(
-            User.username.contains(username),
-            User.is_verified == True,
-            User.id != current_user.id
+    q = username.strip().lower()
+    if not q:
+        return []
+
+    cache_key = "search:users:" + hashlib.sha1(f"{q}|{limit}|{cursor or ''}".encode()).hexdigest()
+    rows = None
+    try:
+        cached = await redis_client.get(cache_key)
+        if cached:
+            rows = json.loads(cached)
+    except Exception as e:
+        print(f"Search cache error: {e}")
+
+    if rows is None:
+        # Rank: exact match, then prefix, then substring. Queries of 1-2 chars
+        # are too short for the trigram index and only match by prefix.
+        name = func.lower(User.username)
+        # The prefix pattern is inlined as a literal: the pattern-ops index
+        # only serves LIKE 'abc%' when the planner sees the constant, and a
+        # cached generic plan for LIKE $1 || '%' never does
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        prefix = name.like(bindparam("prefix", escaped + "%", literal_execute=True), escape="\\")
+        rank = case((name == q, 0), (prefix, 1), else_=2)
+        match = prefix if len(q) < 3 else name.contains(q, autoescape=True)
+        stmt = (
+            select(User.id, User.username, User.avatar_url, rank.label("rank"))
+            .where(match, User.is_verified == True)
+            .order_by(rank, User.username, User.id)
+            .limit(limit + 2)  # +1 to detect another page, +1 in case the caller is among the hits
         )
-    )
-    return result.scalars().all()
+        if cursor:
+            c_rank, c_username, c_id = decode_cursor(cursor, 3)
+            stmt = stmt.where(tuple_(rank, User.username, User.id) > tuple_(c_rank, c_username, c_id))
+        rows = [dict(r._mapping) for r in (await db.execute(stmt)).all()]
+        try:
+            await redis_client.set(cache_key, json.dumps(rows), ex=SEARCH_CACHE_TTL)
+        except Exception as e:
+            print(f"Search cache error: {e}")
+
+    rows = [r for r in rows if r["id"] != current_user.id]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["rank"], last["username"], last["id"])
+    return rows
+
+
+KEYS_BATCH_LIMIT = 100
+
+
+@router.get("/keys", response_model=List[PublicKeyResponse])
+async def get_public_keys(
+    request: Request,
+    ids: str,
+    v: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    # Public key directory: ?ids=a,b,c in one call. The chat list only ships
+    # each participant's key_version; clients keep keys by version and ask
+    # here for the ones they don't have. Passing those versions back as
+    # ?v=x,y,z (same order as ids) makes the URL name its contents, so a
+    # matching response may be cached for good.
+    user_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not user_ids:
+        return FastJSONResponse([])
+    if len(user_ids) > KEYS_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Не больше {KEYS_BATCH_LIMIT} пользователей за запрос")
+
+    result = await db.execute(select(User.id, User.public_key).where(User.id.in_(user_ids)))
+    found = {row.id: row.public_key for row in result.all()}
+    keys = [
+        {"id": uid, "public_key": found[uid], "key_version": public_key_version(found[uid])}
+        for uid in user_ids if uid in found
+    ]
+
+    # Strong ETag: the body is a function of the ids and their key versions
+    digest = hashlib.sha1("|".join(f"{k['id']}:{k['key_version']}" for k in keys).encode()).hexdigest()[:20]
+    etag = f'"{digest}"'
+    requested = v.split(",") if v else None
+    pinned = requested == [public_key_version(found.get(uid)) or "" for uid in user_ids]
+    headers = {"ETag": etag, "Cache-Control": etags.IMMUTABLE if pinned else etags.REVALIDATE}
+    if etags.not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(keys, headers=headers)
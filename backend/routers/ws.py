@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import time
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
+from ..database import AsyncSessionLocal
+from ..deps import authenticate_token, token_expires_at
+from ..realtime import manager
+from ..presence import presence
+
+router = APIRouter()
+
+# Seconds a new socket gets to send its auth message
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))
+
+
+async def _authenticate(websocket: WebSocket):
+    # Browsers can't set Authorization on a WebSocket, and a ?token= query
+    # string ends up in proxy and server access logs, so the JWT comes in
+    # the first message instead: {"type": "auth", "token": "..."}
+    try:
+        data = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+        token = data["token"] if data.get("type") == "auth" else None
+    except (asyncio.TimeoutError, ValueError, KeyError, TypeError, AttributeError):
+        return None, None
+    if not isinstance(token, str):
+        return None, None
+    try:
+        async with AsyncSessionLocal() as db:
+            user = await authenticate_token(token, db)
+    except HTTPException:
+        return None, None
+    return user, token_expires_at(token)
+
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        user, expires_at = await _authenticate(websocket)
+    except WebSocketDisconnect:
+        return
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.send_text(json.dumps({"type": "ready"}))
+    await manager.connect(user.id, websocket)
+    presence.touch(user.id)
+    try:
+        # Server -> client only; we just answer keepalive pings, which also
+        # keep the user online while the app sits idle on an open socket.
+        # The socket lives no longer than the token it was opened with.
+        while True:
+            timeout = expires_at - time.time() if expires_at is not None else None
+            if timeout is not None and timeout <= 0:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="token expired")
+                break
+            try:
+                data = await asyncio.wait_for(websocket.receive_text(), timeout)
+            except asyncio.TimeoutError:
+                continue
+            if data == "ping":
+                presence.touch(user.id)
+                await websocket.send_text("pong")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await manager.disconnect(user.id, websocket)
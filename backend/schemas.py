@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, List
 from datetime import datetime
 from .models import MessageType
@@ -31,6 +31,29 @@ class UserResponse(UserBase):
     class Config:
         from_attributes = True
 
+class ParticipantSummary(BaseModel):
+    # What other chat members need: no key-sync material, no timestamps.
+    # Public keys come from GET /users/keys, cached by key_version.
+    id: str
+    username: str
+    key_version: Optional[str] = None
+    avatar_url: Optional[str] = None
+    is_online: bool = False
+    last_seen: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class UserSearchResult(BaseModel):
+    id: str
+    username: str
+    avatar_url: Optional[str] = None
+
+class PublicKeyResponse(BaseModel):
+    id: str
+    public_key: Optional[str] = None
+    key_version: Optional[str] = None
+
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     avatar_url: Optional[str] = None
@@ -43,45 +66,98 @@ class ChatCreate(BaseModel):
 
 class LastMessage(BaseModel):
     id: str
-    content: str
+    content: Optional[str] = None
     type: str
+    blob_id: Optional[str] = None
     sender_id: str
     created_at: datetime
+    read_at: Optional[datetime] = None
 
 class ChatResponse(BaseModel):
     id: str
-    participants: List[UserResponse]
+    participants: List[ParticipantSummary]
     created_at: datetime
+    # Messages from others past my read watermark; None while the
+    # counters are being rebuilt
+    unread_count: Optional[int] = None
     last_message: Optional[LastMessage] = None
 
     class Config:
         from_attributes = True
 
 class MessageBase(BaseModel):
-    content: str
+    # None when the whole (encrypted) body is the blob
+    content: Optional[str] = None
     type: MessageType
     reply_to_id: Optional[str] = None
+    blob_id: Optional[str] = None  # uploaded via POST /chats/{chat_id}/blobs
 
 class MessageCreate(MessageBase):
-    pass
+    @model_validator(mode="after")
+    def _has_body(self):
+        if self.content is None and self.blob_id is None:
+            raise ValueError("content or blob_id is required")
+        return self
 
 class MessageReply(BaseModel):
     id: str
-    content: str
+    content: Optional[str] = None
     sender_id: str
     type: MessageType
 
+    class Config:
+        from_attributes = True
+
 class MessageResponse(MessageBase):
     id: str
     chat_id: str
     sender_id: str
     created_at: datetime
+    # Derived from the other participant's read watermark: the point in the
+    # chat (not the wall-clock moment) they had read up to
     read_at: Optional[datetime] = None
     reply_to: Optional[MessageReply] = None
 
     class Config:
         from_attributes = True
 
+class MessageBatchItem(MessageCreate):
+    chat_id: str
+
+class MessageBatch(BaseModel):
+    # Offline-queue flush: messages for one or more chats, in send order
+    messages: List[MessageBatchItem] = Field(min_length=1, max_length=100)
+
+class MessageBatchResult(BaseModel):
+    # One per submitted item, in request order; a rejected item doesn't
+    # stop the others
+    index: int
+    ok: bool
+    message: Optional[MessageResponse] = None
+    error: Optional[str] = None
+
+class BlobUploadResponse(BaseModel):
+    blob_id: str
+    size: int
+
+class SyncEventResponse(BaseModel):
+    seq: int
+    type: str
+    chat_id: Optional[str] = None
+    payload: dict
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class SyncResponse(BaseModel):
+    events: List[SyncEventResponse]
+    # Pass back as `since`; unchanged when there was nothing new
+    seq: int
+    has_more: bool = False
+    # Events after `since` were pruned: reload chats and history, then go on from seq
+    truncated: bool = False
+
 class Token(BaseModel):
     access_token: str
     token_type: str
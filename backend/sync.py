@@ -0,0 +1,73 @@
+import os
+from typing import Optional
+from sqlalchemy import String, Integer, JSON, column, values
+from sqlalchemy.future import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import SyncSequence, SyncEvent
+
+# Per-user sync log.
+#
+# Write paths call record() inside their own transaction, next to the change
+# itself, with the same event types the realtime channel publishes. Each
+# recipient gets the next number in their own sequence, so a client that
+# remembers the last seq it saw can fetch exactly what it missed from
+# GET /sync?since=<seq>.
+#
+# Events only say what changed. A new message is logged as its ids and
+# metadata, not its body (IMAGE ciphertext runs to megabytes and would be
+# stored once per recipient); clients fetch the bodies from the chat history
+# with the `after` cursor. Events older than SYNC_RETENTION_DAYS are pruned
+# by the prune_sync_events job (backend/tasks.py); a client that was away
+# longer is told to reload instead.
+
+SYNC_RETENTION_DAYS = int(os.getenv("SYNC_RETENTION_DAYS", "30"))
+MESSAGE_REF_FIELDS = ("id", "chat_id", "sender_id", "type", "created_at", "reply_to_id", "blob_id")
+
+
+def message_ref(message: dict) -> dict:
+    # What a message.created event keeps of a serialized message
+    return {field: message.get(field) for field in MESSAGE_REF_FIELDS}
+
+
+async def record(db: AsyncSession, user_ids, event_type: str, payload: dict, chat_id: Optional[str] = None):
+    await record_many(db, [(user_ids, event_type, payload, chat_id)])
+
+
+async def record_many(db: AsyncSession, events):
+    # events: (user_ids, event_type, payload, chat_id) tuples, oldest first.
+    # One statement: bump every recipient's counter by their number of new
+    # events and insert the events with the numbers in between. Counters are
+    # locked in user id order so concurrent writers can't deadlock.
+    counts, pending = {}, []
+    for user_ids, event_type, payload, chat_id in events:
+        for uid in set(user_ids):
+            counts[uid] = counts.get(uid, 0) + 1
+            pending.append((uid, counts[uid], event_type, chat_id, payload))
+    if not pending:
+        return
+    upsert = pg_insert(SyncSequence).values([{"user_id": uid, "seq": n} for uid, n in sorted(counts.items())])
+    bump = (
+        upsert.on_conflict_do_update(
+            index_elements=[SyncSequence.user_id], set_={"seq": SyncSequence.seq + upsert.excluded.seq}
+        )
+        .returning(SyncSequence.user_id, SyncSequence.seq)
+        .cte("bump")
+    )
+    rows = values(
+        column("user_id", String), column("n", Integer), column("total", Integer),
+        column("type", String), column("chat_id", String), column("payload", JSON),
+        name="pending",
+    ).data([(uid, n, counts[uid], event_type, chat_id, payload) for uid, n, event_type, chat_id, payload in pending])
+    await db.execute(
+        pg_insert(SyncEvent).from_select(
+            ["user_id", "seq", "type", "chat_id", "payload"],
+            select(
+                rows.c.user_id,
+                bump.c.seq - rows.c.total + rows.c.n,
+                rows.c.type,
+                rows.c.chat_id,
+                rows.c.payload,
+            ).join_from(rows, bump, bump.c.user_id == rows.c.user_id),
+        )
+    )
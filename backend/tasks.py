@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete as sa_delete, update as sa_update, tuple_, bindparam, exists
+from sqlalchemy.future import select
+from .database import AsyncSessionLocal, engine
+from .models import Chat, ChatParticipant, ChatBlob, Message, SyncEvent
+from .jobs import job_queue, JOB_WORKERS
+from .blobs import blob_store, lock as lock_blobs, BLOB_GC_GRACE, BLOB_GC_INTERVAL
+from .archive import message_archive
+from .redis_client import redis_client
+from .unread import unread
+from .sync import SYNC_RETENTION_DAYS
+from . import ciphertext, etags
+
+# Job handlers for backend/jobs.py.
+#
+# Imported by the app (and by the standalone worker below) so the handlers
+# are registered before any worker starts:
+#
+#   python -m backend.tasks                      run JOB_WORKERS workers until stopped
+#   python -m backend.tasks --stats              print queue depth and counters
+#   python -m backend.tasks --convert-ciphertext start a new conversion pass
+
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+DELETED_CHAT_SWEEP_INTERVAL = float(os.getenv("DELETED_CHAT_SWEEP_INTERVAL", "600"))
+CIPHERTEXT_BATCH_SIZE = int(os.getenv("CIPHERTEXT_BATCH_SIZE", "500"))
+CIPHERTEXT_CONVERT_INTERVAL = float(os.getenv("CIPHERTEXT_CONVERT_INTERVAL", "3600"))
+# Hash: after (last message id handled), converted (rows converted by this
+# pass so far), done (set once a whole pass found nothing left to convert)
+CIPHERTEXT_PROGRESS_KEY = "jobs:convert_ciphertext"
+UNREAD_RECONCILE_INTERVAL = float(os.getenv("UNREAD_RECONCILE_INTERVAL", "3600"))
+UNREAD_RECONCILE_BATCH = int(os.getenv("UNREAD_RECONCILE_BATCH", "100"))
+SYNC_PRUNE_INTERVAL = float(os.getenv("SYNC_PRUNE_INTERVAL", "3600"))
+
+
+@job_queue.handler("purge_chat")
+async def purge_chat(job):
+    # Removes a soft-deleted chat for good. Messages go in bounded batches,
+    # one short transaction each, so no lock is held for long; re-running
+    # after a crash picks up where the last batch left off.
+    chat_id = job.payload["chat_id"]
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Chat.deleted_at).where(Chat.id == chat_id))
+        row = result.first()
+    if row is not None and row.deleted_at is None:
+        return  # not deleted (anymore): nothing to purge
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            batch = select(Message.id, Message.created_at).where(Message.chat_id == chat_id).limit(PURGE_BATCH_SIZE)
+            result = await db.execute(
+                sa_delete(Message)
+                .where(tuple_(Message.id, Message.created_at).in_(batch))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        if result.rowcount < PURGE_BATCH_SIZE:
+            break
+        await job.heartbeat()
+
+    # The stored files are left to collect_blobs: they may belong to other chats
+    async with AsyncSessionLocal() as db:
+        await db.execute(sa_delete(ChatBlob).where(ChatBlob.chat_id == chat_id))
+        await db.execute(sa_delete(ChatParticipant).where(ChatParticipant.chat_id == chat_id))
+        await db.execute(sa_delete(Chat).where(Chat.id == chat_id))
+        await db.commit()
+    await message_archive.delete_chat(chat_id)
+
+
+@job_queue.handler("sweep_deleted_chats")
+async def sweep_deleted_chats(job):
+    # Catches deleted chats whose purge job was never enqueued (Redis down at
+    # delete time) or ended up dead; purging twice is harmless
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=DELETED_CHAT_SWEEP_INTERVAL)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Chat.id).where(Chat.deleted_at < cutoff))
+        chat_ids = result.scalars().all()
+    for chat_id in chat_ids:
+        await job_queue.enqueue("purge_chat", {"chat_id": chat_id})
+
+
+job_queue.every("sweep_deleted_chats", DELETED_CHAT_SWEEP_INTERVAL)
+
+
+def _unreferenced_uploads():
+    # chat_blobs rows no message in their chat refers to
+    return ~exists().where(
+        Message.chat_id == ChatBlob.chat_id, Message.blob_id == ChatBlob.blob_id
+    )
+
+
+async def _collect_files(db, blob_ids):
+    # Removes the files of blobs no chat_blobs row refers to, re-checked
+    # under the exclusive lock so a concurrent upload either keeps its file
+    # or sees it gone and asks the client to retry
+    result = await db.execute(select(ChatBlob.blob_id).where(ChatBlob.blob_id.in_(blob_ids)))
+    candidates = set(blob_ids) - set(result.scalars().all())
+    if candidates:
+        await lock_blobs(db, candidates, shared=False)
+        result = await db.execute(select(ChatBlob.blob_id).where(ChatBlob.blob_id.in_(candidates)))
+        for blob_id in candidates - set(result.scalars().all()):
+            await blob_store.delete(blob_id)
+    await db.commit()  # releases the locks
+
+
+@job_queue.handler("collect_blobs")
+async def collect_blobs(job):
+    # 1. Uploads no message uses (never sent, or their messages deleted),
+    # once past the grace period. Rows from before the archive boundary
+    # stay: archived messages may use them and aren't checked here.
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=BLOB_GC_GRACE)
+    while True:
+        async with AsyncSessionLocal() as db:
+            boundary = await message_archive.boundary(db)
+            stmt = (
+                select(ChatBlob.chat_id, ChatBlob.blob_id)
+                .where(ChatBlob.created_at < cutoff, _unreferenced_uploads())
+                .limit(PURGE_BATCH_SIZE)
+            )
+            if boundary is not None:
+                stmt = stmt.where(ChatBlob.created_at >= boundary)
+            rows = (await db.execute(stmt)).all()
+            if rows:
+                # A send holding the blob's lock has committed its message
+                # by the time we get it; the DELETE re-checks from there
+                await lock_blobs(db, [blob_id for _, blob_id in rows], shared=False)
+                await db.execute(
+                    sa_delete(ChatBlob)
+                    .where(tuple_(ChatBlob.chat_id, ChatBlob.blob_id).in_([tuple(r) for r in rows]), _unreferenced_uploads())
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        if len(rows) < PURGE_BATCH_SIZE:
+            break
+        await job.heartbeat()
+
+    # 2. Files no chat_blobs row refers to, written before the grace period
+    older_than = cutoff.timestamp()
+    batch = []
+    async for blob_id in blob_store.ids(older_than):
+        batch.append(blob_id)
+        if len(batch) >= PURGE_BATCH_SIZE:
+            async with AsyncSessionLocal() as db:
+                await _collect_files(db, batch)
+            await job.heartbeat()
+            batch = []
+    if batch:
+        async with AsyncSessionLocal() as db:
+            await _collect_files(db, batch)
+
+
+job_queue.every("collect_blobs", BLOB_GC_INTERVAL)
+
+
+@job_queue.handler("convert_ciphertext")
+async def convert_ciphertext(job):
+    # Moves text bodies written before MESSAGE_STORAGE=binary into the bytea
+    # columns. Walks the primary key in id order, one short transaction per
+    # batch, and saves its position after each, so a retried or overlapping
+    # run continues instead of starting over. Each row is only rewritten if
+    # its content is still what was read.
+    #
+    # Ids are random, so rows written behind the cursor while a pass runs
+    # (instances still on text storage during the rollout) are missed by
+    # it. A pass that converted anything is followed by another one, from
+    # the next scheduled run; done is only set after a pass that found
+    # nothing to convert.
+    if not ciphertext.BINARY_STORAGE:
+        return
+    progress = await redis_client.hgetall(CIPHERTEXT_PROGRESS_KEY)
+    if progress.get("done"):
+        return
+    after = progress.get("after", "")
+    converted = int(progress.get("converted", 0))
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Message.id, Message.created_at, Message.content)
+                .where(Message.id > after, Message.content.isnot(None))
+                .order_by(Message.id)
+                .limit(CIPHERTEXT_BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            updates = []
+            for row in rows:
+                parts = ciphertext.split(row.content)
+                if parts is not None:
+                    updates.append({
+                        "b_id": row.id, "b_at": row.created_at, "b_content": row.content,
+                        "b_iv": parts[0], "b_ciphertext": parts[1],
+                    })
+            if updates:
+                await db.execute(
+                    sa_update(Message.__table__)
+                    .where(
+                        Message.id == bindparam("b_id"),
+                        Message.created_at == bindparam("b_at"),
+                        Message.content == bindparam("b_content"),
+                    )
+                    .values(content=None, iv=bindparam("b_iv"), ciphertext=bindparam("b_ciphertext")),
+                    updates,
+                )
+                await db.commit()
+        after = rows[-1].id
+        converted += len(updates)
+        await redis_client.hset(CIPHERTEXT_PROGRESS_KEY, mapping={"after": after, "converted": converted})
+        await job.heartbeat()
+
+    if converted:
+        await redis_client.hset(CIPHERTEXT_PROGRESS_KEY, mapping={"after": "", "converted": 0})
+    else:
+        await redis_client.hset(CIPHERTEXT_PROGRESS_KEY, "done", 1)
+
+if ciphertext.BINARY_STORAGE:
+    job_queue.every("convert_ciphertext", CIPHERTEXT_CONVERT_INTERVAL)
+
+
+async def _rebuild_unread(user_ids):
+    async with AsyncSessionLocal() as db:
+        counts = await unread.load(db, user_ids)
+    await unread.store(counts)
+    await etags.bump(user_ids=user_ids)
+
+
+@job_queue.handler("rebuild_unread")
+async def rebuild_unread(job):
+    # Enqueued by the chat list for a user whose counters are missing
+    await _rebuild_unread(job.payload["user_ids"])
+
+
+@job_queue.handler("reconcile_unread")
+async def reconcile_unread(job):
+    # Rebuilds the counter hash of every user with a chat from Postgres, a
+    # batch of users per query, walking ix_chat_participants_user_id. Undoes
+    # drift from sends and reads that raced each other, and refills the
+    # hashes after Redis was restarted or flushed.
+    after = ""
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ChatParticipant.user_id)
+                .where(ChatParticipant.user_id > after)
+                .distinct()
+                .order_by(ChatParticipant.user_id)
+                .limit(UNREAD_RECONCILE_BATCH)
+            )
+            user_ids = result.scalars().all()
+        if not user_ids:
+            break
+        await _rebuild_unread(user_ids)
+        after = user_ids[-1]
+        await job.heartbeat()
+
+
+job_queue.every("reconcile_unread", UNREAD_RECONCILE_INTERVAL)
+
+
+@job_queue.handler("prune_sync_events")
+async def prune_sync_events(job):
+    # Drops sync events past the retention window, oldest first along
+    # ix_sync_events_created_at, in the same bounded batches as purge_chat
+    cutoff = datetime.now(timezone.utc) - timedelta(days=SYNC_RETENTION_DAYS)
+    while True:
+        async with AsyncSessionLocal() as db:
+            batch = (
+                select(SyncEvent.user_id, SyncEvent.seq)
+                .where(SyncEvent.created_at < cutoff)
+                .order_by(SyncEvent.created_at)
+                .limit(PURGE_BATCH_SIZE)
+            )
+            result = await db.execute(
+                sa_delete(SyncEvent)
+                .where(tuple_(SyncEvent.user_id, SyncEvent.seq).in_(batch))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        if result.rowcount < PURGE_BATCH_SIZE:
+            break
+        await job.heartbeat()
+
+
+job_queue.every("prune_sync_events", SYNC_PRUNE_INTERVAL)
+
+
+async def _main(args):
+    try:
+        if args.stats:
+            for name, value in (await job_queue.stats()).items():
+                print(f"{name:<10} {value}")
+            return
+        if args.convert_ciphertext:
+            await redis_client.delete(CIPHERTEXT_PROGRESS_KEY)
+            print(f"Enqueued convert_ciphertext: {await job_queue.enqueue('convert_ciphertext', {})}")
+            return
+        await job_queue.start(args.workers)
+        print(f"Job workers running: {args.workers}")
+        await asyncio.Event().wait()
+    finally:
+        await job_queue.stop()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Secure Drop background job workers")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1), help="number of concurrent workers")
+    parser.add_argument("--stats", action="store_true", help="show queue depth and counters")
+    parser.add_argument("--convert-ciphertext", action="store_true", help="convert text bodies to bytea from the start")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,132 @@
+from typing import Optional
+from sqlalchemy import and_, or_, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from .models import Chat, ChatParticipant, Message
+from .redis_client import redis_client
+from .jobs import job_queue
+
+# Unread counters in Redis, so the chat list never counts messages.
+#
+#   unread:{user_id}   hash: chat_id -> messages from others past my watermark
+#
+# A hash always holds a "" marker once it has been built from Postgres, and
+# counters are only ever changed in hashes that have it. send_message adds
+# to the other members' counters, reading a chat from the head clears mine,
+# deleting an unread message takes it back off, deleting a chat drops the
+# field. A hash without the marker (new user, Redis restarted or flushed)
+# shows no counts until the rebuild_unread job has filled it; the
+# reconcile_unread job rebuilds every member's hash from Postgres from time
+# to time, correcting drift from writes that raced each other.
+
+UNREAD_KEY = "unread:{}"
+REBUILD_LOCK = "lock:unread:{}"
+LOADED = ""
+
+# KEYS = hashes, ARGV[1] = chat id, ARGV[2] = delta. Counters that drop to
+# zero or below are removed; hashes that aren't loaded are left alone.
+ADD = """
+for _, key in ipairs(KEYS) do
+    if redis.call('HEXISTS', key, '') == 1 then
+        if redis.call('HINCRBY', key, ARGV[1], ARGV[2]) <= 0 then
+            redis.call('HDEL', key, ARGV[1])
+        end
+    end
+end
+return 0
+"""
+
+
+class UnreadCounters:
+    def __init__(self):
+        self._add = redis_client.register_script(ADD)
+        self.hits = 0
+        self.misses = 0
+
+    async def add(self, changes):
+        # changes: (user ids, chat id, delta), applied after the commit
+        changes = [(list(users), chat_id, delta) for users, chat_id, delta in changes if users and delta]
+        if not changes:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for users, chat_id, delta in changes:
+                await self._add(keys=[UNREAD_KEY.format(u) for u in users], args=[chat_id, delta], client=pipe)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Unread counter error: {e}")
+
+    async def clear(self, user_id: str, chat_id: str) -> bool:
+        # True if there was a counter to clear
+        try:
+            return bool(await redis_client.hdel(UNREAD_KEY.format(user_id), chat_id))
+        except Exception as e:
+            print(f"Unread counter error: {e}")
+            return False
+
+    async def chat_deleted(self, chat_id: str, user_ids):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for uid in user_ids:
+                pipe.hdel(UNREAD_KEY.format(uid), chat_id)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Unread counter error: {e}")
+
+    async def counts(self, user_id: str) -> Optional[dict[str, int]]:
+        # chat id -> count (absent = 0), or None while the hash isn't built;
+        # a missing hash schedules its rebuild
+        try:
+            values = await redis_client.hgetall(UNREAD_KEY.format(user_id))
+        except Exception as e:
+            print(f"Unread counter error: {e}")
+            return None
+        if LOADED in values:
+            self.hits += 1
+            return {chat_id: int(n) for chat_id, n in values.items() if chat_id != LOADED}
+        self.misses += 1
+        try:
+            if await redis_client.set(REBUILD_LOCK.format(user_id), 1, nx=True, ex=60):
+                await job_queue.enqueue("rebuild_unread", {"user_ids": [user_id]})
+        except Exception as e:
+            print(f"Unread counter error: {e}")
+        return None
+
+    async def load(self, db: AsyncSession, user_ids) -> dict[str, dict[str, int]]:
+        # The counters from Postgres: one grouped query over the members' chats,
+        # each counted from its watermark along ix_messages_chat_created_id
+        result = await db.execute(
+            select(ChatParticipant.user_id, ChatParticipant.chat_id, func.count(Message.id))
+            .join(Chat, and_(Chat.id == ChatParticipant.chat_id, Chat.deleted_at.is_(None)))
+            .join(Message, and_(
+                Message.chat_id == ChatParticipant.chat_id,
+                Message.sender_id != ChatParticipant.user_id,
+                or_(
+                    ChatParticipant.last_read_at.is_(None),
+                    tuple_(Message.created_at, Message.id)
+                    > tuple_(ChatParticipant.last_read_at, ChatParticipant.last_read_message_id),
+                ),
+            ))
+            .where(ChatParticipant.user_id.in_(list(user_ids)))
+            .group_by(ChatParticipant.user_id, ChatParticipant.chat_id)
+        )
+        counts = {uid: {} for uid in user_ids}
+        for user_id, chat_id, n in result.all():
+            counts[user_id][chat_id] = n
+        return counts
+
+    async def store(self, counts: dict[str, dict[str, int]]):
+        # Replaces each user's hash as a whole
+        pipe = redis_client.pipeline(transaction=True)
+        for user_id, chats in counts.items():
+            key = UNREAD_KEY.format(user_id)
+            pipe.delete(key)
+            pipe.hset(key, mapping={LOADED: 1, **chats})
+            pipe.delete(REBUILD_LOCK.format(user_id))
+        await pipe.execute()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+unread = UnreadCounters()
@@ -0,0 +1,88 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from .redis_client import redis_client
+from .realtime import manager
+
+# In-process cache of authenticated users, keyed by the JWT subject (username).
+#
+# Entries are frozen snapshots, not ORM instances, so they can be shared
+# between requests and sessions safely. Writers call invalidate_user(), which
+# drops the local entry at once and tells every other worker over Redis;
+# the TTL bounds staleness if an invalidation is ever missed.
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+INVALIDATE_CHANNEL = "cache:users:invalidate"
+
+
+@dataclass(frozen=True, slots=True)
+class CachedUser:
+    id: str
+    username: str
+    public_key: Optional[str]
+    is_verified: bool
+    avatar_url: Optional[str]
+    encrypted_private_key: Optional[str]
+    key_salt: Optional[str]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_orm(cls, user) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            public_key=user.public_key,
+            is_verified=user.is_verified,
+            avatar_url=user.avatar_url,
+            encrypted_private_key=user.encrypted_private_key,
+            key_salt=user.key_salt,
+            created_at=user.created_at,
+        )
+
+
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, CachedUser]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedUser]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, user: CachedUser):
+        self._entries[key] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: str):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+manager.on(INVALIDATE_CHANNEL, user_cache.discard)
+
+
+async def invalidate_user(username: str):
+    user_cache.discard(username)
+    try:
+        await redis_client.publish(INVALIDATE_CHANNEL, username)
+    except Exception as e:
+        print(f"User cache invalidation error: {e}")
@@ -0,0 +1,270 @@
+"""Load test / benchmark for the Secure Drop API.
+
+Seeds users, chats and messages through the real API (TOTP codes come from
+pyotp), then hammers the hot endpoints with concurrent async clients and
+reports throughput and p50/p95/p99 latency per endpoint. Results are written
+as JSON so runs can be compared.
+
+By default the ASGI app is driven in-process (needs DATABASE_URL/REDIS_URL
+pointing at local Postgres and Redis); pass --base-url to target a running
+server instead. Requires httpx.
+
+    uv run python bench/load_test.py --users 50 --chats 100 --messages 200
+    python bench/load_test.py --compare bench/results/a.json bench/results/b.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import pyotp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENARIOS = ["get_chats", "get_messages", "send_message", "search_users", "login"]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+async def gather_limited(concurrency, coros):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(coro):
+        async with sem:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+class Seed:
+    def __init__(self):
+        self.users = []   # dicts: username, secret, headers, id
+        self.chats = []   # dicts: id, members (indexes into users)
+
+
+async def register(client, username):
+    r = await client.post("/auth/register", json={"username": username})
+    r.raise_for_status()
+    secret = r.json()["secret"]
+    r = await client.post("/auth/confirm-registration", json={
+        "username": username,
+        "public_key": "bench-public-key",
+        "encrypted_private_key": "bench-encrypted-private-key",
+        "key_salt": "bench-salt",
+        "totp_secret": secret,
+        "totp_code": pyotp.TOTP(secret).now(),
+    })
+    r.raise_for_status()
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    me = (await client.get("/users/me", headers=headers)).json()
+    return {"username": username, "secret": secret, "headers": headers, "id": me["id"]}
+
+
+async def seed(client, args) -> Seed:
+    data = Seed()
+    prefix = f"bench{int(time.time())}"
+    started = time.perf_counter()
+
+    data.users = await gather_limited(args.concurrency, [
+        register(client, f"{prefix}_{i}") for i in range(args.users)
+    ])
+
+    # Distinct random pairs (1:1 chats are unique per pair)
+    pairs = set()
+    max_pairs = args.users * (args.users - 1) // 2
+    while len(pairs) < min(args.chats, max_pairs):
+        a, b = random.sample(range(args.users), 2)
+        pairs.add((min(a, b), max(a, b)))
+
+    async def create_chat(a, b):
+        r = await client.post("/chats", json={"participant_username": data.users[b]["username"]},
+                              headers=data.users[a]["headers"])
+        r.raise_for_status()
+        return {"id": r.json()["id"], "members": (a, b)}
+
+    data.chats = await gather_limited(args.concurrency, [create_chat(a, b) for a, b in pairs])
+
+    async def send(chat, i):
+        sender = data.users[chat["members"][i % 2]]
+        r = await client.post(f"/chats/{chat['id']}/messages", json={
+            "content": f"{os.urandom(12).hex()}:{os.urandom(args.message_bytes).hex()}",
+            "type": "TEXT",
+        }, headers=sender["headers"])
+        r.raise_for_status()
+
+    await gather_limited(args.concurrency, [
+        send(chat, i) for chat in data.chats for i in range(args.messages)
+    ])
+    print(f"Seeded {len(data.users)} users, {len(data.chats)} chats, "
+          f"{len(data.chats) * args.messages} messages in {time.perf_counter() - started:.1f}s")
+    return data
+
+
+def make_request(name, data, args):
+    # Returns a zero-arg coroutine factory for one request of the scenario
+    user = random.choice(data.users)
+    chat = random.choice(data.chats)
+    member = data.users[random.choice(chat["members"])]
+
+    if name == "get_chats":
+        return lambda c: c.get("/chats", headers=user["headers"])
+    if name == "get_messages":
+        return lambda c: c.get(f"/chats/{chat['id']}/messages", headers=member["headers"])
+    if name == "send_message":
+        body = {"content": f"{os.urandom(12).hex()}:{os.urandom(args.message_bytes).hex()}", "type": "TEXT"}
+        return lambda c: c.post(f"/chats/{chat['id']}/messages", json=body, headers=member["headers"])
+    if name == "search_users":
+        term = random.choice(data.users)["username"][: random.randint(3, 12)]
+        return lambda c: c.get("/users", params={"username": term}, headers=user["headers"])
+    if name == "login":
+        body = {"username": user["username"], "totp_code": pyotp.TOTP(user["secret"]).now()}
+        return lambda c: c.post("/auth/login", json=body)
+    raise ValueError(name)
+
+
+async def run_scenario(client, name, data, args):
+    latencies, errors = [], 0
+    requests = [make_request(name, data, args) for _ in range(args.requests)]
+
+    async def one(req):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            r = await req(client)
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        elapsed = (time.perf_counter() - t0) * 1000
+        if ok:
+            latencies.append(elapsed)
+        else:
+            errors += 1
+
+    started = time.perf_counter()
+    await gather_limited(args.concurrency, [one(r) for r in requests])
+    wall = time.perf_counter() - started
+
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies), 2) if latencies else None,
+            "p50": round(percentile(latencies, 50), 2) if latencies else None,
+            "p95": round(percentile(latencies, 95), 2) if latencies else None,
+            "p99": round(percentile(latencies, 99), 2) if latencies else None,
+            "max": round(max(latencies), 2) if latencies else None,
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+async def benchmark(args):
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+        lifespan = None
+    else:
+        # Measure the API, not the limiter (a running server needs RATE_LIMIT_ENABLED=false)
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+        from backend.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+        lifespan = app.router.lifespan_context(app)
+
+    if lifespan:
+        await lifespan.__aenter__()
+    try:
+        async with client:
+            data = await seed(client, args)
+            # Warm-up so connection pools and caches are in steady state
+            for name in args.scenarios:
+                await gather_limited(args.concurrency, [make_request(name, data, args)(client) for _ in range(args.warmup)])
+            results = {}
+            for name in args.scenarios:
+                results[name] = await run_scenario(client, name, data, args)
+                lat = results[name]["latency_ms"]
+                print(f"{name:<14} {results[name]['throughput_rps']:>8} req/s  "
+                      f"p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms  errors {results[name]['errors']}")
+    finally:
+        if lifespan:
+            await lifespan.__aexit__(None, None, None)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "target": args.base_url or "in-process",
+        "params": {k: getattr(args, k) for k in ("users", "chats", "messages", "message_bytes", "requests", "concurrency", "warmup")},
+        "results": results,
+    }
+
+
+def compare(old_path, new_path):
+    old, new = (json.load(open(p)) for p in (old_path, new_path))
+    print(f"{'endpoint':<14} {'rps':>17} {'p50 ms':>17} {'p99 ms':>17}")
+    for name, res in new["results"].items():
+        prev = old["results"].get(name)
+        if not prev:
+            continue
+        cols = []
+        for a, b in ((prev["throughput_rps"], res["throughput_rps"]),
+                     (prev["latency_ms"]["p50"], res["latency_ms"]["p50"]),
+                     (prev["latency_ms"]["p99"], res["latency_ms"]["p99"])):
+            change = f"{(b - a) / a * 100:+.0f}%" if a and b is not None else "n/a"
+            cols.append(f"{b} ({change})")
+        print(f"{name:<14} " + " ".join(f"{c:>17}" for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure Drop API benchmark")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=50, help="messages per chat")
+    parser.add_argument("--message-bytes", type=int, default=64, help="random payload bytes per message")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20, help="warm-up requests per endpoint")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", help="JSON results path (default bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    report = asyncio.run(benchmark(args))
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results",
+        datetime.now().strftime("%Y%m%d-%H%M%S") + ".json",
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,9 @@ import { ChatRoom } from './components/ChatRoom';
 import { Profile } from './components/Profile';
 import { MessageSquare, User as UserIcon } from 'lucide-react';
 import { CryptoService } from './services/crypto';
+import { KeyDirectory } from './services/keys';
+import { Realtime } from './services/realtime';
+import { Outbox, isNetworkError } from './services/outbox';
 
 type View = 'auth' | 'chats' | 'room' | 'profile';
 
@@ -72,7 +75,9 @@ const App: React.FC = () => {
             id: c.id,
             participants: c.participants || [],
             messages: existing ? existing.messages : [], // Persist messages!
+            olderCursor: existing?.olderCursor,
             last_message: c.last_message || null,
+            unread_count: c.unread_count,
             created_at: c.created_at,
           };
         });
@@ -123,6 +128,7 @@ const App: React.FC = () => {
     // We keep keys to allow easy re-login (TOTP only) without recovery password
     localStorage.removeItem('private_key');
     localStorage.removeItem('public_key');
+    Outbox.clear();
     clearAuthToken();
     setCurrentUser(null);
     setChats([]);
@@ -134,8 +140,8 @@ const App: React.FC = () => {
     setActiveChatId(chat.id);
     setView('room');
     try {
-      const msgs = await ApiService.chats.getMessages(chat.id);
-      setChats(prev => prev.map(c => c.id === chat.id ? { ...c, messages: msgs } : c));
+      const page = await ApiService.chats.getMessages(chat.id);
+      setChats(prev => prev.map(c => c.id === chat.id ? { ...c, messages: page.messages, olderCursor: page.nextCursor } : c));
     } catch (e) {
       console.error('Load messages failed', e);
     }
@@ -167,14 +173,33 @@ const App: React.FC = () => {
     if (!currentUser) return;
 
     const poll = async () => {
-      // Always poll to update list (unread status, new messages)
+      // Socket pushes changes; poll only as a fallback while it is down
+      if (Realtime.isOpen()) return;
       await loadChats();
     };
 
+    const unsubscribe = Realtime.subscribe(() => { loadChats(); });
     const interval = setInterval(poll, 4000);
-    return () => clearInterval(interval);
+    return () => { clearInterval(interval); unsubscribe(); };
   }, [currentUser, loadChats]);
 
+  // Send what was queued while offline: now, and whenever the network comes back
+  useEffect(() => {
+    if (!currentUser) return;
+    const flush = async () => { if (await Outbox.flush()) loadChats(); };
+    flush();
+    window.addEventListener('online', flush);
+    return () => window.removeEventListener('online', flush);
+  }, [currentUser, loadChats]);
+
+  // One socket per session
+  useEffect(() => {
+    const token = localStorage.getItem('access_token');
+    if (!currentUser || !token) return;
+    Realtime.connect(token);
+    return () => Realtime.disconnect();
+  }, [currentUser]);
+
   // Effect to assert notifications when chats update
   useEffect(() => {
     if (!currentUser) return;
@@ -200,7 +225,7 @@ const App: React.FC = () => {
             if (newMsg.type === MessageType.TEXT && newMsg.content.includes(':')) {
               try {
                 const myPrivStr = localStorage.getItem('private_key');
-                const otherPubStr = sender?.public_key;
+                const otherPubStr = await KeyDirectory.getOne(sender);
                 if (myPrivStr && otherPubStr) {
                   const myPriv = await CryptoService.importPrivateKey(myPrivStr);
                   const otherPub = await CryptoService.importPublicKey(otherPubStr);
@@ -243,8 +268,15 @@ const App: React.FC = () => {
   // The user likely means "push notifications". Without VAPID, local notifications only work if app is open.
   // We'll stick to basic polling updates for now.
 
-  const handleSendMessage = async (chatId: string, content: string, type: MessageType, replyToId?: string) => {
-    await ApiService.chats.sendMessage(chatId, content, type, replyToId);
+  const handleSendMessage = async (chatId: string, content: string | null, type: MessageType, replyToId?: string, blobId?: string) => {
+    try {
+      await ApiService.chats.sendMessage(chatId, content, type, replyToId, blobId);
+    } catch (e) {
+      // Offline: keep it (already encrypted) for the outbox
+      if (!isNetworkError(e)) throw e;
+      Outbox.add({ chat_id: chatId, content, type, reply_to_id: replyToId, blob_id: blobId });
+      return;
+    }
     // Optimistically update or just wait for poll? ChatRoom polls.
     // We can also update chat list last_message
     if (view === 'chats') loadChats();
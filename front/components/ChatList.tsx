@@ -4,6 +4,7 @@ import { ChatSession, User } from '../types';
 import { Avatar } from './LiquidUI';
 import { ApiService } from '../services/api';
 import { CryptoService } from '../services/crypto';
+import { KeyDirectory } from '../services/keys';
 
 interface ChatListProps {
   chats: ChatSession[];
@@ -55,17 +56,20 @@ export const ChatList: React.FC<ChatListProps> = ({ chats, currentUser, onSelect
       try {
         const myPriv = await CryptoService.importPrivateKey(privateKeyStr);
 
-        for (const chat of chats) {
-          const lastMsg = chat.last_message;
-          if (!lastMsg || !lastMsg.content.includes(':')) continue;
-          if (decryptedPreviews[lastMsg.id]) continue;
+        const pending = chats.filter(chat => chat.last_message?.content?.includes(':') && !decryptedPreviews[chat.last_message.id]);
+        const otherOf = (chat: ChatSession) => chat.participants?.find(p => p.id !== currentUser.id) || chat.participants?.[0];
+        // One request for every key not cached yet
+        const publicKeys = await KeyDirectory.get(pending.map(otherOf));
 
-          const otherUser = chat.participants?.find(p => p.id !== currentUser.id) || chat.participants?.[0];
-          if (!otherUser?.public_key) continue;
+        for (const chat of pending) {
+          const lastMsg = chat.last_message!;
+          const otherUser = otherOf(chat);
+          const otherPubStr = otherUser && publicKeys[otherUser.id];
+          if (!otherPubStr) continue;
 
           try {
             // Expensive deriving?
-            const otherPub = await CryptoService.importPublicKey(otherUser.public_key);
+            const otherPub = await CryptoService.importPublicKey(otherPubStr);
             const sessionKey = await CryptoService.deriveSharedKey(myPriv, otherPub);
 
             const parts = lastMsg.content.split(':');
@@ -197,15 +201,24 @@ export const ChatList: React.FC<ChatListProps> = ({ chats, currentUser, onSelect
                       </span>
                     )}
                   </div>
-                  <p className="text-[13px] text-glass-muted truncate m-0">
-                    {lastMsg
-                      ? (lastMsg.content.includes(':')
-                        ? (decryptedPreviews[lastMsg.id] || '🔒 Сообщение')
-                        : (lastMsg.type === 'IMAGE' ? '📷 Фото' : truncateMsg(lastMsg.content))
-                      )
-                      : (isOnline ? <span className="text-accent-success">В сети</span> : <span>Был(а) {lastSeenText}</span>)
-                    }
-                  </p>
+                  <div className="flex items-center gap-2">
+                    <p className="flex-1 text-[13px] text-glass-muted truncate m-0">
+                      {lastMsg
+                        ? (lastMsg.blob_id || lastMsg.type === 'IMAGE'
+                          ? '📷 Фото'
+                          : lastMsg.content?.includes(':')
+                            ? (decryptedPreviews[lastMsg.id] || '🔒 Сообщение')
+                            : truncateMsg(lastMsg.content || '')
+                        )
+                        : (isOnline ? <span className="text-accent-success">В сети</span> : <span>Был(а) {lastSeenText}</span>)
+                      }
+                    </p>
+                    {!!chat.unread_count && (
+                      <span className="min-w-[20px] h-5 px-1.5 rounded-full bg-accent-primary text-[11px] font-semibold text-white flex items-center justify-center">
+                        {chat.unread_count > 99 ? '99+' : chat.unread_count}
+                      </span>
+                    )}
+                  </div>
                 </div>
                 <button
                   onClick={(e) => handleDelete(e, chat.id)}
@@ -7,12 +7,14 @@ import { MOCK_EMOJIS } from '../constants';
 import { format } from 'date-fns';
 import { ru } from 'date-fns/locale';
 import { CryptoService } from '../services/crypto';
+import { KeyDirectory } from '../services/keys';
+import { Realtime } from '../services/realtime';
 
 interface ChatRoomProps {
   chat: ChatSession;
   currentUser: User;
   onBack: () => void;
-  onSendMessage: (chatId: string, content: string, type: MessageType, replyToId?: string) => void;
+  onSendMessage: (chatId: string, content: string | null, type: MessageType, replyToId?: string, blobId?: string) => void;
   onDeleteChat: (chatId: string) => void;
 }
 
@@ -23,6 +25,12 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
   const [sending, setSending] = useState(false);
   const [messages, setMessages] = useState<Message[]>([]);
   const [rawMessages, setRawMessages] = useState<Message[]>(chat.messages || []);
+  const [olderCursor, setOlderCursor] = useState<string | null>(chat.olderCursor ?? null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const rawRef = useRef(rawMessages);
+  rawRef.current = rawMessages;
+  // Decrypted attachments by blob id; blobs never change, so one download each
+  const blobCache = useRef(new Map<string, string>());
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const pollRef = useRef<ReturnType<typeof setInterval> | null>(null);
@@ -47,7 +55,7 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
           return;
         }
 
-        let otherPubBase64 = otherUser?.public_key;
+        let otherPubBase64 = await KeyDirectory.getOne(otherUser);
         if (!otherPubBase64 || otherPubBase64 === 'undefined' || otherPubBase64.includes('undefined')) {
           setKeyError('Encryption unavailable (Partner keys corrupted)');
           return;
@@ -63,7 +71,7 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
       }
     };
     if (chat && otherUser) initCrypto();
-  }, [chat.id, otherUser?.id]);
+  }, [chat.id, otherUser?.id, otherUser?.key_version]);
 
 
 
@@ -71,61 +79,60 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, []);
 
-  useEffect(() => { scrollToBottom(); }, [messages, scrollToBottom]);
+  // Follow new messages only; loading older pages keeps the view where it is
+  const lastMessageId = messages[messages.length - 1]?.id;
+  useEffect(() => { scrollToBottom(); }, [lastMessageId, scrollToBottom]);
+
+  // Puts a freshly fetched newest page in place of the newest loaded messages.
+  // Older pages stay as long as the page reaches back to them; after a gap
+  // (more new messages than one page) it starts over from this page.
+  const applyHead = useCallback((page: { messages: Message[]; nextCursor: string | null }) => {
+    const prev = rawRef.current;
+    const overlap = page.messages.length ? prev.findIndex(m => m.id === page.messages[0].id) : -1;
+    const next = overlap >= 0 ? [...prev.slice(0, overlap), ...page.messages] : page.messages;
+    if (overlap < 0) setOlderCursor(page.nextCursor);
+    if (JSON.stringify(next) !== JSON.stringify(prev)) setRawMessages(next);
+  }, []);
+
+  const loadOlder = async () => {
+    if (!olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const page = await ApiService.chats.getMessages(chat.id, olderCursor);
+      setRawMessages(prev => [...page.messages.filter(m => !prev.some(p => p.id === m.id)), ...prev]);
+      setOlderCursor(page.nextCursor);
+    } catch { } finally { setLoadingOlder(false); }
+  };
 
   // Poll
   useEffect(() => {
     const poll = async () => {
       try {
-        const newMsgs = await ApiService.chats.getMessages(chat.id);
-        // Compare with RAW chat.messages to see if changed
-        // But chat.messages isn't automatically updated here unless parent updates it.
-        // Yet we use local `messages` state which is decrypted.
-        // Problem: if we pull new messages, they are encrypted. 
-        // We need to decrypt them before comparing or setting?
-        // Or just setChat in parent?
-        // Actually, `ApiService.chats.getMessages` returns array.
-        // We should ideally update the PARENT state (which passes `chat` prop), 
-        // or handle logic here fully. Currently `useEffect [chat.messages]` handles updates.
-        // But polling here only checks difference? 
-        // The previous code did: setMessages(prev => ...).
-        // If we poll, we get ENCRYPTED messages. 
-        // We can't easily compare Encrypted Vs Decrypted in state.
-        // Better strategy: Calls `onPoll` prop? Or just re-run the decryption effect when data comes.
-        // Let's rely on Parent polling or if we stick to local polling:
-        // We fetch encrypted, check if different from *last fetched encrypted* (need ref), then update state -> trigger decrypt effect.
-
-        // Simplified: Just decrypt newly fetched always.
-        // Optimization: Checking last message ID.
-        const lastMsg = newMsgs[newMsgs.length - 1];
-        // We need access to current raw messages to compare? 
-        // Let's just trust `onSendMessage` updates and maybe occasional manual refresh?
-        // The original code had polling. I will keep it but it needs to trigger the Decrypt Effect.
-        // We can set a separate `rawMessages` state?
-        // Refactoring:
-        // 1. `rawMessages` state.
-        // 2. `useEffect([rawMessages, sessionKey])` -> sets `messages` (decrypted).
-        // 3. Polling updates `rawMessages`.
-
-        // DOING THIS NOW:
-        setRawMessages(prev => {
-          const isSame = JSON.stringify(newMsgs) === JSON.stringify(prev);
-          return isSame ? prev : newMsgs;
-        });
+        applyHead(await ApiService.chats.getMessages(chat.id));
       } catch { }
     };
-    pollRef.current = setInterval(poll, 3000);
-    return () => { if (pollRef.current) clearInterval(pollRef.current); };
-  }, [chat.id]);
+    // Refetch as soon as the socket reports a change in this chat;
+    // the interval is only a fallback while the socket is down.
+    const unsubscribe = Realtime.subscribe((event) => {
+      if (event.chat_id === chat.id) poll();
+    });
+    pollRef.current = setInterval(() => { if (!Realtime.isOpen()) poll(); }, 3000);
+    return () => {
+      if (pollRef.current) clearInterval(pollRef.current);
+      unsubscribe();
+    };
+  }, [chat.id, applyHead]);
 
   // 3. Sync with props ONLY if props have messages (initial load or full refresh)
   // Fix for flickering: If parent polling returns chat WITHOUT messages, ignore it.
   useEffect(() => {
     if (chat.messages && chat.messages.length > 0) {
       setRawMessages(chat.messages);
+      setOlderCursor(chat.olderCursor ?? null);
     } else if (rawMessages.length === 0 && chat.messages) {
       // Initial load of empty chat
       setRawMessages(chat.messages);
+      setOlderCursor(chat.olderCursor ?? null);
     }
   }, [chat.messages]);
 
@@ -138,8 +145,16 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
       }
       const decrypted = await Promise.all(rawMessages.map(async (msg) => {
         try {
+          if (msg.blob_id && msg.content === null) {
+            let plain = blobCache.current.get(msg.blob_id);
+            if (plain === undefined) {
+              plain = await CryptoService.decryptBlob(await ApiService.chats.getBlob(chat.id, msg.blob_id), sessionKey);
+              blobCache.current.set(msg.blob_id, plain);
+            }
+            return { ...msg, content: plain };
+          }
           // console.log("Decrypting msg:", msg.id, msg.content);
-          if (msg.content.includes(':')) {
+          if (msg.content?.includes(':')) {
             const [iv, cipher] = msg.content.split(':');
             const plain = await CryptoService.decrypt(cipher, iv, sessionKey);
             // console.log("Decrypted result:", plain);
@@ -186,8 +201,7 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
       setReplyingTo(null);
       // Let polling or parent update handle the rest? 
       // Original code fetched new msgs immediately.
-      const newMsgs = await ApiService.chats.getMessages(chat.id);
-      setRawMessages(newMsgs);
+      applyHead(await ApiService.chats.getMessages(chat.id));
     } finally { setSending(false); }
   };
 
@@ -202,20 +216,16 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
     const reader = new FileReader();
     reader.onloadend = async () => {
       const base64Img = reader.result as string;
-      let contentToSend = base64Img;
-
-      if (sessionKey) {
-        const { cipherText, iv } = await CryptoService.encrypt(base64Img, sessionKey);
-        contentToSend = `${iv}:${cipherText}`;
-      } else {
+      if (!sessionKey) {
         alert("Ошибка шифрования: ключи не согласованы.");
         return;
       }
 
-      await onSendMessage(chat.id, contentToSend, MessageType.IMAGE, replyingTo?.id);
+      // The encrypted image goes to the blob store; the message only references it
+      const { blob_id } = await ApiService.chats.uploadBlob(chat.id, await CryptoService.encryptBlob(base64Img, sessionKey));
+      await onSendMessage(chat.id, null, MessageType.IMAGE, replyingTo?.id, blob_id);
       setReplyingTo(null);
-      const newMsgs = await ApiService.chats.getMessages(chat.id);
-      setRawMessages(newMsgs);
+      applyHead(await ApiService.chats.getMessages(chat.id));
     };
     reader.readAsDataURL(file);
     e.target.value = '';
@@ -313,6 +323,15 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
           </div>
         )}
         <div className="flex flex-col gap-4">
+          {olderCursor && (
+            <button
+              onClick={loadOlder}
+              disabled={loadingOlder}
+              className="self-center text-[11px] text-glass-muted px-3 py-1 rounded-full border border-glass-border hover:bg-glass-highlight transition-colors"
+            >
+              {loadingOlder ? 'Загрузка…' : 'Показать более ранние'}
+            </button>
+          )}
           {messages.map((msg) => {
             const isMe = msg.sender_id === currentUser.id;
             return (
@@ -342,7 +361,7 @@ export const ChatRoom: React.FC<ChatRoomProps> = ({ chat, currentUser, onBack, o
                   >
                     {msg.type === MessageType.TEXT && <p className="whitespace-pre-wrap break-words m-0">{msg.content}</p>}
                     {msg.type === MessageType.EMOJI && <p className="text-4xl m-0">{msg.content}</p>}
-                    {msg.type === MessageType.IMAGE && <img src={msg.content} alt="" className="rounded-xl max-w-full max-h-[240px] object-cover" />}
+                    {msg.type === MessageType.IMAGE && <img src={msg.content ?? undefined} alt="" className="rounded-xl max-w-full max-h-[240px] object-cover" />}
 
                     {/* Actions (Reply/Delete) */}
                     <div className={`absolute top-0 ${isMe ? '-left-16' : '-right-16'} h-full flex items-center gap-2 opacity-0 group-hover:opacity-100 transition-opacity px-2`}>
@@ -36,7 +36,7 @@ export const ApiService = {
             return r.data;
         },
         register: async (username: string) => {
-            const r = await api.post('/auth/register', { username });
+            const r = await api.post('/auth/register', { username, qr_format: 'svg' });
             return r.data;
         },
         confirmRegistration: async (
@@ -74,6 +74,13 @@ export const ApiService = {
         updateMe: async (data: { username?: string; avatar_url?: string }) => {
             const r = await api.put<User>('/users/me', data);
             return r.data;
+        },
+        // Public keys for many users; passing the known key versions makes the response cacheable for good
+        keys: async (ids: string[], versions?: string[]) => {
+            const params: Record<string, string> = { ids: ids.join(',') };
+            if (versions) params.v = versions.join(',');
+            const r = await api.get<{ id: string; public_key: string | null; key_version: string | null }[]>('/users/keys', { params });
+            return r.data;
         }
     },
     chats: {
@@ -89,12 +96,30 @@ export const ApiService = {
             const r = await api.delete(`/chats/${chatId}`);
             return r.data;
         },
-        getMessages: async (chatId: string) => {
-            const r = await api.get<Message[]>(`/chats/${chatId}/messages`);
+        // One page of history, oldest -> newest: the newest page, or the one just
+        // before `before`. nextCursor (X-Next-Cursor) goes further back; null at the start of the chat.
+        getMessages: async (chatId: string, before?: string) => {
+            const r = await api.get<Message[]>(`/chats/${chatId}/messages`, { params: before ? { before } : undefined });
+            return { messages: r.data, nextCursor: (r.headers['x-next-cursor'] as string | undefined) ?? null };
+        },
+        sendMessage: async (chatId: string, content: string | null, type: MessageType, replyToId?: string, blobId?: string) => {
+            const response = await api.post(`/chats/${chatId}/messages`, { content, type, reply_to_id: replyToId, blob_id: blobId });
+            return response.data;
+        },
+        // Encrypted attachment bytes; the returned blob_id goes into sendMessage
+        uploadBlob: async (chatId: string, data: Blob) => {
+            const r = await api.post<{ blob_id: string; size: number }>(`/chats/${chatId}/blobs`, data, {
+                headers: { 'Content-Type': 'application/octet-stream' },
+            });
+            return r.data;
+        },
+        getBlob: async (chatId: string, blobId: string) => {
+            const r = await api.get<ArrayBuffer>(`/chats/${chatId}/blobs/${blobId}`, { responseType: 'arraybuffer' });
             return r.data;
         },
-        sendMessage: async (chatId: string, content: string, type: MessageType, replyToId?: string) => {
-            const response = await api.post(`/chats/${chatId}/messages`, { content, type, reply_to_id: replyToId });
+        // Flush queued messages (any chats) in one request; results come back per item, in order (see services/outbox.ts)
+        sendMessages: async (messages: { chat_id: string; content: string | null; type: MessageType; reply_to_id?: string; blob_id?: string }[]) => {
+            const response = await api.post('/chats/messages/batch', { messages });
             return response.data;
         },
 
@@ -93,6 +93,26 @@ export class CryptoService {
     };
   }
 
+  // Attachments (uploaded as blobs): raw bytes, the 12-byte IV followed by the ciphertext
+  static async encryptBlob(content: string, key: CryptoKey): Promise<Blob> {
+    const iv = window.crypto.getRandomValues(new Uint8Array(12));
+    const encrypted = await window.crypto.subtle.encrypt(
+      { name: "AES-GCM", iv: iv },
+      key,
+      new TextEncoder().encode(content)
+    );
+    return new Blob([iv, encrypted], { type: "application/octet-stream" });
+  }
+
+  static async decryptBlob(data: ArrayBuffer, key: CryptoKey): Promise<string> {
+    const decrypted = await window.crypto.subtle.decrypt(
+      { name: "AES-GCM", iv: data.slice(0, 12) },
+      key,
+      data.slice(12)
+    );
+    return new TextDecoder().decode(decrypted);
+  }
+
   static async decrypt(cipherText: string, iv: string, key: CryptoKey): Promise<string> {
     const encryptedBuffer = this.base64ToArrayBuffer(cipherText);
     const ivBuffer = this.base64ToArrayBuffer(iv);
@@ -0,0 +1,43 @@
+import { ApiService } from './api';
+import { User } from '../types';
+
+// Public keys of other users, kept in localStorage by key version.
+// The chat list only carries key_version; a key is fetched (in one batch
+// per call) the first time a version is seen and then never again.
+
+const PREFIX = 'pubkey:';
+
+const storageKey = (id: string, version: string) => `${PREFIX}${id}:${version}`;
+
+export const KeyDirectory = {
+    // id -> base64 public key, for the users whose key is known
+    get: async (users: (User | undefined)[]): Promise<Record<string, string>> => {
+        const keys: Record<string, string> = {};
+        const missing: User[] = [];
+        for (const user of users) {
+            if (!user?.key_version || keys[user.id]) continue;
+            const cached = localStorage.getItem(storageKey(user.id, user.key_version));
+            if (cached) keys[user.id] = cached;
+            else if (!missing.some(u => u.id === user.id)) missing.push(user);
+        }
+        if (missing.length === 0) return keys;
+
+        const fetched = await ApiService.users.keys(missing.map(u => u.id), missing.map(u => u.key_version!));
+        for (const entry of fetched) {
+            if (!entry.public_key || !entry.key_version) continue;
+            keys[entry.id] = entry.public_key;
+            // Drop the user's superseded keys
+            for (let i = localStorage.length - 1; i >= 0; i--) {
+                const k = localStorage.key(i);
+                if (k?.startsWith(`${PREFIX}${entry.id}:`)) localStorage.removeItem(k);
+            }
+            localStorage.setItem(storageKey(entry.id, entry.key_version), entry.public_key);
+        }
+        return keys;
+    },
+
+    getOne: async (user: User | undefined): Promise<string | undefined> => {
+        if (!user) return undefined;
+        return (await KeyDirectory.get([user]))[user.id];
+    },
+};
@@ -0,0 +1,66 @@
+// Messages that couldn't be sent because the network was down.
+// They wait in localStorage, already encrypted, and go out in order through
+// POST /chats/messages/batch once the browser is back online.
+
+import { ApiService } from './api';
+import { MessageType } from '../types';
+
+export interface OutboxItem {
+    chat_id: string;
+    content: string | null;
+    type: MessageType;
+    reply_to_id?: string;
+    blob_id?: string;
+}
+
+const KEY = 'outbox';
+// Server limit per batch request
+const BATCH_SIZE = 100;
+
+const load = (): OutboxItem[] => {
+    try { return JSON.parse(localStorage.getItem(KEY) || '[]'); } catch { return []; }
+};
+
+const save = (items: OutboxItem[]) => {
+    if (items.length) localStorage.setItem(KEY, JSON.stringify(items));
+    else localStorage.removeItem(KEY);
+};
+
+// No response at all: offline or the server unreachable, worth queueing
+export const isNetworkError = (e: any) => !!e?.isAxiosError && !e.response;
+
+let flushing: Promise<boolean> | null = null;
+
+export const Outbox = {
+    add: (item: OutboxItem) => save([...load(), item]),
+    clear: () => localStorage.removeItem(KEY),
+    // Sends everything queued, oldest first; true if anything went out.
+    // Items the server rejects are dropped (they would only fail again);
+    // on a network error the rest stays for the next flush.
+    flush: () => {
+        if (!flushing) {
+            flushing = (async () => {
+                let sent = false;
+                try {
+                    let batch = load().slice(0, BATCH_SIZE);
+                    while (batch.length) {
+                        const results: { ok: boolean; error?: string }[] = await ApiService.chats.sendMessages(batch);
+                        results.forEach((r, i) => {
+                            if (!r.ok) console.warn(`Queued message for chat ${batch[i].chat_id} rejected: ${r.error}`);
+                        });
+                        // Re-read: messages may have been queued meanwhile
+                        save(load().slice(batch.length));
+                        sent = true;
+                        batch = load().slice(0, BATCH_SIZE);
+                    }
+                } catch (e) {
+                    if (!isNetworkError(e)) console.error('Outbox flush failed', e);
+                } finally {
+                    flushing = null;
+                }
+                return sent;
+            })();
+        }
+        return flushing;
+    },
+};
@@ -0,0 +1,82 @@
+// Real-time events from the backend `/ws` endpoint.
+// While the socket is open, components can skip their polling loops and
+// refetch only when an event for them arrives.
+
+export interface RealtimeEvent {
+    type: string;
+    chat_id?: string;
+    [key: string]: any;
+}
+
+type Listener = (event: RealtimeEvent) => void;
+
+const listeners = new Set<Listener>();
+let socket: WebSocket | null = null;
+let ready = false;
+let token: string | null = null;
+let retryTimer: ReturnType<typeof setTimeout> | null = null;
+let pingTimer: ReturnType<typeof setInterval> | null = null;
+let retryDelay = 1000;
+
+// Close code the server uses for a missing, invalid or expired token
+const POLICY_VIOLATION = 1008;
+
+const open = () => {
+    if (!token) return;
+    const proto = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    // The token goes in the first message, not the URL, so it stays out of access logs
+    const ws = new WebSocket(`${proto}//${window.location.host}/ws`);
+    const wsToken = token;
+    socket = ws;
+
+    ws.onopen = () => {
+        ws.send(JSON.stringify({ type: 'auth', token: wsToken }));
+    };
+    ws.onmessage = (e) => {
+        if (e.data === 'pong') return;
+        try {
+            const event = JSON.parse(e.data) as RealtimeEvent;
+            if (event.type === 'ready') {
+                ready = true;
+                retryDelay = 1000;
+                pingTimer = setInterval(() => ws.readyState === WebSocket.OPEN && ws.send('ping'), 25000);
+                return;
+            }
+            listeners.forEach(fn => fn(event));
+        } catch { }
+    };
+    ws.onclose = (e) => {
+        if (pingTimer) clearInterval(pingTimer);
+        pingTimer = null;
+        if (socket !== ws) return; // replaced or disconnected on purpose
+        socket = null;
+        ready = false;
+        // Rejected or expired token: retrying with it is pointless; the next
+        // API call gets a 401 and sends the user back to login
+        if (e.code === POLICY_VIOLATION) return;
+        retryTimer = setTimeout(open, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, 30000);
+    };
+};
+
+export const Realtime = {
+    connect: (accessToken: string) => {
+        Realtime.disconnect();
+        token = accessToken;
+        open();
+    },
+    disconnect: () => {
+        token = null;
+        if (retryTimer) clearTimeout(retryTimer);
+        retryTimer = null;
+        const ws = socket;
+        socket = null;
+        ready = false;
+        ws?.close();
+    },
+    isOpen: () => ready && socket?.readyState === WebSocket.OPEN,
+    subscribe: (fn: Listener) => {
+        listeners.add(fn);
+        return () => { listeners.delete(fn); };
+    },
+};
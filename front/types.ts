@@ -10,6 +10,7 @@ export interface User {
   id: string;
   username: string;
   public_key?: string;
+  key_version?: string | null;
   avatar_url?: string;
   is_verified?: boolean;
   is_online?: boolean;
@@ -22,15 +23,16 @@ export interface Message {
   id: string;
   chat_id?: string;
   sender_id: string;
-  content: string;
+  content: string | null; // null when the body is the attachment (blob_id)
   type: MessageType;
   created_at: string;
   read_at?: string | null;
+  blob_id?: string | null;
   status?: 'SENT' | 'DELIVERED' | 'READ';
   reply_to_id?: string;
   reply_to?: {
     id: string;
-    content: string;
+    content: string | null;
     sender_id: string;
     type: MessageType;
   };
@@ -38,8 +40,9 @@ export interface Message {
 
 export interface LastMessage {
   id: string;
-  content: string;
+  content: string | null;
   type: string;
+  blob_id?: string | null;
   sender_id: string;
   created_at: string;
 }
@@ -48,6 +51,9 @@ export interface ChatSession {
   id: string;
   participants: User[];
   messages: Message[];
+  // Cursor for the page before `messages`; null once the start of the chat is loaded
+  olderCursor?: string | null;
   last_message: LastMessage | null;
+  unread_count?: number | null;
   created_at: string;
 }
\ No newline at end of file
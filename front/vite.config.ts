@@ -48,7 +48,9 @@ export default defineConfig({
     proxy: {
       '/auth': { target: 'http://localhost:8000', changeOrigin: true },
       '/users': { target: 'http://localhost:8000', changeOrigin: true },
-      '/chats': { target: 'http://localhost:8000', changeOrigin: true }
+      '/chats': { target: 'http://localhost:8000', changeOrigin: true },
+      '/sync': { target: 'http://localhost:8000', changeOrigin: true },
+      '/ws': { target: 'ws://localhost:8000', ws: true }
     }
   }
 });
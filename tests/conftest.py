@@ -0,0 +1,26 @@
+import os
+
+import fakeredis
+import pytest
+
+# Importing backend modules builds the engines and the Redis client; neither
+# connects until used, and the tests swap Redis for an in-memory fake
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://test@localhost/test")
+os.environ.setdefault("SECRET_KEY", "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def redis(monkeypatch):
+    # A fresh fake per test, patched into every module that holds the client
+    from backend import etags, jobs, unread
+
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    for module in (etags, jobs, unread):
+        monkeypatch.setattr(module, "redis_client", client)
+    yield client
+    await client.aclose()
@@ -0,0 +1,53 @@
+import base64
+
+import pytest
+
+from backend import ciphertext
+
+IV = bytes(range(12))
+BODY = b"\x00encrypted\xffbody"
+CONTENT = base64.b64encode(IV).decode() + ":" + base64.b64encode(BODY).decode()
+
+
+def test_split_join_round_trip():
+    assert ciphertext.split(CONTENT) == (IV, BODY)
+    assert ciphertext.join(IV, BODY) == CONTENT
+
+
+@pytest.mark.parametrize("content", [
+    None,
+    "",
+    "😀",
+    "plain text",
+    "a:b:c",
+    ":" + base64.b64encode(BODY).decode(),
+    base64.b64encode(IV).decode() + ":",
+    "not base64!:" + base64.b64encode(BODY).decode(),
+    # Decodes, but re-encodes differently: storing bytes would change it
+    "QUJ=:QUI=",
+    "QUJD:QUI=\n",
+])
+def test_split_keeps_anything_else_as_text(content):
+    assert ciphertext.split(content) is None
+
+
+def test_columns(monkeypatch):
+    monkeypatch.setattr(ciphertext, "BINARY_STORAGE", False)
+    assert ciphertext.columns(CONTENT) == {"content": CONTENT, "iv": None, "ciphertext": None}
+    monkeypatch.setattr(ciphertext, "BINARY_STORAGE", True)
+    assert ciphertext.columns(CONTENT) == {"content": None, "iv": IV, "ciphertext": BODY}
+    assert ciphertext.columns("😀") == {"content": "😀", "iv": None, "ciphertext": None}
+
+
+def test_text_from_either_storage():
+    assert ciphertext.text(CONTENT, None, None) == CONTENT
+    assert ciphertext.text(None, IV, BODY) == CONTENT
+    assert ciphertext.text(None, None, None) is None
+
+
+def test_fields():
+    # JSON always carries content; msgpack gets raw bytes for encrypted pairs
+    assert ciphertext.fields(None, IV, BODY, binary=False) == {"content": CONTENT}
+    assert ciphertext.fields(CONTENT, None, None, binary=True) == {"content": None, "iv": IV, "ciphertext": BODY}
+    assert ciphertext.fields(None, memoryview(IV), memoryview(BODY), binary=True) == {"content": None, "iv": IV, "ciphertext": BODY}
+    assert ciphertext.fields("😀", None, None, binary=True) == {"content": "😀"}
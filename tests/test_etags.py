@@ -0,0 +1,74 @@
+import time
+
+import pytest
+from starlette.requests import Request
+
+from backend import etags
+
+pytestmark = pytest.mark.anyio
+
+
+def request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_make_etag_is_weak_and_stable():
+    tag = etags.make_etag([1, 2], "user", "chat")
+    assert tag.startswith('W/"')
+    assert tag == etags.make_etag([1, 2], "user", "chat")
+    assert tag != etags.make_etag([1, 3], "user", "chat")
+    assert tag != etags.make_etag([1, 2], "user", "other")
+
+
+def test_no_markers_no_etag():
+    assert etags.make_etag(None, "user") is None
+
+
+def test_fresh_markers_no_etag_with_replica(monkeypatch):
+    # The replica may not have a change this recent yet
+    monkeypatch.setattr(etags, "replica_engine", object())
+    assert etags.make_etag([time.time_ns()], "user") is None
+    assert etags.make_etag([time.time_ns() - 3600 * 10**9], "user") is not None
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('W/"abc"', True),
+    ('"abc"', True),
+    ('W/"old", W/"abc"', True),
+    ("*", True),
+    ('W/"old"', False),
+])
+def test_not_modified(header, expected):
+    assert etags.not_modified(request(header), 'W/"abc"') is expected
+
+
+def test_not_modified_without_etag():
+    assert not etags.not_modified(request("*"), None)
+
+
+async def test_versions_start_tracking_on_first_read(redis):
+    key = etags.CHAT_VERSION.format("c1")
+    assert await etags.versions(key) is None
+    first = await etags.versions(key)
+    assert first is not None
+    assert await etags.versions(key) == first
+    assert await redis.ttl(key) > 0
+
+
+async def test_bump_changes_the_etag(redis):
+    key = etags.CHAT_LIST_VERSION.format("u1")
+    await etags.versions(key)
+    before = etags.make_etag(await etags.versions(key), "u1")
+    version = await etags.bump(user_ids=["u1"])
+    assert await etags.versions(key) == [version]
+    assert etags.make_etag(await etags.versions(key), "u1") != before
+
+
+async def test_versions_without_redis(monkeypatch):
+    class Down:
+        async def mget(self, keys):
+            raise ConnectionError("down")
+    monkeypatch.setattr(etags, "redis_client", Down())
+    assert await etags.versions("k") is None
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from backend import jobs
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def queue(redis, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_BACKOFF", 0)
+    return jobs.JobQueue(workers=0, poll_interval=0.01, visibility_timeout=60)
+
+
+async def counters(redis):
+    return {name: int(n) for name, n in (await redis.hgetall(jobs.STATS_KEY)).items()}
+
+
+async def test_claim_and_complete(queue, redis):
+    job_id = await queue.enqueue("purge", {"chat_id": "c1"})
+    job = await queue.claim()
+    assert (job.id, job.type, job.payload, job.attempts) == (job_id, "purge", {"chat_id": "c1"}, 1)
+    assert await queue.claim() is None
+    await queue.complete(job)
+    assert not await redis.exists(jobs.JOB_KEY.format(job_id))
+    assert await redis.zcard(jobs.RUNNING_KEY) == 0
+    assert await counters(redis) == {"enqueued": 1, "completed": 1}
+
+
+async def test_failure_retries_then_dead_letters(queue, redis):
+    job_id = await queue.enqueue("purge", {}, max_attempts=2)
+    job = await queue.claim()
+    await queue.fail(job, "boom")
+    assert await redis.zscore(jobs.DELAYED_KEY, job_id) is not None
+
+    job = await queue.claim()  # the retry is due at once with no backoff
+    assert job.attempts == 2
+    await queue.fail(job, "boom again")
+    assert await redis.lrange(jobs.DEAD_KEY, 0, -1) == [job_id]
+    assert await redis.hget(jobs.JOB_KEY.format(job_id), "error") == "boom again"
+    assert (await counters(redis))["retried"] == 1
+    assert (await counters(redis))["dead_lettered"] == 1
+    stats = await queue.stats()
+    assert stats["dead"] == 1 and stats["dead_lettered"] == 1
+
+
+async def test_run_dispatches_to_the_handler(queue, redis):
+    seen = []
+
+    @queue.handler("echo")
+    async def echo(job):
+        seen.append(job.payload)
+
+    await queue.enqueue("echo", {"n": 1})
+    await queue._run(await queue.claim())
+    assert seen == [{"n": 1}]
+    assert (await counters(redis))["completed"] == 1
+
+
+async def test_expired_claim_belongs_to_the_new_claimant(queue, redis):
+    queue.visibility_timeout = 0.05
+    job_id = await queue.enqueue("purge", {})
+    stale = await queue.claim()
+    await asyncio.sleep(0.1)
+    current = await queue.claim()
+    assert current.id == job_id and current.claim != stale.claim
+
+    # The first worker finishing late changes nothing
+    assert not await stale.heartbeat()
+    await queue.complete(stale)
+    await queue.fail(stale, "late")
+    assert await redis.exists(jobs.JOB_KEY.format(job_id))
+    assert await redis.zscore(jobs.RUNNING_KEY, job_id) is not None
+    assert await redis.zcard(jobs.DELAYED_KEY) == 0
+
+    assert await current.heartbeat()
+    await queue.complete(current)
+    assert not await redis.exists(jobs.JOB_KEY.format(job_id))
+
+
+async def test_expired_claim_without_attempts_left_is_dead(queue, redis):
+    queue.visibility_timeout = 0.05
+    job_id = await queue.enqueue("purge", {}, max_attempts=1)
+    await queue.claim()
+    await asyncio.sleep(0.1)
+    assert await queue.claim() is None
+    assert await redis.lrange(jobs.DEAD_KEY, 0, -1) == [job_id]
+    assert (await counters(redis))["dead_lettered"] == 1
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from backend.pagination import decode_cursor, decode_time_cursor, encode_cursor
+
+
+def test_time_cursor_round_trip():
+    created_at = datetime(2026, 3, 1, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    cursor = encode_cursor(created_at, "m-1")
+    assert decode_time_cursor(cursor) == (created_at, "m-1")
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor(datetime(2026, 1, 1, tzinfo=timezone.utc), "a+b/c?")
+    assert "=" not in cursor
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+
+
+def test_decode_cursor_returns_parts():
+    assert decode_cursor(encode_cursor(1, "x", None), 3) == [1, "x", None]
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor("only-one"), encode_cursor(1, 2, 3)])
+def test_malformed_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_time_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize("parts", [("yesterday", "m-1"), (None, "m-1"), (42, "m-1")])
+def test_bad_timestamp_is_400(parts):
+    with pytest.raises(HTTPException) as e:
+        decode_time_cursor(encode_cursor(*parts))
+    assert e.value.status_code == 400
@@ -0,0 +1,57 @@
+import pytest
+
+from backend import jobs, unread as unread_module
+from backend.unread import LOADED, REBUILD_LOCK, UNREAD_KEY, UnreadCounters
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def unread(redis, monkeypatch):
+    monkeypatch.setattr(unread_module, "job_queue", jobs.JobQueue(0, 0.01, 60))
+    return UnreadCounters()
+
+
+async def test_add_only_touches_loaded_hashes(unread, redis):
+    await unread.store({"u1": {}})
+    await unread.add([(["u1", "u2"], "c1", 2), (["u1"], "c2", 1)])
+    assert await unread.counts("u1") == {"c1": 2, "c2": 1}
+    assert not await redis.exists(UNREAD_KEY.format("u2"))
+
+
+async def test_counters_at_zero_are_removed(unread, redis):
+    await unread.store({"u1": {"c1": 2}})
+    await unread.add([(["u1"], "c1", -1)])
+    assert await unread.counts("u1") == {"c1": 1}
+    await unread.add([(["u1"], "c1", -5)])
+    assert await unread.counts("u1") == {}
+    assert await redis.hgetall(UNREAD_KEY.format("u1")) == {LOADED: "1"}
+
+
+async def test_clear(unread):
+    await unread.store({"u1": {"c1": 3, "c2": 1}})
+    assert await unread.clear("u1", "c1")
+    assert not await unread.clear("u1", "c1")
+    assert await unread.counts("u1") == {"c2": 1}
+
+
+async def test_missing_hash_schedules_one_rebuild(unread, redis):
+    assert await unread.counts("u1") is None
+    assert await unread.counts("u1") is None
+    assert await redis.llen(jobs.READY_KEY) == 1
+    assert unread.stats() == {"hits": 0, "misses": 2}
+
+
+async def test_store_replaces_the_hash(unread, redis):
+    await unread.store({"u1": {"c1": 5, "old": 1}})
+    await redis.set(REBUILD_LOCK.format("u1"), 1)
+    await unread.store({"u1": {"c1": 2}})
+    assert await unread.counts("u1") == {"c1": 2}
+    assert not await redis.exists(REBUILD_LOCK.format("u1"))
+
+
+async def test_chat_deleted(unread):
+    await unread.store({"u1": {"c1": 1, "c2": 1}, "u2": {"c1": 4}})
+    await unread.chat_deleted("c1", ["u1", "u2"])
+    assert await unread.counts("u1") == {"c2": 1}
+    assert await unread.counts("u2") == {}
@@ -10,7 +10,7 @@ async def main():
         # 1. Register User 1
         username1 = f"user_{int(datetime.now().timestamp())}"
         print(f"Registering {username1}...")
-        reg_res = await client.post("/auth/register", json={"username": username1, "public_key": "key1"})
+        reg_res = await client.post("/auth/register", json={"username": username1})
         if reg_res.status_code != 200:
             print(f"Registration failed: {reg_res.text}")
             return
@@ -27,6 +27,8 @@ async def main():
         confirm_res = await client.post("/auth/confirm-registration", json={
             "username": username1,
             "public_key": "key1",
+            "encrypted_private_key": "enc1",
+            "key_salt": "salt1",
             "totp_secret": secret1,
             "totp_code": code1
         })
@@ -40,13 +42,15 @@ async def main():
         # 2. Register User 2
         username2 = f"user2_{int(datetime.now().timestamp())}"
         print(f"Registering {username2}...")
-        reg_res2 = await client.post("/auth/register", json={"username": username2, "public_key": "key2"})
+        reg_res2 = await client.post("/auth/register", json={"username": username2})
         secret2 = reg_res2.json()["secret"]
         totp2 = pyotp.TOTP(secret2)
         code2 = totp2.now()
         confirm_res2 = await client.post("/auth/confirm-registration", json={
             "username": username2,
             "public_key": "key2",
+            "encrypted_private_key": "enc2",
+            "key_salt": "salt2",
             "totp_secret": secret2,
             "totp_code": code2
         })